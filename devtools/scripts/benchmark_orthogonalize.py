@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Benchmark of math_utils.orthogonalize, which block_matrix.project_constraint
+calls for every DLC block a constraint (e.g. the string tangent) is
+projected into.
+
+For DLC blocks of increasing size (about 5 primitives per atom and 3N-6
+delocalized coordinates, the eigenvectors of G = B.B^T) with one or more
+constraint vectors in their span, compares the Householder QR based
+orthogonalize with the Gram-Schmidt loop it replaced (reproduced below
+as gram_schmidt_orthogonalize) and checks that both give the same basis.
+
+    python devtools/scripts/benchmark_orthogonalize.py -natoms 20 50 100 200
+"""
+# standard library imports
+import argparse
+import importlib
+import sys
+import time
+from os import path
+
+# third party
+import numpy as np
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', '..'))
+from pyGSM.utilities.block_matrix import block_matrix  # noqa: E402
+from pyGSM.utilities.math_utils import orthogonalize  # noqa: E402
+
+# the module, pyGSM.utilities.block_matrix is the class
+block_matrix_module = importlib.import_module('pyGSM.utilities.block_matrix')
+
+
+def gram_schmidt_orthogonalize(vecs, numCvecs=0):
+    ''' math_utils.orthogonalize before the QR version '''
+    rows = vecs.shape[0]
+    cols = vecs.shape[1]
+    basis = np.zeros((rows, cols-numCvecs))
+    count = 0
+    for v in vecs.T:
+        w = v - sum(np.dot(v, b)*b for b in basis.T)
+        wnorm = np.linalg.norm(w)
+        if wnorm > 1e-3 and (abs(w) > 1e-6).any():
+            basis[:, count] = w/wnorm
+            count += 1
+    dots = np.matmul(basis.T, basis)
+    if not (np.allclose(dots, np.eye(dots.shape[0], dtype=float), atol=1e-4)):
+        raise RuntimeError("error in orthonormality")
+    return basis
+
+
+def dlc_block(natoms, nconstraints, rng):
+    ''' DLC basis of a random Wilson B matrix and constraints in its span '''
+    nprims = 5*natoms
+    B = rng.randn(nprims, 3*natoms)
+    # translations and rotations are not in the span of the primitives
+    B[:, :6] = 0.
+    L, Q = np.linalg.eigh(np.dot(B, B.T))
+    Vecs = Q[:, np.abs(L) > 1e-6]
+    C = np.dot(Vecs, rng.randn(Vecs.shape[1], nconstraints))
+    return Vecs, C/np.linalg.norm(C, axis=0)
+
+
+def timed(function, *args, repeat=3):
+    t0 = time.time()
+    for _ in range(repeat):
+        result = function(*args)
+    return result, (time.time() - t0)/repeat
+
+
+def project(Vecs, C):
+    return block_matrix.project_constraint(block_matrix([Vecs]), C.copy())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-natoms', type=int, nargs='+', default=[20, 50, 100, 200], help='number of atoms')
+    parser.add_argument('-nconstraints', type=int, default=1, help='number of constraint vectors')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    print("{:>8s} {:>12s} {:>12s} {:>12s} {:>12s} {:>12s} {:>10s}".format(
+        'atoms', 'block', 'GS (s)', 'QR (s)', 'GS proj (s)', 'QR proj (s)', 'max diff'))
+    for natoms in args.natoms:
+        Vecs, C = dlc_block(natoms, args.nconstraints, rng)
+        vecs = np.hstack((C, Vecs))
+
+        gs, t_gs = timed(gram_schmidt_orthogonalize, vecs, args.nconstraints)
+        qr, t_qr = timed(orthogonalize, vecs, args.nconstraints)
+
+        # the whole constraint projection with either orthogonalization
+        block_matrix_module.orthogonalize = gram_schmidt_orthogonalize
+        gs_proj, t_gs_proj = timed(project, Vecs, C)
+        block_matrix_module.orthogonalize = orthogonalize
+        qr_proj, t_qr_proj = timed(project, Vecs, C)
+
+        diff = max(np.max(np.abs(gs - qr)), np.max(np.abs(gs_proj.matlist[0] - qr_proj.matlist[0])))
+        print("{:8d} {:>12s} {:12.4f} {:12.4f} {:12.4f} {:12.4f} {:10.1e}".format(
+            natoms, '{}x{}'.format(*vecs.shape), t_gs, t_qr, t_gs_proj, t_qr_proj, diff))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Benchmark of xTB_lot in the calling process and in a ProcessPoolLot.
+
+Computes the energies and gradients of nodes interpolated between the
+first and last frames of an xyz file (by default the Diels-Alder
+reaction), each round with small random displacements as during a string
+optimization, and compares
+    - a new xtb Calculator per calculation (xTB_lot before the calculators
+      were cached, reproduced below as legacy_run)
+    - xTB_lot, one cached Calculator per process and restarts from the last
+      results of the lot
+    - ProcessPoolLot.run_batch over xTB_lot with each number of workers
+and checks that they give the same energies.
+
+    python devtools/scripts/benchmark_process_pool_lot.py -nodes 12 -workers 1 2 4 -repeat 5
+"""
+# standard library imports
+import argparse
+import os
+import sys
+import tempfile
+import time
+from os import path
+
+# third party
+import numpy as np
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', '..'))
+from pyGSM.level_of_theories.process_pool_lot import LotPool, ProcessPoolLot  # noqa: E402
+from pyGSM.level_of_theories.xtb_lot import xTB_lot  # noqa: E402
+from pyGSM.utilities import manage_xyz, units  # noqa: E402
+
+from xtb.interface import Calculator  # noqa: E402
+from xtb.utils import get_method  # noqa: E402
+
+
+def legacy_run(lot, coords):
+    ''' xTB_lot.run before the calculators were cached '''
+    calc = Calculator(get_method(lot.xTB_Hamiltonian), lot.numbers, coords*units.ANGSTROM_TO_AU, charge=lot.charge)
+    calc.set_accuracy(lot.xTB_accuracy)
+    calc.set_electronic_temperature(lot.xTB_electronic_temperature)
+    calc.set_output('lot_jobs_{}.txt'.format(lot.node_id))
+    res = calc.singlepoint()
+    calc.release_output()
+    return res.get_energy()
+
+
+def displaced_nodes(nodes, repeat, scale, rng):
+    ''' repeat rounds of every node, each with a small random displacement '''
+    return [[xyz + scale*rng.randn(*xyz.shape) for xyz in nodes] for _ in range(repeat)]
+
+
+def timed(function, *args):
+    t0 = time.time()
+    result = function(*args)
+    return result, time.time() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-xyzfile', type=str, default=path.join(path.dirname(path.abspath(__file__)), '..', '..', 'pyGSM', 'data', 'diels_alder.xyz'),
+                        help='reactant and product')
+    parser.add_argument('-nodes', type=int, default=12, help='number of interpolated nodes')
+    parser.add_argument('-workers', type=int, nargs='+', default=[1, 2, 4], help='number of worker processes')
+    parser.add_argument('-repeat', type=int, default=5, help='rounds over all the nodes')
+    parser.add_argument('-scale', type=float, default=0.005, help='size of the random displacements (Angstrom)')
+    args = parser.parse_args()
+
+    geoms = manage_xyz.read_xyzs(path.abspath(args.xyzfile))
+    reactant = manage_xyz.xyz_to_np(geoms[0])
+    product = manage_xyz.xyz_to_np(geoms[-1])
+    frames = [(1. - t)*reactant + t*product for t in np.linspace(0., 1., args.nodes)]
+    rounds = displaced_nodes(frames, args.repeat, args.scale, np.random.RandomState(0))
+    ncalcs = len(frames)*args.repeat
+
+    # the lots write their scratch files to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='benchmark_process_pool_lot_'))
+    lot = xTB_lot.from_options(states=[(1, 0)], gradient_states=[(1, 0)], geom=geoms[0], node_id=0)
+    nodes = [xTB_lot.copy(lot, {'node_id': n}) for n in range(len(frames))]
+
+    def run_legacy():
+        return [[legacy_run(lot, xyz) for xyz in xyzs] for xyzs in rounds]
+
+    def run_cached():
+        energies = []
+        for xyzs in rounds:
+            for node, xyz in zip(nodes, xyzs):
+                node.runall(manage_xyz.np_to_xyz(node.geom, xyz))
+            energies.append([node.Energies[(1, 0)].value for node in nodes])
+        return energies
+
+    def run_pool(pool_lot):
+        node_ids = list(range(len(frames)))
+        return [[result[0][(1, 0)].value for result in pool_lot.run_batch(xyzs, node_ids=node_ids)] for xyzs in rounds]
+
+    ref, t_legacy = timed(run_legacy)
+    print("{:>24s} {:>10s} {:>12s} {:>12s}".format('', 'time (s)', 'ms/calc', 'max dE (Ha)'))
+    print("{:>24s} {:10.3f} {:12.2f} {:>12s}".format('new Calculator per call', t_legacy, 1000.*t_legacy/ncalcs, '-'))
+    energies, t_cached = timed(run_cached)
+    print("{:>24s} {:10.3f} {:12.2f} {:12.1e}".format('cached Calculator', t_cached, 1000.*t_cached/ncalcs, np.max(np.abs(np.subtract(energies, ref)))))
+
+    for nworkers in args.workers:
+        pool_lot = ProcessPoolLot.wrap(xTB_lot.copy(lot, {}), nworkers)
+        # the first round starts the workers
+        pool_lot.run_batch(frames, node_ids=list(range(len(frames))))
+        energies, t_pool = timed(run_pool, pool_lot)
+        print("{:>24s} {:10.3f} {:12.2f} {:12.1e}".format('{} workers'.format(nworkers), t_pool, 1000.*t_pool/ncalcs, np.max(np.abs(np.subtract(energies, ref)))))
+        pool_lot.pool.close()
+
+    print(LotPool.report())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+Benchmark of the bond detection and fragment bridging of Topology.
+
+Builds boxes of water molecules of increasing size and compares
+    - the grid algorithm that Topology.build_bonds used before the
+      neighbor lists (reproduced below as legacy_grid_bonds)
+    - Topology.build_bonds with the KD-tree and the cell list backends
+    - networkx.minimum_spanning_edges on the all-pairs distance graph
+      (the old fragment bridging) and neighbor_list.minimum_spanning_edges
+and checks that they find the same bonds and spanning tree edges.
+
+    python devtools/scripts/benchmark_topology.py -sizes 300 3000 30000
+"""
+# standard library imports
+import argparse
+import itertools
+import sys
+import time
+from collections import OrderedDict
+from os import path
+
+# third party
+import networkx as nx
+import numpy as np
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', '..'))
+from pyGSM.coordinate_systems.neighbor_list import minimum_spanning_edges  # noqa: E402
+from pyGSM.coordinate_systems.topology import AtomContact, Topology  # noqa: E402
+from pyGSM.utilities import elements, nifty  # noqa: E402
+
+
+def water_box(natoms, density=0.0334, seed=0):
+    ''' Randomly oriented waters on a jittered cubic lattice, density in molecules/A^3 '''
+    rng = np.random.RandomState(seed)
+    nmol = max(natoms // 3, 1)
+    nside = int(np.ceil(nmol ** (1. / 3)))
+    spacing = density ** (-1. / 3)
+    sites = np.array(list(itertools.product(range(nside), repeat=3)))[:nmol] * spacing
+    sites += rng.uniform(-0.2, 0.2, sites.shape)
+    # O-H 0.96 A, H-O-H 104.5 degrees
+    theta = np.radians(104.5) / 2
+    local = np.array([[0., 0., 0.], [0.96*np.sin(theta), 0.96*np.cos(theta), 0.], [-0.96*np.sin(theta), 0.96*np.cos(theta), 0.]])
+    xyz = []
+    for site in sites:
+        q, r = np.linalg.qr(rng.randn(3, 3))
+        xyz.append(site + local.dot(q.T))
+    symbols = ['O', 'H', 'H'] * nmol
+    return symbols, np.vstack(xyz)
+
+
+def legacy_grid_bonds(xyz, atoms, Fac=1.2, gsz=6.0, mindist=1.0):
+    ''' The grid algorithm of the old Topology.build_bonds (no periodic box, all atoms) '''
+    natoms = len(xyz)
+    R = np.array([atom.covalent_radius for atom in atoms])
+    xmin, ymin, zmin = np.min(xyz, axis=0)
+    xmax, ymax, zmax = np.max(xyz, axis=0)
+    xext, yext, zext = xmax - xmin, ymax - ymin, zmax - zmin
+    if np.min([xext, yext, zext]) > 2.0*gsz:
+        xgrd = np.arange(xmin, xmax-gsz, gsz)
+        ygrd = np.arange(ymin, ymax-gsz, gsz)
+        zgrd = np.arange(zmin, zmax-gsz, gsz)
+        gidx = list(itertools.product(list(range(len(xgrd))), list(range(len(ygrd))), list(range(len(zgrd)))))
+        gngh = OrderedDict()
+        amax = np.array(gidx[-1])
+        amin = np.array(gidx[0])
+        n27 = np.array(list(itertools.product([-1, 0, 1], repeat=3)))
+        for i in gidx:
+            gngh[i] = []
+            ai = np.array(i)
+            for j in n27:
+                nj = ai+j
+                for k in range(3):
+                    mod = amax[k]-amin[k]+1
+                    if nj[k] < amin[k]:
+                        nj[k] += mod
+                    elif nj[k] > amax[k]:
+                        nj[k] -= mod
+                gngh[i].append(tuple(nj))
+        gasn = OrderedDict([(i, []) for i in gidx])
+        for i in range(natoms):
+            idx = []
+            for grd, lo, hi, ext, k in ((xgrd, xmin, xmax, xext, 0), (ygrd, ymin, ymax, yext, 1), (zgrd, zmin, zmax, zext, 2)):
+                n = -1
+                for j in grd:
+                    xi = xyz[i][k]
+                    while xi < lo:
+                        xi += ext
+                    while xi > hi:
+                        xi -= ext
+                    if xi < j:
+                        break
+                    n += 1
+                idx.append(n)
+            gasn[tuple(idx)].append(i)
+        AtomIterator = []
+        for i in gasn:
+            for j in gngh[i]:
+                apairs = nifty.cartesian_product2([gasn[i], gasn[j]])
+                if len(apairs) > 0:
+                    AtomIterator.append(apairs[apairs[:, 0] > apairs[:, 1]])
+        AtomIterator = np.ascontiguousarray(np.vstack(AtomIterator))
+    else:
+        AtomIterator = np.array(np.triu_indices(natoms, 1)).T
+    BondThresh = np.maximum((R[AtomIterator[:, 0]] + R[AtomIterator[:, 1]]) * Fac, mindist)
+    dxij = AtomContact(xyz, AtomIterator)
+    return sorted(set(tuple(sorted((int(i), int(j)))) for i, j in AtomIterator[dxij < BondThresh]))
+
+
+def networkx_mst(xyz):
+    ''' The old fragment bridging, minimum spanning tree of the complete distance graph '''
+    AtomIterator, dxij = Topology.distance_matrix(xyz, pbc=False)
+    dgraph = nx.Graph()
+    dgraph.add_nodes_from(range(len(xyz)))
+    for (i, j), d in zip(AtomIterator, dxij[0]):
+        dgraph.add_edge(int(i), int(j), weight=d)
+    return sorted(nx.minimum_spanning_edges(dgraph, data=False))
+
+
+def timed(function, *args, **kwargs):
+    t0 = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-sizes', type=int, nargs='+', default=[300, 3000, 30000], help='number of atoms')
+    parser.add_argument('-legacy_max', type=int, default=30000, help='largest system for the legacy grid code')
+    parser.add_argument('-mst_max', type=int, default=1500, help='largest system for the all-pairs spanning tree')
+    args = parser.parse_args()
+
+    ELEMENT_TABLE = elements.ElementData()
+    print("{:>8s} {:>12s} {:>12s} {:>12s} {:>8s} {:>12s} {:>12s} {:>8s}".format(
+        'atoms', 'grid (s)', 'kdtree (s)', 'cells (s)', 'same', 'nx MST (s)', 'MST (s)', 'same'))
+    for natoms in args.sizes:
+        symbols, xyz = water_box(natoms)
+        atoms = [ELEMENT_TABLE.from_symbol(s) for s in symbols]
+        indices = range(len(atoms))
+
+        kdtree, t_kdtree = timed(Topology.build_bonds, xyz, atoms, indices, neighbor_method='kdtree')
+        cells, t_cells = timed(Topology.build_bonds, xyz, atoms, indices, neighbor_method='cells')
+        same = kdtree == cells
+        t_grid = float('nan')
+        if len(atoms) <= args.legacy_max:
+            grid, t_grid = timed(legacy_grid_bonds, xyz, atoms)
+            same = same and grid == kdtree
+
+        mst, t_mst = timed(minimum_spanning_edges, xyz)
+        same_mst = ''
+        t_nx = float('nan')
+        if len(atoms) <= args.mst_max:
+            nx_mst, t_nx = timed(networkx_mst, xyz)
+            same_mst = str(nx_mst == mst)
+
+        print("{:8d} {:12.3f} {:12.3f} {:12.3f} {:>8s} {:12.3f} {:12.3f} {:>8s}".format(
+            len(atoms), t_grid, t_kdtree, t_cells, str(same), t_nx, t_mst, same_mst))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 from __future__ import print_function
 from pyGSM.utilities import nifty, block_matrix, math_utils
+from pyGSM.utilities.lru_cache import get_cache, new_token, array_key
+from pyGSM.utilities.compact_hessian import CompactHessian
 
 # standard library imports
 from sys import exit
@@ -10,6 +12,7 @@ import networkx as nx
 from collections import OrderedDict, defaultdict
 from numpy.linalg import multi_dot
 import numpy as np
+from scipy import sparse
 np.set_printoptions(precision=4, suppress=True)
 
 # local application imports
@@ -47,7 +50,10 @@ class DelocalizedInternalCoordinates(InternalCoordinates):
             # print(" warning: not sure if a deep copy prims")
             # self.Prims=self.options['primitives']
             t0 = time()
-            self.Prims = PrimitiveInternalCoordinates.copy(self.options['primitives'])
+            if self.options['share_primitives']:
+                self.Prims = PrimitiveInternalCoordinates.shared_copy(self.options['primitives'])
+            else:
+                self.Prims = PrimitiveInternalCoordinates.copy(self.options['primitives'])
 
             print(" num of primitives {}".format(len(self.Prims.Internals)))
             dt = time() - t0
@@ -79,6 +85,16 @@ class DelocalizedInternalCoordinates(InternalCoordinates):
         super(DelocalizedInternalCoordinates, self).clearCache()
         self.Prims.clearCache()
 
+    @property
+    def Vecs(self):
+        return self._Vecs
+
+    @Vecs.setter
+    def Vecs(self, value):
+        self._Vecs = value
+        # the cached G-inverses belong to the old basis
+        self.cache_token = new_token()
+
     def __repr__(self):
         return self.Prims.__repr__()
 
@@ -304,33 +320,15 @@ class DelocalizedInternalCoordinates(InternalCoordinates):
                 Float array containing difference in primitive coordinates
         """
 
-        nifty.click()
-        # print(" Beginning to build G Matrix")
-        G = self.Prims.GMatrix(xyz)  # in primitive coords
-        time_G = nifty.click()
-        # print(" Timings: Build G: %.3f " % (time_G))
-
-        tmpvecs = []
-        for A in G.matlist:
-            L, Q = np.linalg.eigh(A)
-            LargeVals = 0
-            LargeIdx = []
-            for ival, value in enumerate(L):
-                # print("val=%.4f" %value,end=' ')
-                if np.abs(value) > 1e-6:
-                    LargeVals += 1
-                    LargeIdx.append(ival)
-            # print('\n')
-            # print("LargeVals %i" % LargeVals)
-            tmpvecs.append(Q[:, LargeIdx])
-
-        self.Vecs = block_matrix(tmpvecs)
-        # print(" shape of DLC")
-        # print(self.Vecs.shape)
-
-        time_eig = nifty.click()
-        print(" Timings: Build G: %.3f Eig: %.3f" % (time_G, time_eig))
+        key = (self.Prims.basis_token,) + array_key(xyz, C)
+        Vecs = get_cache('Vecs').get(key)
+        if Vecs is not None:
+            self.Vecs = Vecs
+            self.Internals = ["DLC %i" % (i+1) for i in range(self.Vecs.shape[1])]
+            return self.Vecs
 
+        # only the constraint projection depends on C
+        self.Vecs = self.dlc_space(xyz)
         self.Internals = ["DLC %i" % (i+1) for i in range(self.Vecs.shape[1])]
 
         # Vecs has number of rows equal to the number of primitives, and
@@ -364,7 +362,44 @@ class DelocalizedInternalCoordinates(InternalCoordinates):
             self.Vecs = block_matrix.project_constraint(self.Vecs, cVecs)
             # print(" shape of DLC")
             # print(self.Vecs.shape)
-        return self.Vecs
+        return get_cache('Vecs').put(key, self.Vecs)
+
+    def dlc_space(self, xyz):
+        """
+        The non-redundant space of the primitives at xyz, the eigenvectors of
+        G with nonzero eigenvalues for each block, as a block_matrix.  It only
+        depends on the geometry, so it is cached per geometry and build_dlc
+        only redoes the constraint projection for a new constraint.
+        """
+
+        key = (self.Prims.basis_token,) + array_key(xyz)
+        Vecs = get_cache('DLCSpace').get(key)
+        if Vecs is not None:
+            return Vecs
+
+        nifty.click()
+        # print(" Beginning to build G Matrix")
+        G = block_matrix.todense(self.Prims.GMatrix(xyz))  # in primitive coords
+        time_G = nifty.click()
+        # print(" Timings: Build G: %.3f " % (time_G))
+
+        tmpvecs = []
+        for A in G.matlist:
+            L, Q = np.linalg.eigh(A)
+            LargeVals = 0
+            LargeIdx = []
+            for ival, value in enumerate(L):
+                # print("val=%.4f" %value,end=' ')
+                if np.abs(value) > 1e-6:
+                    LargeVals += 1
+                    LargeIdx.append(ival)
+            # print('\n')
+            # print("LargeVals %i" % LargeVals)
+            tmpvecs.append(Q[:, LargeIdx])
+
+        time_eig = nifty.click()
+        print(" Timings: Build G: %.3f Eig: %.3f" % (time_G, time_eig))
+        return get_cache('DLCSpace').put(key, block_matrix(tmpvecs))
 
     def build_dlc_conjugate(self, xyz, C=None):
         """
@@ -746,7 +781,10 @@ class DelocalizedInternalCoordinates(InternalCoordinates):
         Gp = self.Prims.GMatrix(xyz)
         Vt = block_matrix.transpose(self.Vecs)
         for vt, G, v in zip(Vt.matlist, Gp.matlist, self.Vecs.matlist):
-            tmpvecs.append(np.dot(np.dot(vt, G), v))
+            if sparse.issparse(G):
+                tmpvecs.append(np.dot(vt, G.dot(v)))
+            else:
+                tmpvecs.append(np.dot(np.dot(vt, G), v))
         return block_matrix(tmpvecs)
 
     def MW_GMatrix(self, xyz, mass):
@@ -820,7 +858,14 @@ class DelocalizedInternalCoordinates(InternalCoordinates):
         return block_matrix(tmpGi)
 
     def GInverse(self, xyz):
-        return self.GInverse_EIG(xyz)
+        key = (self.cache_token, self.Prims.cache_token) + array_key(xyz)
+        ans = get_cache('GInverse').get(key)
+        if ans is None:
+            InternalCoordinates.count_ginv('factorized')
+            ans = get_cache('GInverse').put(key, self.GInverse_EIG(xyz))
+        else:
+            InternalCoordinates.count_ginv('reused')
+        return ans
 
     # TODO this needs to be fixed
     def GInverse_diag(self, xyz):
@@ -850,8 +895,8 @@ class DelocalizedInternalCoordinates(InternalCoordinates):
     def guess_hessian(self, coords):
         """ Build the guess Hessian, consisting of a diagonal matrix
         in the primitive space and changed to the basis of DLCs. """
-        Hprim = self.Prims.guess_hessian(coords)
-        return multi_dot([self.Vecs.T, Hprim, self.Vecs])
+        Hprim = CompactHessian(self.Prims.guess_hessian_diagonal(coords))
+        return Hprim.project(self.Vecs)
 
     def resetRotations(self, xyz):
         """ Reset the reference geometries for calculating the orientational variables. """
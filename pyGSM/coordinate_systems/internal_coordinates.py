@@ -1,22 +1,27 @@
 #!/usr/bin/env python
 
 # standard library imports
-import time
+import threading
 
 # third party
-from collections import OrderedDict
+from collections import Counter
 import numpy as np
 from numpy.linalg import multi_dot
 
 from pyGSM.utilities import elements, options, nifty, block_matrix
+from pyGSM.utilities.lru_cache import get_cache, new_token, array_key
 
 ELEMENT_TABLE = elements.ElementData()
 
-CacheWarning = False
-
 
 class InternalCoordinates(object):
 
+    # G-inverses factorized (GInverse cache misses) and reused (cache hits,
+    # e.g. the frozen G of the newCartesian micro-iterations) by all the
+    # coordinate objects, see ginv_report
+    ginv_stats = Counter(factorized=0, reused=0, stalled=0)
+    _stats_lock = threading.Lock()
+
     @staticmethod
     def default_options():
         ''' InternalCoordinates default options.'''
@@ -96,6 +101,34 @@ class InternalCoordinates(object):
             doc='This is the molecule topology, used for building primitives'
         )
 
+        opt.add_option(
+            key='sparse_b',
+            value=False,
+            allowed_types=[bool],
+            doc='Store the primitive Wilson B-matrix blocks as sparse (CSR) matrices and \
+                    solve the G^-1 products of calcGrad/newCartesian iteratively instead of \
+                    inverting G. Use for large (e.g. QM/MM hybrid) systems.'
+        )
+
+        opt.add_option(
+            key='share_primitives',
+            value=False,
+            allowed_types=[bool],
+            doc='Build the primitives from the primitives option as a copy-on-write copy that \
+                    references its primitive definitions, topology and blocks instead of \
+                    deep copying them, so all the nodes of a string share one set.'
+        )
+
+        opt.add_option(
+            key='ginv_update',
+            value='full',
+            allowed_types=[str],
+            allowed_values=['full', 'frozen'],
+            doc='G-inverse used in the newCartesian micro-iterations. full refactorizes G \
+                    at every micro-iteration, frozen reuses the G of the last factorization \
+                    and only refactorizes when the dQ error stops dropping quickly.'
+        )
+
         opt.add_option(
             key='print_level',
             value=1,
@@ -116,7 +149,7 @@ class InternalCoordinates(object):
                  ):
 
         self.options = options
-        self.stored_wilsonB = OrderedDict()
+        self.cache_token = new_token()
 
     def addConstraint(self, cPrim, cVal):
         raise NotImplementedError("Constraints not supported with Cartesian coordinates")
@@ -131,30 +164,24 @@ class InternalCoordinates(object):
         raise NotImplementedError("Constraints not supported with Cartesian coordinates")
 
     def clearCache(self):
-        self.stored_wilsonB = OrderedDict()
+        # entries under the old token age out of the shared caches
+        self.cache_token = new_token()
 
     def wilsonB(self, xyz):
         """
         Given Cartesian coordinates xyz, return the Wilson B-matrix
         given by dq_i/dx_j where x is flattened (i.e. x1, y1, z1, x2, y2, z2)
         """
-        global CacheWarning
-        t0 = time.time()
-        xhash = hash(xyz.tostring())
-        ht = time.time() - t0
-        if xhash in self.stored_wilsonB:
-            ans = self.stored_wilsonB[xhash]
+        key = (self.cache_token,) + array_key(xyz)
+        ans = get_cache('wilsonB').get(key)
+        if ans is not None:
             return ans
         WilsonB = []
         Der = self.derivatives(xyz)
         for i in range(Der.shape[0]):
             WilsonB.append(Der[i].flatten())
-        self.stored_wilsonB[xhash] = np.array(WilsonB)
-        if len(self.stored_wilsonB) > 1000 and not CacheWarning:
-            nifty.logger.warning("\x1b[91mWarning: more than 100 B-matrices stored, memory leaks likely\x1b[0m")
-            CacheWarning = True
         ans = np.array(WilsonB)
-        return ans
+        return get_cache('wilsonB').put(key, ans)
 
     def GMatrix(self, xyz, u=None):
         """
@@ -311,12 +338,30 @@ class InternalCoordinates(object):
         logger.info("Finite-difference Finished\n")
         return FiniteDifference
 
+    @classmethod
+    def count_ginv(cls, key):
+        ''' Add one to ginv_stats[key], the nodes may run in threads '''
+        with cls._stats_lock:
+            cls.ginv_stats[key] += 1
+
+    @classmethod
+    def ginv_report(cls):
+        return " G-inverse: {factorized} factorized, {reused} reused, {stalled} newCartesian refactorizations after stalling".format(**cls.ginv_stats)
+
+    def solveG(self, xyz, rhs):
+        """
+        Return G^-1 rhs. With the sparse_b option G is never formed, instead
+        (B.B^T) x = rhs is solved with conjugate gradient.
+        """
+        if self.options['sparse_b']:
+            return block_matrix.solve_normal(self.wilsonB(xyz), rhs)
+        return block_matrix.dot(self.GInverse(xyz), rhs)
+
     def calcGrad(self, xyz, gradx, frozen_atoms=None):
-        Ginv = self.GInverse(xyz)
         Bmat = self.wilsonB(xyz)
 
         # Internal coordinate gradient
-        return block_matrix.dot(Ginv, block_matrix.dot(Bmat, gradx))
+        return self.solveG(xyz, block_matrix.dot(Bmat, gradx))
 
     def calcHess(self, xyz, gradx, hessx):
         """
@@ -397,13 +442,16 @@ class InternalCoordinates(object):
             return xyzsave.reshape((-1, 3))
 
         fail_counter = 0
+        frozen = self.options['ginv_update'] == 'frozen'
+        xyzG = None  # geometry of the G used for the step
         while True:
             microiter += 1
             Bmat = self.wilsonB(xyz1)
-            Ginv = self.GInverse(xyz1)
+            if xyzG is None or not frozen:
+                xyzG = xyz1
 
             # Get new Cartesian coordinates
-            dxyz = damp*block_matrix.dot(block_matrix.transpose(Bmat), block_matrix.dot(Ginv, dQ1))
+            dxyz = damp*block_matrix.dot(block_matrix.transpose(Bmat), self.solveG(xyzG, dQ1))
 
             if frozen_atoms is not None:
                 for a in [3*i for i in frozen_atoms]:
@@ -437,6 +485,10 @@ class InternalCoordinates(object):
                     nifty.logger.info(" Iter: %i Err-dQ = %.5e RMSD: %.5e Damp: %.5e\n" % (microiter, ndq, rmsd, damp))
                 rmsdt = rmsd
                 ndqt = ndq
+            if frozen and xyzG is not xyz1 and len(ndqs) > 0 and ndq > 0.5*ndqs[-1]:
+                # the old G is not good enough anymore
+                xyzG = None
+                InternalCoordinates.count_ginv('stalled')
             ndqs.append(ndq)
             rmsds.append(rmsd)
             # Check convergence / fail criteria
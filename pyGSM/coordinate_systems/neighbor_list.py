@@ -0,0 +1,204 @@
+# standard library imports
+import itertools
+
+# third party
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+#=============================#
+#|  Neighbor lists of atoms   |#
+#| for bonding and bridging   |#
+#=============================#
+#
+# neighbor_pairs finds all pairs of atoms within a cutoff in O(N) with a
+# KD-tree (scipy) or a cell list, optionally in a periodic orthorhombic box
+# (minimum image convention).  Topology.build_bonds uses it with the largest
+# possible bond length as the cutoff and minimum_spanning_edges uses it to
+# connect the fragments without the all-pairs distance matrix.
+
+# the 13 neighbor cells (plus the cell itself) that cover each pair of cells once
+HALF_SHELL = np.array([o for o in itertools.product([-1, 0, 1], repeat=3) if o > (0, 0, 0)] + [(0, 0, 0)])
+
+
+def minimum_image(dxyz, box=None):
+    ''' Displacement vectors in the minimum image convention of an orthorhombic box '''
+    if box is None:
+        return dxyz
+    box = np.asarray(box, dtype=float)
+    return dxyz - box*np.round(dxyz/box)
+
+
+def wrap(xyz, box):
+    ''' Coordinates wrapped into [0, box) '''
+    box = np.asarray(box, dtype=float)
+    xyz = np.mod(xyz, box)
+    # np.mod can round up to box itself
+    return np.where(xyz >= box, 0., xyz)
+
+
+def neighbor_pairs(xyz, cutoff, indices=None, box=None, method='auto'):
+    '''
+    All pairs of atoms closer than cutoff.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        Nx3 array of atom positions
+    cutoff : float
+        Distance cutoff, same units as xyz
+    indices : array-like, optional
+        Only search among these atoms (default all)
+    box : array-like, optional
+        Lengths of an orthorhombic periodic box, cutoff must be at most half of each
+    method : str
+        'kdtree' (scipy cKDTree), 'cells' (cell list) or 'auto' (kdtree when scipy is available)
+
+    Returns
+    -------
+    np.ndarray
+        (npairs, 2) array of atom indices, i < j, sorted lexicographically
+    np.ndarray
+        npairs distances
+    '''
+    xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+    indices = np.arange(len(xyz)) if indices is None else np.unique(np.asarray(indices, dtype=int))
+    if box is not None:
+        box = np.asarray(box, dtype=float)
+        if np.any(cutoff > 0.5*box):
+            raise ValueError("cutoff {} is larger than half the box {}".format(cutoff, box))
+    if method == 'auto':
+        method = 'kdtree' if cKDTree is not None else 'cells'
+
+    sel = xyz[indices]
+    if len(sel) < 2:
+        pairs = np.zeros((0, 2), dtype=int)
+    elif method == 'kdtree':
+        if cKDTree is None:
+            raise ImportError("the kdtree neighbor list needs scipy")
+        if box is not None:
+            tree = cKDTree(wrap(sel, box), boxsize=box)
+        else:
+            tree = cKDTree(sel)
+        pairs = tree.query_pairs(cutoff, output_type='ndarray').astype(int).reshape(-1, 2)
+    elif method == 'cells':
+        pairs = _cell_pairs(sel, cutoff, box)
+    else:
+        raise ValueError("unknown neighbor list method {}".format(method))
+
+    # back to atom indices, i < j
+    pairs = indices[pairs]
+    pairs = np.column_stack((pairs.min(axis=1), pairs.max(axis=1)))
+    dr = np.sqrt(np.sum(minimum_image(xyz[pairs[:, 1]] - xyz[pairs[:, 0]], box)**2, axis=1))
+    keep = dr < cutoff
+    pairs = pairs[keep]
+    dr = dr[keep]
+    order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+    return pairs[order], dr[order]
+
+
+def _cell_pairs(xyz, cutoff, box=None):
+    '''
+    Candidate pairs (local indices, possibly farther than cutoff) from a cell
+    list with cells of at least cutoff in each direction.
+    '''
+    if box is not None:
+        xyz = wrap(xyz, box)
+        ncell = np.maximum(np.floor(box/cutoff).astype(int), 1)
+        size = box/ncell
+        cell = np.minimum((xyz/size).astype(int), ncell-1)
+    else:
+        lo = xyz.min(axis=0)
+        ncell = np.maximum(np.floor((xyz.max(axis=0) - lo)/cutoff).astype(int), 1)
+        size = np.maximum((xyz.max(axis=0) - lo)/ncell, cutoff)
+        cell = np.minimum(((xyz - lo)/size).astype(int), ncell-1)
+
+    # atoms sorted by cell, start and count of each cell
+    cell_id = np.ravel_multi_index(cell.T, ncell)
+    order = np.argsort(cell_id, kind='stable')
+    ncells = int(np.prod(ncell))
+    count = np.bincount(cell_id, minlength=ncells)
+    start = np.concatenate(([0], np.cumsum(count)[:-1]))
+    occupied = np.flatnonzero(count)
+    occupied_cells = np.array(np.unravel_index(occupied, ncell)).T
+
+    pairs = []
+    for offset in HALF_SHELL:
+        other = occupied_cells + offset
+        if box is not None:
+            other %= ncell
+            valid = np.ones(len(other), dtype=bool)
+        else:
+            valid = np.all((other >= 0) & (other < ncell), axis=1)
+        a = occupied[valid]
+        b = np.ravel_multi_index(other[valid].T, ncell)
+        b_ok = count[b] > 0
+        a = a[b_ok]
+        b = b[b_ok]
+        if not len(a):
+            continue
+        # all combinations of the atoms of cell a and cell b
+        na = count[a]
+        nb = count[b]
+        total = na*nb
+        block = np.repeat(np.arange(len(a)), total)
+        t = np.arange(total.sum()) - np.repeat(np.cumsum(total) - total, total)
+        i = order[start[a][block] + t // nb[block]]
+        j = order[start[b][block] + t % nb[block]]
+        pairs.append(np.column_stack((i, j)))
+
+    if not pairs:
+        return np.zeros((0, 2), dtype=int)
+    pairs = np.vstack(pairs)
+    pairs = np.column_stack((pairs.min(axis=1), pairs.max(axis=1)))
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    # small periodic boxes reach the same cell pair through several offsets
+    return np.unique(pairs, axis=0)
+
+
+def minimum_spanning_edges(xyz, cutoff=4.0, method='auto'):
+    '''
+    Edges (i, j), i < j, of the minimum spanning tree of the complete graph of
+    interatomic distances, the same edges as networkx.minimum_spanning_edges
+    (Kruskal, ties broken by atom indices) on that graph.
+
+    Only pairs closer than cutoff are considered, the cutoff is doubled until
+    they connect all the atoms.  Once connected, every edge of the spanning
+    tree is shorter than the cutoff, so the result is exact.
+    '''
+    xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+    natoms = len(xyz)
+    if natoms < 2:
+        return []
+    while True:
+        pairs, dr = neighbor_pairs(xyz, cutoff, method=method)
+        edges = _kruskal(natoms, pairs, dr)
+        if len(edges) == natoms - 1:
+            return sorted(edges)
+        cutoff *= 2.
+
+
+def _kruskal(n, pairs, weights):
+    ''' Minimum spanning forest with union-find, ties broken by (i, j) '''
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    edges = []
+    for k in np.lexsort((pairs[:, 1], pairs[:, 0], weights)):
+        i, j = int(pairs[k, 0]), int(pairs[k, 1])
+        ri = find(i)
+        rj = find(j)
+        if ri != rj:
+            parent[ri] = rj
+            edges.append((i, j))
+            if len(edges) == n - 1:
+                break
+    return edges
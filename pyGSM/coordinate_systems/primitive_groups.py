@@ -0,0 +1,572 @@
+# standard library imports
+import sys
+from os import path
+
+# third party
+import numpy as np
+from scipy import sparse
+
+# local application imports
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+try:
+    from .slots import Distance, Angle, LinearAngle, Dihedral, OutOfPlane, TranslationX, TranslationY, TranslationZ, CartesianX, CartesianY, CartesianZ, RotationA, RotationB, RotationC
+except:
+    from slots import Distance, Angle, LinearAngle, Dihedral, OutOfPlane, TranslationX, TranslationY, TranslationZ, CartesianX, CartesianY, CartesianZ, RotationA, RotationB, RotationC
+
+# special vectors used by Angle.derivative when the two bonds are parallel
+VECTOR1 = np.array([1, -1, 1]) / np.sqrt(3)
+VECTOR2 = np.array([-1, 1, 1]) / np.sqrt(3)
+
+CARTESIAN_AXIS = {CartesianX: 0, CartesianY: 1, CartesianZ: 2}
+TRANSLATION_AXIS = {TranslationX: 0, TranslationY: 1, TranslationZ: 2}
+GROUP_NATOMS = {'Distance': 2, 'Angle': 3, 'Dihedral': 4}
+
+
+def _norm(v):
+    return np.sqrt(np.einsum('ij,ij->i', v, v))
+
+
+def _dot(u, v):
+    return np.einsum('ij,ij->i', u, v)
+
+
+def _outer(u, v):
+    return np.einsum('ni,nj->nij', u, v)
+
+
+def _skew(v):
+    """ Batched cross product matrices, _skew(v)[n] @ x == np.cross(v[n], x) """
+    answer = np.zeros((len(v), 3, 3))
+    answer[:, 0, 1] = -v[:, 2]
+    answer[:, 0, 2] = v[:, 1]
+    answer[:, 1, 0] = v[:, 2]
+    answer[:, 1, 2] = -v[:, 0]
+    answer[:, 2, 0] = -v[:, 1]
+    answer[:, 2, 1] = v[:, 0]
+    return answer
+
+
+def _zeta(natoms, a, b):
+    """ zeta(x, a, b) of the slots for the x-th atom of a primitive, 1 for a, -1 for b """
+    z = np.zeros(natoms)
+    z[a] += 1.
+    z[b] -= 1.
+    return z
+
+
+def _coefficients(pairs, natoms, offdiagonal=()):
+    """
+    C[k, i, j], the coefficient of term k in the block of atoms i and j,
+    for terms sum over (z1, z2) of zeta z1 of atom i times zeta z2 of atom j.
+    Terms in offdiagonal only contribute to blocks with i != j.
+    """
+    C = np.array([sum(np.outer(_zeta(natoms, *z1), _zeta(natoms, *z2)) for z1, z2 in term) for term in pairs])
+    for k in offdiagonal:
+        np.fill_diagonal(C[k], 0.)
+    return C
+
+
+# atom order m, n
+DISTANCE_COEFFS = np.array([[-1., 1.], [1., -1.]])
+# atom order m, o, n
+M, O, N = 0, 1, 2
+ANGLE_COEFFS = _coefficients([
+    [((M, O), (M, O))],
+    [((N, O), (N, O))],
+    [((M, O), (N, O))],
+    [((N, O), (M, O))],
+], 3)
+# atom order m, o, p, n
+M, O, P, N = 0, 1, 2, 3
+DIHEDRAL_COEFFS = _coefficients([
+    [((M, O), (M, O))],
+    [((N, P), (N, P))],
+    [((M, O), (O, P)), ((P, O), (O, M))],
+    [((N, P), (P, O)), ((P, O), (N, P))],
+    [((O, P), (P, O))],
+    [((P, O), (O, P))],
+    [((M, O), (P, O)), ((P, O), (O, M))],
+    [((N, O), (P, O)), ((P, O), (O, N))],
+], 4, offdiagonal=(6, 7))
+del M, O, N, P
+
+
+class PrimitiveGroups(object):
+    """ Vectorized evaluation of a list of primitive internal coordinates
+
+    The primitives are grouped by type (Distance, Angle, Dihedral, OutOfPlane,
+    Cartesian and Translation) into atom index arrays so that all of their
+    values, Wilson B rows and second derivatives are computed with a handful
+    of NumPy calls instead of one Python call (and one natoms x 3 array, or
+    natoms x 3 x natoms x 3 tensor) per primitive.  Second derivatives only
+    touch the atom-local 6x6/9x9/12x12 blocks of each primitive.
+    Anything else (rotations, linear angles) falls back to the slot's own
+    value/derivative/second_derivative methods.  Rows come out in the order of the primitives.
+
+    The grouping only depends on the primitives, so build it once and reuse it
+    for every geometry.
+    """
+
+    def __init__(self, prims):
+        # keep the primitives alive so their ids can't be recycled
+        self.prims = list(prims)
+        self.nprims = len(prims)
+        self.ids = tuple(map(id, prims))
+
+        rows = {'Distance': [], 'Angle': [], 'Dihedral': [], 'Cartesian': [], 'Translation': []}
+        atoms = {'Distance': [], 'Angle': [], 'Dihedral': []}
+        cart_atoms, cart_axes, cart_w = [], [], []
+        trans_rows, trans_atoms, trans_axes, trans_w = [], [], [], []
+        oop = []
+        self.other = []
+
+        for i, p in enumerate(prims):
+            t = type(p)
+            if t is Distance:
+                rows['Distance'].append(i)
+                atoms['Distance'].append((p.a, p.b))
+            elif t is Angle:
+                rows['Angle'].append(i)
+                atoms['Angle'].append((p.a, p.b, p.c))
+            elif t is Dihedral or t is OutOfPlane:
+                # same value and derivative formula
+                rows['Dihedral'].append(i)
+                atoms['Dihedral'].append((p.a, p.b, p.c, p.d))
+                oop.append(t is OutOfPlane)
+            elif t in CARTESIAN_AXIS:
+                rows['Cartesian'].append(i)
+                cart_atoms.append(p.a)
+                cart_axes.append(CARTESIAN_AXIS[t])
+                cart_w.append(p.w)
+            elif t in TRANSLATION_AXIS:
+                rows['Translation'].append(i)
+                trans_rows.extend([len(rows['Translation'])-1]*len(p.a))
+                trans_atoms.extend(p.a)
+                trans_axes.extend([TRANSLATION_AXIS[t]]*len(p.a))
+                trans_w.extend(p.w)
+            else:
+                self.other.append((i, p))
+
+        self.rows = {key: np.array(val, dtype=int) for key, val in rows.items()}
+        self.atoms = {key: np.array(val, dtype=int).reshape(-1, GROUP_NATOMS[key]) for key, val in atoms.items()}
+        self.cart_atoms = np.array(cart_atoms, dtype=int)
+        self.cart_axes = np.array(cart_axes, dtype=int)
+        self.cart_w = np.array(cart_w, dtype=float)
+        self.trans_rows = np.array(trans_rows, dtype=int)
+        self.trans_atoms = np.array(trans_atoms, dtype=int)
+        self.trans_axes = np.array(trans_axes, dtype=int)
+        self.trans_w = np.array(trans_w, dtype=float)
+        # which members of the Dihedral group are out of plane bends
+        self.oop = np.array(oop, dtype=bool)
+
+    def matches(self, prims):
+        """ True if this grouping was built from exactly these primitive objects """
+        return len(prims) == self.nprims and tuple(map(id, prims)) == self.ids
+
+    # => values <= #
+
+    def values(self, xyz):
+        """ Values of all primitives, same as [p.value(xyz) for p in prims] """
+        return self.string_values(xyz.reshape(1, -1, 3))[0]
+
+    def string_values(self, xyzs):
+        """
+        Values of all primitives for a stack of geometries, e.g. all the nodes
+        of a string.  xyzs is (nnodes, natoms, 3), returns (nnodes, nprims).
+        """
+        xyzs = np.asarray(xyzs, dtype=float)
+        nnodes = xyzs.shape[0]
+        answer = np.zeros((nnodes, self.nprims))
+
+        def atom_vectors(idx, to, frm):
+            # (nnodes*ngroup, 3) bond vectors of every node
+            return (xyzs[:, idx[:, to]] - xyzs[:, idx[:, frm]]).reshape(-1, 3)
+
+        idx = self.atoms['Distance']
+        if len(idx):
+            d = atom_vectors(idx, 0, 1)
+            answer[:, self.rows['Distance']] = _norm(d).reshape(nnodes, -1)
+
+        idx = self.atoms['Angle']
+        if len(idx):
+            v1 = atom_vectors(idx, 0, 1)
+            v2 = atom_vectors(idx, 2, 1)
+            cos = _dot(v1, v2) / (_norm(v1) * _norm(v2))
+            if np.any(cos - 1.0 > 1e-6):
+                raise RuntimeError('Encountered invalid value in angle')
+            answer[:, self.rows['Angle']] = np.arccos(np.clip(cos, -1.0, 1.0)).reshape(nnodes, -1)
+
+        idx = self.atoms['Dihedral']
+        if len(idx):
+            vec1 = atom_vectors(idx, 1, 0)
+            vec2 = atom_vectors(idx, 2, 1)
+            vec3 = atom_vectors(idx, 3, 2)
+            cross1 = np.cross(vec2, vec3)
+            cross2 = np.cross(vec1, vec2)
+            arg1 = _dot(vec1, cross1) * _norm(vec2)
+            arg2 = _dot(cross1, cross2)
+            answer[:, self.rows['Dihedral']] = np.arctan2(arg1, arg2).reshape(nnodes, -1)
+
+        if len(self.cart_atoms):
+            answer[:, self.rows['Cartesian']] = xyzs[:, self.cart_atoms, self.cart_axes]*self.cart_w
+
+        if len(self.trans_atoms):
+            ntrans = len(self.rows['Translation'])
+            bins = (np.arange(nnodes)[:, None]*ntrans + self.trans_rows).ravel()
+            weights = (xyzs[:, self.trans_atoms, self.trans_axes]*self.trans_w).ravel()
+            answer[:, self.rows['Translation']] = np.bincount(bins, weights=weights, minlength=nnodes*ntrans).reshape(nnodes, ntrans)
+
+        for i, p in self.other:
+            for k in range(nnodes):
+                answer[k, i] = p.value(xyzs[k])
+        return answer
+
+    def string_differences(self, xyzs, pairs, values=None):
+        """
+        Differences c(xyzs[i]) - c(xyzs[j]) of all primitives for every (i, j)
+        in pairs, the same as p.calcDiff(xyzs[i], xyzs[j]).  Dihedrals and out
+        of plane bends are taken modulo 2*pi, rotations (and the other
+        primitives without a vectorized form) use their own calcDiff.
+
+        Parameters
+        ----------
+        xyzs : np.ndarray
+            (nnodes, natoms, 3) stacked geometries
+        pairs : array-like
+            (npairs, 2) node indices
+        values : np.ndarray, optional
+            string_values(xyzs) if already known
+
+        Returns
+        -------
+        np.ndarray
+            (npairs, nprims)
+        """
+        xyzs = np.asarray(xyzs, dtype=float)
+        pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+        if values is None:
+            values = self.string_values(xyzs)
+        diff = values[pairs[:, 0]] - values[pairs[:, 1]]
+
+        rows = self.rows['Dihedral']
+        if len(rows):
+            d = diff[:, rows]
+            d = np.where(np.abs(d) > np.abs(d + 2*np.pi), d + 2*np.pi, d)
+            d = np.where(np.abs(d) > np.abs(d - 2*np.pi), d - 2*np.pi, d)
+            diff[:, rows] = d
+
+        for i, p in self.other:
+            for k, (a, b) in enumerate(pairs):
+                diff[k, i] = p.calcDiff(xyzs[a], xyzs[b])
+        return diff
+
+    # => guess Hessian <= #
+
+    def guess_hessian_diagonal(self, xyz, radii, atomic_nums):
+        """
+        Diagonal of the guess Hessian of PrimitiveInternalCoordinates.guess_hessian
+        (Schlegel's guidelines).  radii and atomic_nums are arrays of the covalent
+        radii and atomic numbers of all the atoms.
+        """
+        xyz = xyz.reshape(-1, 3)
+
+        def covalent(a, b):
+            return _norm(xyz[a] - xyz[b]) / (radii[a] + radii[b]) < 1.2
+
+        def angle(a, b, c):
+            A = np.where(np.minimum(np.minimum(atomic_nums[a], atomic_nums[b]), atomic_nums[c]) < 3, 0.160, 0.250)
+            return np.where(covalent(a, b) & covalent(b, c), A, 0.1)
+
+        # Cartesians, translations and rotations
+        answer = np.full(self.nprims, 0.05)
+
+        idx = self.atoms['Distance']
+        answer[self.rows['Distance']] = np.where(covalent(idx[:, 0], idx[:, 1]), 0.35, 0.1)
+
+        idx = self.atoms['Angle']
+        answer[self.rows['Angle']] = angle(idx[:, 0], idx[:, 1], idx[:, 2])
+
+        idx = self.atoms['Dihedral']
+        bonded = covalent(idx[:, 0], idx[:, 1]) & covalent(idx[:, 0], idx[:, 2]) & covalent(idx[:, 0], idx[:, 3])
+        answer[self.rows['Dihedral']] = np.where(self.oop & bonded, 0.045, 0.023)
+
+        for i, p in self.other:
+            if type(p) is LinearAngle:
+                answer[i] = angle(np.array([p.a]), np.array([p.b]), np.array([p.c]))[0]
+            elif type(p) not in (RotationA, RotationB, RotationC):
+                raise RuntimeError('Failed to build guess Hessian matrix. Make sure all IC types are supported')
+        return answer
+
+    # => derivatives <= #
+
+    def derivatives(self, xyz, start_idx=0):
+        """
+        Wilson B rows of all primitives as a (nprims, 3*natoms) array,
+        same as [p.derivative(xyz, start_idx).flatten() for p in prims].
+        As in the slots, xyz may be a fragment starting at atom start_idx.
+        """
+        xyz = xyz.reshape(-1, 3)
+        B = np.zeros((self.nprims, xyz.shape[0], 3))
+        for rows, atoms, vecs in self._derivative_terms(xyz, start_idx):
+            B[rows, atoms] = vecs
+        for i, p in self.other:
+            B[i] = p.derivative(xyz, start_idx=start_idx)
+        return B.reshape(self.nprims, -1)
+
+    def sparse_derivatives(self, xyz, start_idx=0):
+        """ Same as derivatives but returned as a scipy.sparse CSR matrix """
+        xyz = xyz.reshape(-1, 3)
+        rows, cols, vals = [], [], []
+        for r, atoms, vecs in self._derivative_terms(xyz, start_idx):
+            rows.append(np.repeat(r, 3))
+            cols.append((3*atoms[:, None] + np.arange(3)).ravel())
+            vals.append(vecs.ravel())
+        for i, p in self.other:
+            der = p.derivative(xyz, start_idx=start_idx).flatten()
+            nz = np.flatnonzero(der)
+            rows.append(np.full(len(nz), i))
+            cols.append(nz)
+            vals.append(der[nz])
+        if rows:
+            rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+        B = sparse.csr_matrix((vals, (rows, cols)), shape=(self.nprims, 3*xyz.shape[0]))
+        B.eliminate_zeros()
+        return B
+
+    def _derivative_terms(self, xyz, start_idx):
+        """
+        Yields (rows, atoms, vectors): the nonzero 3-vectors of the B rows
+        for each primitive type.  Each (row, atom) pair appears only once.
+        """
+        idx = self.atoms['Distance']
+        if len(idx):
+            rows = self.rows['Distance']
+            m = idx[:, 0] - start_idx
+            n = idx[:, 1] - start_idx
+            d = xyz[m] - xyz[n]
+            u = d / _norm(d)[:, None]
+            yield rows, m, u
+            yield rows, n, -u
+
+        idx = self.atoms['Angle']
+        if len(idx):
+            rows = self.rows['Angle']
+            m = idx[:, 0] - start_idx
+            o = idx[:, 1] - start_idx
+            n = idx[:, 2] - start_idx
+            u_prime = xyz[m] - xyz[o]
+            v_prime = xyz[n] - xyz[o]
+            u_norm = _norm(u_prime)
+            v_norm = _norm(v_prime)
+            u = u_prime / u_norm[:, None]
+            v = v_prime / v_norm[:, None]
+            w_prime = np.cross(u, v)
+            parallel = (_norm(u + v) < 1e-10) | (_norm(u - v) < 1e-10)
+            if np.any(parallel):
+                # pick a perpendicular direction as Angle.derivative does
+                up = u[parallel]
+                use2 = (_norm(up + VECTOR1) < 1e-10) | (_norm(up - VECTOR2) < 1e-10)
+                w_prime[parallel] = np.where(use2[:, None], np.cross(up, VECTOR2), np.cross(up, VECTOR1))
+            w = w_prime / _norm(w_prime)[:, None]
+            term1 = np.cross(u, w) / u_norm[:, None]
+            term2 = np.cross(w, v) / v_norm[:, None]
+            yield rows, m, term1
+            yield rows, n, term2
+            yield rows, o, -(term1 + term2)
+
+        idx = self.atoms['Dihedral']
+        if len(idx):
+            rows = self.rows['Dihedral']
+            m = idx[:, 0] - start_idx
+            o = idx[:, 1] - start_idx
+            p = idx[:, 2] - start_idx
+            n = idx[:, 3] - start_idx
+            u_prime = xyz[m] - xyz[o]
+            w_prime = xyz[p] - xyz[o]
+            v_prime = xyz[n] - xyz[p]
+            u_norm = _norm(u_prime)
+            w_norm = _norm(w_prime)
+            v_norm = _norm(v_prime)
+            u = u_prime / u_norm[:, None]
+            w = w_prime / w_norm[:, None]
+            v = v_prime / v_norm[:, None]
+            uw = _dot(u, w)
+            vw = _dot(v, w)
+            su = 1 - uw**2
+            sv = 1 - vw**2
+            # zero out the terms of (nearly) linear u-w or v-w pairs
+            okay_u = su >= 1e-6
+            okay_v = sv >= 1e-6
+            su = np.where(okay_u, su, 1.)
+            sv = np.where(okay_v, sv, 1.)
+            cuw = np.cross(u, w) * okay_u[:, None]
+            cvw = np.cross(v, w) * okay_v[:, None]
+            term1 = cuw / (u_norm * su)[:, None]
+            term2 = cvw / (v_norm * sv)[:, None]
+            term3 = cuw * (uw / (w_norm * su))[:, None]
+            term4 = cvw * (vw / (w_norm * sv))[:, None]
+            yield rows, m, term1
+            yield rows, n, -term2
+            yield rows, o, -term1 + term3 - term4
+            yield rows, p, term2 - term3 + term4
+
+        if len(self.cart_atoms):
+            vecs = np.zeros((len(self.cart_atoms), 3))
+            vecs[np.arange(len(self.cart_atoms)), self.cart_axes] = self.cart_w
+            yield self.rows['Cartesian'], self.cart_atoms - start_idx, vecs
+
+        if len(self.trans_atoms):
+            vecs = np.zeros((len(self.trans_atoms), 3))
+            vecs[np.arange(len(self.trans_atoms)), self.trans_axes] = self.trans_w
+            yield self.rows['Translation'][self.trans_rows], self.trans_atoms - start_idx, vecs
+
+    # => second derivatives <= #
+
+    def second_derivatives(self, xyz, start_idx=0):
+        """
+        Second derivatives of all primitives as a (nprims, 3*natoms, 3*natoms) array,
+        same as [p.second_derivative(xyz, start_idx).reshape(3*natoms, 3*natoms) for p in prims].
+        """
+        xyz = xyz.reshape(-1, 3)
+        natoms = xyz.shape[0]
+        answer = np.zeros((self.nprims, natoms, 3, natoms, 3))
+        for rows, atoms, blocks in self._second_derivative_terms(xyz, start_idx):
+            for i in range(atoms.shape[1]):
+                for j in range(atoms.shape[1]):
+                    answer[rows, atoms[:, i], :, atoms[:, j], :] = blocks[:, i, j]
+        for i, p in self.other:
+            answer[i] = p.second_derivative(xyz, start_idx=start_idx).reshape(natoms, 3, natoms, 3)
+        return answer.reshape(self.nprims, 3*natoms, 3*natoms)
+
+    def weighted_second_derivatives(self, xyz, weights, start_idx=0, sparse_result=False):
+        """
+        sum_p weights[p] * d^2 q_p / dx^2 as a (3*natoms, 3*natoms) array
+        (a scipy.sparse CSR matrix if sparse_result), without building the
+        second derivative tensor of every primitive.
+        """
+        xyz = xyz.reshape(-1, 3)
+        weights = np.asarray(weights, dtype=float).ravel()
+        n = 3*xyz.shape[0]
+        rows, cols, vals = [], [], []
+        for prim_rows, atoms, blocks in self._second_derivative_terms(xyz, start_idx):
+            # (nprim, k) atoms -> (nprim, k, k, 3, 3) Cartesian indices of the blocks
+            k = atoms.shape[1]
+            cart = 3*atoms[:, :, None] + np.arange(3)
+            rows.append(np.broadcast_to(cart[:, :, None, :, None], (len(atoms), k, k, 3, 3)).ravel())
+            cols.append(np.broadcast_to(cart[:, None, :, None, :], (len(atoms), k, k, 3, 3)).ravel())
+            vals.append((blocks*weights[prim_rows, None, None, None, None]).ravel())
+        for i, p in self.other:
+            if weights[i] == 0.:
+                continue
+            der2 = p.second_derivative(xyz, start_idx=start_idx).reshape(n, n)
+            r, c = np.nonzero(der2)
+            rows.append(r)
+            cols.append(c)
+            vals.append(weights[i]*der2[r, c])
+        if rows:
+            rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+        # duplicate (row, col) entries are summed
+        answer = sparse.coo_matrix((vals, (rows, cols)), shape=(n, n))
+        if sparse_result:
+            return answer.tocsr()
+        return answer.toarray()
+
+    def _second_derivative_terms(self, xyz, start_idx):
+        """
+        Yields (rows, atoms, blocks): the atom indices (nprim, k) and the
+        nonzero 3x3 blocks (nprim, k, k, 3, 3) of the second derivatives of
+        each primitive type, k is the number of atoms of the primitive.
+        Cartesians and translations are linear and have none.
+        """
+        idx = self.atoms['Distance']
+        if len(idx):
+            atoms = idx - start_idx
+            d = xyz[atoms[:, 0]] - xyz[atoms[:, 1]]
+            norm = _norm(d)
+            u = d / norm[:, None]
+            mtx = (_outer(u, u) - np.eye(3)) / norm[:, None, None]
+            yield self.rows['Distance'], atoms, DISTANCE_COEFFS[None, :, :, None, None]*mtx[:, None, None]
+
+        idx = self.atoms['Angle']
+        if len(idx):
+            # in the order of the slot: m, o, n
+            atoms = idx - start_idx
+            u_prime = xyz[atoms[:, 0]] - xyz[atoms[:, 1]]
+            v_prime = xyz[atoms[:, 2]] - xyz[atoms[:, 1]]
+            u_norm = _norm(u_prime)
+            v_norm = _norm(v_prime)
+            u = u_prime / u_norm[:, None]
+            v = v_prime / v_norm[:, None]
+            # zero for parallel or antiparallel bonds, as in Angle.second_derivative
+            okay = (_norm(u + v) >= 1e-10) & (_norm(u - v) >= 1e-10)
+            cq = _dot(u, v)
+            sq = np.sqrt(np.where(okay, 1 - cq**2, 1.))
+            uu = _outer(u, u)
+            uv = _outer(u, v)
+            vu = _outer(v, u)
+            vv = _outer(v, v)
+            de = np.eye(3)
+            c = cq[:, None, None]
+            terms = np.stack([
+                (uv + vu - (3*uu - de)*c) / (u_norm**2*sq)[:, None, None],
+                (uv + vu - (3*vv - de)*c) / (v_norm**2*sq)[:, None, None],
+                (uu + vv - uv*c - de) / (u_norm*v_norm*sq)[:, None, None],
+                (uu + vv - vu*c - de) / (u_norm*v_norm*sq)[:, None, None],
+            ], axis=1)
+            blocks = np.einsum('kij,nkab->nijab', ANGLE_COEFFS, terms)
+
+            w = np.cross(u, v)
+            w /= np.where(okay, _norm(w), 1.)[:, None]
+            der1 = np.empty((len(idx), 3, 3))
+            der1[:, 0] = np.cross(u, w) / u_norm[:, None]
+            der1[:, 2] = np.cross(w, v) / v_norm[:, None]
+            der1[:, 1] = -(der1[:, 0] + der1[:, 2])
+            blocks -= (cq/sq)[:, None, None, None, None] * np.einsum('nia,njb->nijab', der1, der1)
+            yield self.rows['Angle'], atoms, blocks*okay[:, None, None, None, None]
+
+        idx = self.atoms['Dihedral']
+        if len(idx):
+            # in the order of the slot: m, o, p, n
+            atoms = idx - start_idx
+            u_prime = xyz[atoms[:, 0]] - xyz[atoms[:, 1]]
+            w_prime = xyz[atoms[:, 2]] - xyz[atoms[:, 1]]
+            v_prime = xyz[atoms[:, 3]] - xyz[atoms[:, 2]]
+            lu = _norm(u_prime)
+            lw = _norm(w_prime)
+            lv = _norm(v_prime)
+            u = u_prime / lu[:, None]
+            w = w_prime / lw[:, None]
+            v = v_prime / lv[:, None]
+            cu = _dot(u, w)
+            cv = _dot(v, w)
+            su = np.sqrt(1 - cu**2)
+            sv = np.sqrt(1 - cv**2)
+            # zero for (nearly) linear u-w or v-w pairs, as in Dihedral.second_derivative
+            okay = (su >= 1e-6) & (sv >= 1e-6)
+            su = np.where(okay, su, 1.)
+            sv = np.where(okay, sv, 1.)
+            su4 = su**4
+            sv4 = sv**4
+            uxw = np.cross(u, w)
+            vxw = np.cross(v, w)
+            cu_ = cu[:, None]
+            cv_ = cv[:, None]
+
+            def sym(a, b, scale):
+                t = _outer(a, b) / scale[:, None, None]
+                return t + t.transpose(0, 2, 1)
+
+            terms = np.stack([
+                sym(uxw, w*cu_ - u, lu**2*su4),
+                sym(vxw, -w*cv_ + v, lv**2*sv4),
+                sym(uxw, w - 2*u*cu_ + w*cu_**2, 2*lu*lw*su4),
+                sym(vxw, w - 2*v*cv_ + w*cv_**2, 2*lv*lw*sv4),
+                sym(uxw, u + u*cu_**2 - 3*w*cu_ + w*cu_**3, 2*lw**2*su4),
+                sym(vxw, -v - v*cv_**2 + 3*w*cv_ - w*cv_**3, 2*lw**2*sv4),
+                _skew(0.5*(-w*cu_ + u) / (lu*lw*su**2)[:, None]),
+                _skew(0.5*(w*cv_ - v) / (lv*lw*sv**2)[:, None]),
+            ], axis=1)
+            blocks = np.einsum('kij,nkab->nijab', DIHEDRAL_COEFFS, terms)
+            yield self.rows['Dihedral'], atoms, blocks*okay[:, None, None, None, None]
+
@@ -1,10 +1,6 @@
 from __future__ import print_function
-from copy import deepcopy, copy
-from pyGSM.utilities import manage_xyz, nifty, block_matrix, block_tensor
-from collections import OrderedDict, defaultdict
-import itertools
-import networkx as nx
-import numpy as np
+from pyGSM.utilities import manage_xyz, block_matrix, block_tensor
+from pyGSM.utilities.lru_cache import get_cache, new_token, array_key
 
 # standard library imports
 import time
@@ -29,12 +25,18 @@ try:
     from .internal_coordinates import InternalCoordinates
     from .topology import Topology, MyG
     from .slots import Distance, Angle, Dihedral, OutOfPlane, RotationA, RotationB, RotationC, TranslationX, TranslationY, TranslationZ, CartesianX, CartesianY, CartesianZ, LinearAngle
+    from .primitive_groups import PrimitiveGroups
+    from .neighbor_list import minimum_spanning_edges
 except:
     from internal_coordinates import InternalCoordinates
     from topology import Topology, MyG
     from slots import Distance, Angle, Dihedral, OutOfPlane, RotationA, RotationB, RotationC, TranslationX, TranslationY, TranslationZ, CartesianX, CartesianY, CartesianZ, LinearAngle
+    from primitive_groups import PrimitiveGroups
+    from neighbor_list import minimum_spanning_edges
 
-CacheWarning = False
+# primitives without per-geometry state, these can be shared between the nodes
+# of a string (rotations and linear angles keep reference vectors, see slots)
+STATELESS_PRIMITIVES = (Distance, Angle, Dihedral, OutOfPlane, TranslationX, TranslationY, TranslationZ, CartesianX, CartesianY, CartesianZ)
 
 
 class PrimitiveInternalCoordinates(InternalCoordinates):
@@ -58,6 +60,9 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         self.natoms = len(self.atoms)
         self.built_bonds = False
         self.hybrid_idx_start_stop = []
+        self.stored_groups = {}
+        # True while the primitives/topology are referenced by other objects, see shared_copy
+        self.shared = False
 
         # # Topology settings  -- CRA 3/2019 leftovers from Lee-Ping's code
         # but maybe useful in the future
@@ -112,7 +117,74 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
 
         return newPrims
 
+    @classmethod
+    def shared_copy(cls, Prims):
+        '''
+        Copy-on-write copy of Prims. The copy references the primitives,
+        topology and block info of Prims instead of deep copying them; only
+        stateful primitives (rotations, linear angles) are copied. Whichever
+        of the two is modified first (add, delete, append_prim_to_block, ...)
+        takes a private deep copy beforehand, see own.
+        '''
+        newPrims = cls(Prims.options.copy().set_values({'form_topology': False}))
+        newPrims.hybrid_idx_start_stop = Prims.hybrid_idx_start_stop
+        newPrims.topology = Prims.topology
+        memo = {}
+        newPrims.Internals = [p if type(p) in STATELESS_PRIMITIVES else deepcopy(p, memo) for p in Prims.Internals]
+        newPrims.block_info = Prims.block_info
+        newPrims.prim_only_block_info = Prims.prim_only_block_info
+        newPrims.atoms = newPrims.options['atoms']
+        if hasattr(Prims, 'fragments'):
+            newPrims.fragments = Prims.fragments
+        else:
+            newPrims.fragments = [Prims.topology.subgraph(c).copy() for c in nx.connected_components(Prims.topology)]
+            for g in newPrims.fragments:
+                g.__class__ = MyG
+        if not memo:
+            # same primitive objects, so the same vectorized groups
+            newPrims.stored_groups = Prims.stored_groups
+        Prims.shared = True
+        newPrims.shared = True
+        return newPrims
+
+    def own(self):
+        ''' Take private copies of the structures shared by shared_copy, call before modifying them '''
+        if not self.shared:
+            return
+        self.topology = deepcopy(self.topology)
+        self.Internals = deepcopy(self.Internals)
+        self.block_info = deepcopy(self.block_info)
+        self.prim_only_block_info = copy(self.prim_only_block_info)
+        self.fragments = [self.topology.subgraph(c).copy() for c in nx.connected_components(self.topology)]
+        for g in self.fragments:
+            g.__class__ = MyG
+        self.stored_groups = {}
+        self.shared = False
+
+    def reshare(self, Prims):
+        '''
+        Reference the structures of Prims again where they still equal ours,
+        undoes the private copies pickling makes (e.g. a process executor
+        sending the nodes back). The stateful primitives are kept.
+        '''
+        if not (self.shared and Prims.shared) or self is Prims:
+            return
+        if len(self.Internals) != len(Prims.Internals) or self.block_info != Prims.block_info:
+            return
+        if any(type(p) is not type(q) or p != q for p, q in zip(self.Internals, Prims.Internals)):
+            return
+        stateless = [type(p) in STATELESS_PRIMITIVES for p in self.Internals]
+        self.Internals = [q if s else p for p, q, s in zip(self.Internals, Prims.Internals, stateless)]
+        self.topology = Prims.topology
+        self.block_info = Prims.block_info
+        self.prim_only_block_info = Prims.prim_only_block_info
+        if hasattr(Prims, 'fragments'):
+            self.fragments = Prims.fragments
+        if all(stateless):
+            self.stored_groups = Prims.stored_groups
+
     def makePrimitives(self, xyz):
+        self.own()
 
         self.Internals = []
         connect = self.options['connect']
@@ -129,20 +201,10 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         noncov = []
         # Connect all non-bonded fragments together
         if connect:
-            # Make a distance matrix mapping atom pairs to interatomic distances
-            AtomIterator, dxij = Topology.distance_matrix(xyz, pbc=False)
-            D = {}
-            for i, j in zip(AtomIterator, dxij[0]):
-                assert i[0] < i[1]
-                D[tuple(i)] = j
-            dgraph = nx.Graph()
-            for i in range(self.natoms):
-                dgraph.add_node(i)
-            for k, v in list(D.items()):
-                dgraph.add_edge(k[0], k[1], weight=v)
-            mst = sorted(list(nx.minimum_spanning_edges(dgraph, data=False)))
+            # Minimum spanning tree of the interatomic distances, from a neighbor list
+            mst = minimum_spanning_edges(xyz)
             for edge in mst:
-                if edge not in list(self.topology.edges()):
+                if not self.topology.has_edge(*edge):
                     print("Adding %s from minimum spanning tree" % str(edge))
                     self.topology.add_edge(edge[0], edge[1])
                     noncov.append(edge)
@@ -311,13 +373,9 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         Given Cartesian coordinates xyz, return the Wilson B-matrix
         given by dq_i/dx_j where x is flattened (i.e. x1, y1, z1, x2, y2, z2)
         """
-        global CacheWarning
-        t0 = time.time()
-        xhash = hash(xyz.tostring())
-        ht = time.time() - t0
-        if xhash in self.stored_wilsonB:
-            # print(" returning stored")
-            ans = self.stored_wilsonB[xhash]
+        key = (self.cache_token,) + array_key(xyz)
+        ans = get_cache('wilsonB').get(key)
+        if ans is not None:
             return ans
         xyz = xyz.reshape(-1, 3)
 
@@ -327,7 +385,10 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
             ea = info[1]
             sp = info[2]
             ep = info[3]
-            Blist.append(np.array([p.derivative(xyz[sa:ea, :], start_idx=sa).flatten() for p in self.Internals[sp:ep]]))
+            if self.options['sparse_b']:
+                Blist.append(self.primitive_groups(sp, ep).sparse_derivatives(xyz[sa:ea, :], start_idx=sa))
+            else:
+                Blist.append(self.primitive_groups(sp, ep).derivatives(xyz[sa:ea, :], start_idx=sa))
 
         ans = block_matrix(Blist)
         # print(block_matrix.full_matrix(ans))
@@ -337,11 +398,26 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         #    print(block)
         #    print(block.shape)
 
-        self.stored_wilsonB[xhash] = ans
-        if len(self.stored_wilsonB) > 1000 and not CacheWarning:
-            nifty.logger.warning("\x1b[91mWarning: more than 100 B-matrices stored, memory leaks likely\x1b[0m")
-            CacheWarning = True
-        return ans
+        return get_cache('wilsonB').put(key, ans)
+
+    def primitive_groups(self, sp=0, ep=None):
+        """
+        Return the PrimitiveGroups (vectorized values and derivatives) of
+        Internals[sp:ep], rebuilt only when those primitives have changed
+        """
+        prims = self.Internals[sp:ep]
+        key = (sp, ep)
+        groups = self.stored_groups.get(key)
+        if groups is None or not groups.matches(prims):
+            groups = PrimitiveGroups(prims)
+            groups.token = new_token()
+            self.stored_groups[key] = groups
+        return groups
+
+    @property
+    def basis_token(self):
+        """ Changes only when the primitives or their blocks change, used to cache DLC bases """
+        return (self.primitive_groups().token, tuple(map(tuple, self.block_info)))
 
     def GMatrix(self, xyz):
         #if len(self.nprims_frag)==1:
@@ -360,7 +436,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         loops = 0
         while True:
             try:
-                G = self.GMatrix(xyz)
+                G = block_matrix.todense(self.GMatrix(xyz))
                 # time_G = nifty.click()
                 start = 0
                 tmpUvecs = []
@@ -408,7 +484,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
     def GInverse_EIG(self, xyz):
         xyz = xyz.reshape(-1, 3)
         # nifty.click()
-        G = self.GMatrix(xyz)
+        G = block_matrix.todense(self.GMatrix(xyz))
         # time_G = nifty.click()
 
         matlist = []
@@ -478,6 +554,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         return not self.__eq__(other)
 
     def update(self, other):
+        self.own()
         Changed = False
         for i in self.Internals:
             if i not in other.Internals:
@@ -499,6 +576,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         return Changed
 
     def join(self, other, bonds_only=False):
+        self.own()
         Changed = False
         for i in other.Internals:
             if i not in self.Internals:
@@ -552,10 +630,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         return False
 
     def calculate(self, xyz):
-        answer = []
-        for Internal in self.Internals:
-            answer.append(Internal.value(xyz))
-        return np.array(answer)
+        return self.primitive_groups().values(xyz)
 
     def calculateDegrees(self, xyz):
         answer = []
@@ -593,12 +668,12 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
 
     def derivatives(self, xyz):
         self.calculate(xyz)
-        answer = [p.derivative(xyz) for p in self.Internals]
+        answer = self.primitive_groups().derivatives(xyz)
         # This array has dimensions:
         # 1) Number of internal coordinates
         # 2) Number of atoms
         # 3) 3
-        return np.array(answer)
+        return answer.reshape(len(self.Internals), -1, 3)
 
     def calcDiff(self, xyz1, xyz2):
         """ Calculate difference in internal coordinates (coord1-coord2), accounting for changes in 2*pi of angles. """
@@ -609,9 +684,17 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
 
     def GInverse(self, xyz):
         # 9/2019 CRA what is the difference in performace/stability for SVD vs regular inverse?
-        return self.GInverse_EIG(xyz)
+        key = (self.cache_token,) + array_key(xyz)
+        ans = get_cache('GInverse').get(key)
+        if ans is None:
+            InternalCoordinates.count_ginv('factorized')
+            ans = get_cache('GInverse').put(key, self.GInverse_EIG(xyz))
+        else:
+            InternalCoordinates.count_ginv('reused')
+        return ans
 
     def add(self, dof, verbose=False):
+        self.own()
         if dof.__class__.__name__ in ['CartesianX', 'CartesianY', 'CartesianZ']:
             if verbose:
                 print((" adding ", dof))
@@ -659,6 +742,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         return self.Internals.index(prim)
 
     def delete(self, dof):
+        self.own()
         found = False
         for ii in range(len(self.Internals))[::-1]:
             if dof == self.Internals[ii]:
@@ -675,6 +759,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         return found
 
     def addConstraint(self, cPrim, cVal=None, xyz=None):
+        self.own()
         if cVal is None and xyz is None:
             raise RuntimeError('Please provide either cval or xyz')
         if cVal is None:
@@ -695,6 +780,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
             self.cVals.append(cVal)
 
     def reorderPrimitives(self):
+        self.own()
         # Reorder primitives to be in line with cc's code
         newPrims = []
         for cPrim in self.cPrims:
@@ -715,6 +801,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
             self.block_info = [(1, self.natoms, len(newPrims), 'P')]
 
     def newMakePrimitives(self, xyz):
+        self.own()
         self.Internals = []
         self.block_info = []
         # coordinates in Angstrom
@@ -756,20 +843,10 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
                 noncov = []
                 if connect:
                     # Connect all non-bonded fragments together
-                    # Make a distance matrix mapping atom pairs to interatomic distances
-                    AtomIterator, dxij = Topology.distance_matrix(xyz, pbc=False)
-                    D = {}
-                    for i, j in zip(AtomIterator, dxij[0]):
-                        assert i[0] < i[1]
-                        D[tuple(i)] = j
-                    dgraph = nx.Graph()
-                    for i in range(self.natoms):
-                        dgraph.add_node(i)
-                    for k, v in list(D.items()):
-                        dgraph.add_edge(k[0], k[1], weight=v)
-                    mst = sorted(list(nx.minimum_spanning_edges(dgraph, data=False)))
+                    # Minimum spanning tree of the interatomic distances, from a neighbor list
+                    mst = minimum_spanning_edges(xyz)
                     for edge in mst:
-                        if edge not in list(self.topology.edges()):
+                        if not self.topology.has_edge(*edge):
                             print("Adding %s from minimum spanning tree" % str(edge))
                             self.topology.add_edge(edge[0], edge[1])
                             noncov.append(edge)
@@ -992,6 +1069,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         '''
         Warning this assumes that the fragments aren't intermixed. you shouldn't do that!!!!
         '''
+        self.own()
 
         # these are the subgraphs
         # frags = [m for m in self.fragments]
@@ -1138,76 +1216,15 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         """
         Build a guess Hessian that roughly follows Schlegel's guidelines.
         """
-        xyzs = coords.reshape(-1, 3)
-
-        def covalent(a, b):
-            r = np.linalg.norm(xyzs[a]-xyzs[b])
-            rcov = self.atoms[a].covalent_radius + self.atoms[b].covalent_radius
-            return r/rcov < 1.2
-
-        Hdiag = []
-        for ic in self.Internals:
-            if type(ic) is Distance:
-                # r = np.linalg.norm(xyzs[ic.a]-xyzs[ic.b])
-                # elem1 = min(self.atoms[ic.a].atomic_num, self.atoms[ic.b].atomic_num)
-                # elem2 = max(self.atoms[ic.a].atomic_num, self.atoms[ic.b].atomic_num)
-                # A = 1.734
-                # if elem1 < 3:
-                #    if elem2 < 3:
-                #        B = -0.244
-                #    elif elem2 < 11:
-                #        B = 0.352
-                #    else:
-                #        B = 0.660
-                # elif elem1 < 11:
-                #    if elem2 < 11:
-                #        B = 1.085
-                #    else:
-                #        B = 1.522
-                # else:
-                #    B = 2.068
-                if covalent(ic.a, ic.b):
-                    Hdiag.append(0.35)
-                    # Hdiag.append(A/(r-B)**3)
-                else:
-                    Hdiag.append(0.1)
-            elif type(ic) in [Angle, LinearAngle]:
-                a = ic.a
-                c = ic.c
-                if min(self.atoms[a].atomic_num,
-                        self.atoms[ic.b].atomic_num,
-                        self.atoms[c].atomic_num) < 3:
-                    A = 0.160
-                else:
-                    A = 0.250
-                if covalent(a, ic.b) and covalent(ic.b, c):
-                    Hdiag.append(A)
-                else:
-                    Hdiag.append(0.1)
-            elif type(ic) in [Dihedral]:
-                # r = np.linalg.norm(xyzs[ic.b]-xyzs[ic.c])
-                # rcov = self.atoms[ic.b].covalent_radius + self.atoms[ic.c].covalent_radius
-                # Hdiag.append(0.1)
-                Hdiag.append(0.023)
-            elif type(ic) is OutOfPlane:
-                # r1 = xyzs[ic.b]-xyzs[ic.a]
-                # r2 = xyzs[ic.c]-xyzs[ic.a]
-                # r3 = xyzs[ic.d]-xyzs[ic.a]
-                # d = 1 - np.abs(np.dot(r1, np.cross(r2, r3))/np.linalg.norm(r1)/np.linalg.norm(r2)/np.linalg.norm(r3))
-                # Hdiag.append(0.1)
-                if covalent(ic.a, ic.b) and covalent(ic.a, ic.c) and covalent(ic.a, ic.d):
-                    Hdiag.append(0.045)
-                else:
-                    Hdiag.append(0.023)
-            elif type(ic) in [CartesianX, CartesianY, CartesianZ]:
-                Hdiag.append(0.05)
-            elif type(ic) in [TranslationX, TranslationY, TranslationZ]:
-                Hdiag.append(0.05)
-            elif type(ic) in [RotationA, RotationB, RotationC]:
-                Hdiag.append(0.05)
-            else:
-                raise RuntimeError('Failed to build guess Hessian matrix. Make sure all IC types are supported')
-        return np.diag(Hdiag)
+        return np.diag(self.guess_hessian_diagonal(coords))
+
+    def guess_hessian_diagonal(self, coords):
+        """
+        The diagonal of guess_hessian, the guess has no off-diagonal elements.
+        """
+        radii = np.array([atom.covalent_radius for atom in self.atoms])
+        atomic_nums = np.array([atom.atomic_num for atom in self.atoms])
+        return self.primitive_groups().guess_hessian_diagonal(coords, radii, atomic_nums)
 
     # def apply_periodic_boundary(self,xyz,L):
     #    tot=0
@@ -1260,12 +1277,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
             ea = info[1]
             sp = info[2]
             ep = info[3]
-            na = ea - sa
-            SDer = np.array(
-                [np.reshape(p.second_derivative(xyz[sa:ea, :], start_idx=sa), (3*na, 3*na)) for p in self.Internals[sp:ep]]
-            )
-
-            c_list.append(SDer)
+            c_list.append(self.primitive_groups(sp, ep).second_derivatives(xyz[sa:ea, :], start_idx=sa))
 
         answer = block_tensor(c_list)
         # This array has dimensions:
@@ -1281,20 +1293,15 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         '''
         self.calculate(xyz)
         Gq = self.calcGrad(xyz, gradx).flatten()
-        natoms = len(xyz)
 
+        # only the atom-local blocks of each primitive are computed and summed
         result_list = []
         for info in self.block_info:
             sa = int(info[0])
             ea = int(info[1])
             sp = int(info[2])
             ep = int(info[3])
-            na = ea - sa
-            mini_result = np.zeros( (3*na,3*na), dtype=float )
-            for p,prim in enumerate(self.Internals[sp:ep]):
-                sder = np.reshape(prim.second_derivative(xyz[sa:ea,:],start_idx=sa), (3*na,3*na))
-                mini_result += sder*Gq[p+sp]
-            result_list.append(mini_result)
+            result_list.append(self.primitive_groups(sp, ep).weighted_second_derivatives(xyz[sa:ea, :], Gq[sp:ep], start_idx=sa))
 
         result = block_diag(*result_list)
 
@@ -1360,6 +1367,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         # print(self.hybrid_idx_start_stop)
 
     def append_prim_to_block(self, prim, count=None):
+        self.own()
         total_blocks = len(self.block_info)
 
         if count is None:
@@ -1146,7 +1146,7 @@ class Angle(PrimitiveCoordinate):
         term2 = (uv + uv.T - (3*vv - de)*cq)/(v_norm**2*sq)
         term3 = (uu + vv - uv*cq - de)/(u_norm*v_norm*sq)
         term4 = (uu + vv - uv.T*cq - de)/(u_norm*v_norm*sq)
-        der1 = self.derivative(xyz)
+        der1 = self.derivative(xyz, start_idx)
 
         def zeta(a_, m_, n_):
             return (int(a_ == m_) - int(a_ == n_))
@@ -1838,9 +1838,9 @@ class OutOfPlane(PrimitiveCoordinate):
             for j in range(3):
                 ii = [a, b, c, d][i]
                 xyz[ii, j] += h
-                FPlus = self.derivative(xyz)
+                FPlus = self.derivative(xyz, start_idx)
                 xyz[ii, j] -= 2*h
-                FMinus = self.derivative(xyz)
+                FMinus = self.derivative(xyz, start_idx)
                 xyz[ii, j] += h
                 fderiv = (FPlus-FMinus)/(2*h)
                 deriv2[ii, j, :, :] = fderiv
@@ -1,6 +1,5 @@
 from __future__ import print_function
 from utilities import manage_xyz, nifty
-from collections import OrderedDict
 from pkg_resources import parse_version
 import itertools
 import numpy as np
@@ -12,6 +11,11 @@ from os import path
 # i don't know what this is doing
 sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
 
+try:
+    from .neighbor_list import neighbor_pairs
+except:
+    from neighbor_list import neighbor_pairs
+
 
 try:
     import networkx as nx
@@ -160,6 +164,9 @@ class Topology():
             not provided, this will be taken from the top_settings
             field.  If provided, this will take priority and write
             the value into top_settings.
+
+        The other keyword arguments (toppbc, box, Fac, neighbor_method)
+        are passed to build_bonds.
         """
 
         natoms = len(atoms)
@@ -175,6 +182,7 @@ class Topology():
             primitive_indices = range(len(atoms))
         else:
             # specify Hybrid TRIC we need to specify which atoms to build topology for
+            hybrid_indices = set(hybrid_indices)
             primitive_indices = []
             for i in range(len(atoms)):
                 if i not in hybrid_indices:
@@ -198,7 +206,7 @@ class Topology():
         if not bondlistfile:
             nifty.printcool(" building bonds")
             print(prim_idx_start_stop)
-            bonds = Topology.build_bonds(xyz, atoms, primitive_indices, prim_idx_start_stop)
+            bonds = Topology.build_bonds(xyz, atoms, primitive_indices, prim_idx_start_stop, **kwargs)
             # print(" done")
             assert bondlistfile is None
         else:
@@ -290,7 +298,15 @@ class Topology():
 
     @staticmethod
     def build_bonds(xyz, atoms, primitive_indices, prim_idx_start_stop=None, **kwargs):
-        """ Build the bond connectivity graph. """
+        """
+        Build the bond connectivity graph.
+
+        Two atoms of the same primitive block are bonded if they are closer
+        than Fac times the sum of their covalent radii (or mindist).  The
+        candidate pairs come from a neighbor list (see neighbor_list), with
+        toppbc=True and box=(a, b, c) distances use the minimum image
+        convention of that orthorhombic box.
+        """
 
         print(" In build bonds")
         top_settings = {
@@ -298,10 +314,10 @@ class Topology():
             'topframe': kwargs.get('topframe', 0),
             'Fac': kwargs.get('Fac', 1.2),
             'radii': kwargs.get('radii', {}),
+            'box': kwargs.get('box', None),
+            'neighbor_method': kwargs.get('neighbor_method', 'auto'),
         }
 
-        # leftover from LPW code
-        sn = top_settings['topframe']
         toppbc = top_settings['toppbc']
         Fac = top_settings['Fac']
         natoms = len(xyz)
@@ -311,223 +327,57 @@ class Topology():
         # Molecule object can have its own set of radii that overrides the global ones
         # R = np.array([top_settings['radii'].get(i.symbol, i.covalent_radius) for i in atoms])
         R = np.array([atom.covalent_radius for atom in atoms])
-        # Create a list of 2-tuples corresponding to combinations of atomic indices using a grid algorithm.
-        mins = np.min(xyz, axis=0)
-        maxs = np.max(xyz, axis=0)
-        # Grid size in Angstrom.  This number is optimized for speed in a 15,000 atom system (united atom pentadecane).
-        gsz = 6.0
-        boxes = None
-        if top_settings['toppbc']:
-            raise NotImplementedError
-            xmin = 0.0
-            ymin = 0.0
-            zmin = 0.0
-            xmax = boxes[sn].a
-            ymax = boxes[sn].b
-            zmax = boxes[sn].c
-            if any([i != 90.0 for i in [boxes[sn].alpha, boxes[sn].beta, boxes[sn].gamma]]):
-                nifty.logger.warning("Warning: Topology building will not work with broken molecules in nonorthogonal cells.")
-                toppbc = False
-        else:
-            xmin = mins[0]
-            ymin = mins[1]
-            zmin = mins[2]
-            xmax = maxs[0]
-            ymax = maxs[1]
-            zmax = maxs[2]
-            toppbc = False
-
-        xext = xmax-xmin
-        yext = ymax-ymin
-        zext = zmax-zmin
 
+        box = None
         if toppbc:
-            gszx = xext/int(xext/gsz)
-            gszy = yext/int(yext/gsz)
-            gszz = zext/int(zext/gsz)
-        else:
-            gszx = gsz
-            gszy = gsz
-            gszz = gsz
-
-        # Run algorithm to determine bonds.
-        # Decide if we want to use the grid algorithm.
-        use_grid = toppbc or (np.min([xext, yext, zext]) > 2.0*gsz)
-        if use_grid and prim_idx_start_stop is None:
-            print(" Using grid")
-            # Inside the grid algorithm.
-            # 1) Determine the left edges of the grid cells.
-            # Note that we leave out the rightmost grid cell,
-            # because this may cause spurious partitionings.
-            xgrd = np.arange(xmin, xmax-gszx, gszx)
-            ygrd = np.arange(ymin, ymax-gszy, gszy)
-            zgrd = np.arange(zmin, zmax-gszz, gszz)
-            # 2) Grid cells are denoted by a three-index tuple.
-            gidx = list(itertools.product(list(range(len(xgrd))), list(range(len(ygrd))), list(range(len(zgrd)))))
-            # 3) Build a dictionary which maps a grid cell to itplus its neighboring grid cells.
-            # Two grid cells are defined to be neighbors if the differences between their x, y, z indices are at most 1.
-            gngh = OrderedDict()
-            amax = np.array(gidx[-1])
-            amin = np.array(gidx[0])
-            n27 = np.array(list(itertools.product([-1, 0, 1], repeat=3)))
-            for i in gidx:
-                gngh[i] = []
-                ai = np.array(i)
-                for j in n27:
-                    nj = ai+j
-                    for k in range(3):
-                        mod = amax[k]-amin[k]+1
-                        if nj[k] < amin[k]:
-                            nj[k] += mod
-                        elif nj[k] > amax[k]:
-                            nj[k] -= mod
-                    gngh[i].append(tuple(nj))
-            # 4) Loop over the atoms and assign each to a grid cell.
-            # Note: I think this step becomes the bottleneck if we choose very small grid sizes.
-
-            # TODO 9/2019 build-bonds only for non-cartesian indices
-            gasn = OrderedDict([(i, []) for i in gidx])
-            for i in primitive_indices:
-                xidx = -1
-                yidx = -1
-                zidx = -1
-                for j in xgrd:
-                    xi = xyz[i][0]
-                    while xi < xmin:
-                        xi += xext
-                    while xi > xmax:
-                        xi -= xext
-                    if xi < j:
-                        break
-                    xidx += 1
-                for j in ygrd:
-                    yi = xyz[i][1]
-                    while yi < ymin:
-                        yi += yext
-                    while yi > ymax:
-                        yi -= yext
-                    if yi < j:
-                        break
-                    yidx += 1
-                for j in zgrd:
-                    zi = xyz[i][2]
-                    while zi < zmin:
-                        zi += zext
-                    while zi > zmax:
-                        zi -= zext
-                    if zi < j:
-                        break
-                    zidx += 1
-                gasn[(xidx, yidx, zidx)].append(i)
-
-            # 5) Create list of 2-tuples corresponding to combinations of atomic indices.
-            # This is done by looping over pairs of neighboring grid cells and getting Cartesian products of atom indices inside.
-            # It may be possible to get a 2x speedup by eliminating forward-reverse pairs (e.g. (5, 4) and (4, 5) and duplicates (5,5).)
-            AtomIterator = []
-            for i in gasn:
-                for j in gngh[i]:
-                    apairs = nifty.cartesian_product2([gasn[i], gasn[j]])
-                    if len(apairs) > 0:
-                        AtomIterator.append(apairs[apairs[:, 0] > apairs[:, 1]])
-            AtomIterator = np.ascontiguousarray(np.vstack(AtomIterator))
-        else:
-            # Create a list of 2-tuples corresponding to combinations of atomic indices.
-            # This is much faster than using itertools.combinations.
-            # TODO 9/2019 build-bonds only for non-cartesian indices
-            # the original version
-            # AtomIterator = np.ascontiguousarray(np.vstack((np.fromiter(itertools.chain(*[[i]*(natoms-i-1) for i in range(natoms)]),dtype=np.int32), np.fromiter(itertools.chain(*[list(range(i+1,natoms)) for i in range(natoms)]),dtype=np.int32))).T)
-
-            # first_o =np.fromiter(itertools.chain(*[[i]*(natoms-i-1) for i in range(natoms)]),dtype=np.int32)
-
-            # print("prim indices")
-            # need the primitive start and stop indices
-
-            if prim_idx_start_stop is None:
-                prim_idx_start_stop = []
-                new = True
-                for i in range(natoms+1):
-                    if i in primitive_indices:
-                        if new:
-                            start = i
-                            new = False
-                    else:
-                        if not new:
-                            end = i-1
-                            new = True
-                            prim_idx_start_stop.append((start, end))
-            else:
-                print(" using user defined primitive start stop values")
-
-            # print(prim_idx_start_stop)
-            first_list = []
-            for tup in prim_idx_start_stop:
-                for i in range(tup[0], tup[1]):
-                    first_list.append([i]*(tup[1]-i))
-            #         first_list.append([i]*(tup[1]-i-1) for i in range(tup[0],tup[1]))
-            # print(first_list)
-
-            second_list = []
-            for tup in prim_idx_start_stop:
-                for i in range(tup[0], tup[1]):
-                    second_list.append(list(range(i+1, tup[1]+1)))
-            # print(second_list)
-
-            # first = np.fromiter(itertools.chain(*[[i]*(natoms-i-1) for i in primitive_indices]),dtype=np.int32)
-            # first = np.fromiter(itertools.chain(*first_list), dtype=np.int32)
-            # second = np.fromiter(itertools.chain(*second_list), dtype=np.int32)
-
-            AtomIterator = np.ascontiguousarray(
-                np.vstack((
-                    np.fromiter(itertools.chain(*first_list), dtype=np.int32),
-                    np.fromiter(itertools.chain(*second_list), dtype=np.int32)
-                )).T
-            )
-        # Create a list of thresholds for determining whether a certain interatomic distance is considered to be a bond.
-        BT0 = R[AtomIterator[:, 0]]
-        BT1 = R[AtomIterator[:, 1]]
-        BondThresh = (BT0+BT1) * Fac
-        BondThresh = (BondThresh > mindist) * BondThresh + (BondThresh < mindist) * mindist
-        # if hasattr( 'boxes') and toppbc:
-        if toppbc:
-            raise NotImplementedError
-            # dxij = AtomContact(xyz, AtomIterator, box=np.array([boxes[sn].a, boxes[sn].b, boxes[sn].c]))
+            if top_settings['box'] is None:
+                raise NotImplementedError("periodic topologies need the box lengths, box=(a, b, c)")
+            box = np.asarray(top_settings['box'], dtype=float)
+
+        # need the primitive start and stop indices
+        if prim_idx_start_stop is None:
+            primitive_indices = set(primitive_indices)
+            prim_idx_start_stop = []
+            new = True
+            for i in range(natoms+1):
+                if i in primitive_indices:
+                    if new:
+                        start = i
+                        new = False
+                else:
+                    if not new:
+                        end = i-1
+                        new = True
+                        prim_idx_start_stop.append((start, end))
         else:
-            dxij = AtomContact(xyz, AtomIterator)
-
-        # Update topology settings with what we learned
-        top_settings['toppbc'] = toppbc
-
-        # Create a list of atoms that each atom is bonded to.
-        atom_bonds = [[] for i in range(natoms)]
-        # atom_bonds = [[] for i in primitive_indices]
+            print(" using user defined primitive start stop values")
+
+        # bonds are only made within a block, start and stop inclusive
+        block = np.full(natoms, -1)
+        for k, (start, end) in enumerate(prim_idx_start_stop):
+            block[start:end+1] = k
+        members = np.flatnonzero(block >= 0)
+        if len(members) < 2:
+            return []
+
+        # the longest possible bond is the neighbor list cutoff
+        cutoff = max(2.*R[members].max()*Fac, mindist)
+        AtomIterator, dxij = neighbor_pairs(xyz, cutoff, indices=members, box=box, method=top_settings['neighbor_method'])
+        same_block = block[AtomIterator[:, 0]] == block[AtomIterator[:, 1]]
+        AtomIterator = AtomIterator[same_block]
+        dxij = dxij[same_block]
 
+        # Create a list of thresholds for determining whether a certain interatomic distance is considered to be a bond.
+        BondThresh = np.maximum((R[AtomIterator[:, 0]] + R[AtomIterator[:, 1]]) * Fac, mindist)
         bond_bool = dxij < BondThresh
-        for i, a in enumerate(bond_bool):
-            if not a:
-                continue
-            (ii, jj) = AtomIterator[i]
-            if ii == jj:
-                continue
-            atom_bonds[ii].append(jj)
-            atom_bonds[jj].append(ii)
-        bondlist = []
-
-        for i, bi in enumerate(atom_bonds):
-            for j in bi:
-                if i == j:
-                    continue
-                # Do not add a bond between resids if fragment is set to True.
-                # if top_settings['fragment'] and 'resid' in Data.keys() and resid[i] != resid[j]:
-                #    continue
-                elif i < j:
-                    bondlist.append((i, j))
-                else:
-                    bondlist.append((j, i))
-        bondlist = sorted(list(set(bondlist)))
-        bonds = sorted(list(set(bondlist)))
+
+        # Do not add a bond between resids if fragment is set to True.
+        # if top_settings['fragment'] and 'resid' in Data.keys() and resid[i] != resid[j]:
+        #    continue
+        bonds = [(int(i), int(j)) for i, j in AtomIterator[bond_bool]]
 
         # print('bond list')
-        # print(bondlist)
+        # print(bonds)
 
         return bonds
 
@@ -617,11 +467,16 @@ class Topology():
         return dihidx
 
     @staticmethod
-    def distance_matrix(xyz, pbc=True):
-        """ Obtain distance matrix between all pairs of atoms. """
+    def distance_matrix(xyz, pbc=True, cutoff=None):
+        """
+        Obtain distance matrix between all pairs of atoms, or with a cutoff
+        only between the pairs closer than cutoff (from a neighbor list).
+        """
+        if cutoff is not None:
+            AtomIterator, drij = neighbor_pairs(xyz, cutoff)
+            return AtomIterator, [drij]
         natoms = len(xyz)
-        AtomIterator = np.ascontiguousarray(np.vstack((np.fromiter(itertools.chain(*[[i]*(natoms-i-1) for i in range(natoms)]), dtype=np.int32),
-                                            np.fromiter(itertools.chain(*[list(range(i+1, natoms)) for i in range(natoms)]), dtype=np.int32))).T)
+        AtomIterator = np.ascontiguousarray(np.array(np.triu_indices(natoms, 1), dtype=np.int32).T)
         drij = []
         # if hasattr(self, 'boxes') and pbc:
         #    drij.append(AtomContact(xyz,AtomIterator,box=np.array([self.boxes[sn].a, self.boxes[sn].b, self.boxes[sn].c])))
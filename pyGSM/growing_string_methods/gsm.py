@@ -6,22 +6,17 @@ from os import path
 sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
 from coordinate_systems import Distance, Angle, Dihedral, OutOfPlane
 from utilities import nifty, options, block_matrix
+from utilities.executors import get_executor, EXECUTORS, ReparamPool
 from pyGSM.molecule import Molecule
-from utilities.manage_xyz import write_molden_geoms
+from utilities.manage_xyz import write_molden_geoms, TrajectoryWriter, FRAME_LOG_EXT
 
 # third party
 import numpy as np
-import multiprocessing as mp
 from collections import Counter
 from copy import copy
 from itertools import chain
 
 
-def worker(arg):
-   obj, methname = arg[:2]
-   return getattr(obj, methname)(*arg[2:])
-
-
 #######################################################################################
 #### This class contains the main constructor, object properties and staticmethods ####
 #######################################################################################
@@ -148,12 +143,32 @@ class GSM(object):
             doc='Function to be used to format and write XYZ files',
         )
 
+        opt.add_option(
+            key='frame_log',
+            value=False,
+            required=False,
+            allowed_types=[bool],
+            doc='Append the string of every growth/optimization iteration to one binary frame log\
+                    per stage (scratch/growth_iters_ID.frames, see manage_xyz.export_frame_log) \
+                    instead of writing a new xyz_writer file per iteration.',
+        )
+
         opt.add_option(
             key='mp_cores',
             value=1,
             doc='multiprocessing cores for parallel programming. Use this with caution.',
         )
 
+        opt.add_option(
+            key='node_executor',
+            value=None,
+            required=False,
+            allowed_values=list(EXECUTORS),
+            doc='Backend used to optimize the active nodes concurrently (serial, thread or process). \
+                    Threads suit LoTs that call an external QM program, processes suit in-process LoTs \
+                    such as xTB or ASE. Defaults to serial, mp_cores then only sizes the reparameterization pool.',
+        )
+
         opt.add_option(
             key="BDIST_RATIO",
             value=0.5,
@@ -186,6 +201,16 @@ class GSM(object):
             doc='Noise to check for intermediate',
         )
 
+        opt.add_option(
+            key='ts_mode_refinement',
+            value=0,
+            allowed_types=[int],
+            required=False,
+            doc='When the TS node Hessian is (re)built from the reaction path for the climbing/finding stages, \
+                    refine its lowest mode with up to this many Davidson iterations of finite difference \
+                    Hessian-vector products (two gradients each). 0 uses the reaction path curvature only.',
+        )
+
         GSM._default_options = opt
         return GSM._default_options.copy()
 
@@ -224,7 +249,9 @@ class GSM(object):
         self.CONV_TOL = self.options['CONV_TOL']
         self.noise = self.options['noise']
         self.mp_cores = self.options['mp_cores']
+        self.node_executor = get_executor(self.options['node_executor'], self.mp_cores)
         self.xyz_writer = self.options['xyz_writer']
+        self.frame_logs = {}
 
         optimizer = options['optimizer']
         for count in range(self.nnodes):
@@ -265,6 +292,23 @@ class GSM(object):
         self.ran_out = False   # if it ran out of iterations
 
         self.newic = Molecule.copy_from_options(self.nodes[0])  # newic object is used for coordinate transformations
+        self._reparam_pool = None
+
+    @property
+    def reparam_pool(self):
+        '''
+        Process pool for the reparameterizations, lives as long as the GSM object.
+        None when running on a single core.
+        '''
+        if self._reparam_pool is None and self.mp_cores > 1:
+            self._reparam_pool = ReparamPool(self.mp_cores)
+        return self._reparam_pool
+
+    def close(self):
+        ''' Shut down the worker pools '''
+        if self._reparam_pool is not None:
+            self._reparam_pool.shutdown()
+        self.node_executor.shutdown()
 
     @property
     def TSnode(self):
@@ -524,6 +568,34 @@ class GSM(object):
                 PMDiff[k] = prim.calcDiff(xyz2, xyz1)
         return np.reshape(PMDiff, (-1, 1))
 
+    @staticmethod
+    def get_tangents_xyz(nodes, pairs):
+        '''
+        Primitive tangents pointing from nodes[i] to nodes[j] for every (i, j)
+        in pairs, the same as get_tangent(nodes[i], nodes[j]) for each pair:
+        the primitives are those of nodes[j].  The pairs whose nodes[j] share
+        their primitives (share_primitives) are evaluated in one vectorized pass.
+
+        Returns a list of (nprims,) arrays, one per pair
+        '''
+        tangents = [None]*len(pairs)
+        batches = {}
+        for k, (i, j) in enumerate(pairs):
+            groups = nodes[j].coord_obj.Prims.primitive_groups()
+            batches.setdefault(id(groups), (groups, []))[1].append(k)
+        for groups, ks in batches.values():
+            used = sorted(set(chain.from_iterable(pairs[k] for k in ks)))
+            local = {n: m for m, n in enumerate(used)}
+            xyzs = np.array([nodes[n].xyz for n in used])
+            diffs = groups.string_differences(xyzs, [(local[pairs[k][1]], local[pairs[k][0]]) for k in ks])
+            rows = groups.rows['Distance']
+            # the same type test as get_tangent
+            if len(rows) and type(groups.prims[rows[0]]) is Distance:
+                diffs[:, rows] *= 2.5
+            for k, diff in zip(ks, diffs):
+                tangents[k] = diff
+        return tangents
+
     @staticmethod
     def get_tangent(node1, node2, print_level=1, **kwargs):
         '''
@@ -682,11 +754,11 @@ class GSM(object):
         dqmaga = [0.]*nnodes
         ictan = [[]]*nnodes
 
+        assert all(node is not None for node in nodes[n0:]), "missing node"
+        tangents = GSM.get_tangents_xyz(nodes, [(n-1, n) for n in range(n0+1, nnodes)])
+
         for n in range(n0+1, nnodes):
-            # print "getting tangent between %i %i" % (n,n-1)
-            assert nodes[n] is not None, "n is bad"
-            assert nodes[n-1] is not None, "n-1 is bad"
-            ictan[n] = GSM.get_tangent_xyz(nodes[n-1].xyz, nodes[n].xyz, nodes[0].primitive_internal_coordinates)
+            ictan[n] = np.reshape(tangents[n-n0-1], (-1, 1))
 
             dqmaga[n] = 0.
             # ictan0= np.copy(ictan[n])
@@ -746,34 +818,27 @@ class GSM(object):
             print("** Setting the middle of the string to be TS node to get proper directions **")
             TSnode = nnodes//2
 
+        # each tangent points from the first to the second node of its pair,
+        # the three way tangent at the TS node mixes n+1 -> n and n -> n-1
+        pairs = []
         for n in range(n0, nnodes):
-            do3 = False
-            print('getting tan[{' + str(n) + '}]')
             if n < TSnode:
                 # The order is very important here
-                # the way it should be ;(
-                intic_n = n+1
-                newic_n = n
-
-                # old way
-                # intic_n = n
-                # newic_n = n+1
-
+                pairs.append((n, n+1))
             elif n > TSnode:
-                # The order is very important here
-                intic_n = n
-                newic_n = n-1
+                pairs.append((n-1, n))
             else:
-                do3 = True
-                newic_n = n
-                intic_n = n+1
-                int2ic_n = n-1
+                pairs += [(n+1, n), (n, n-1)]
+        tangents = GSM.get_tangents_xyz(nodes, pairs)
 
-            if do3:
+        k = 0
+        for n in range(n0, nnodes):
+            print('getting tan[{' + str(n) + '}]')
+            if n == TSnode:
+                t1 = np.reshape(tangents[k], (-1, 1))
+                t2 = np.reshape(tangents[k+1], (-1, 1))
+                k += 2
                 if first_node_max or last_node_max:
-                    t1, _ = GSM.get_tangent(nodes[intic_n], nodes[newic_n])
-                    t2, _ = GSM.get_tangent(nodes[newic_n], nodes[int2ic_n])
-                    print(" done 3 way tangent")
                     ictan0 = t1 + t2
                 else:
                     f1 = 0.
@@ -787,13 +852,11 @@ class GSM(object):
                         f1 = 1 - dEmax/(dEmax+dEmin+0.00000001)
 
                     print(' 3 way tangent ({}): f1:{:3.2}'.format(n, f1))
-
-                    t1, _ = GSM.get_tangent(nodes[intic_n], nodes[newic_n])
-                    t2, _ = GSM.get_tangent(nodes[newic_n], nodes[int2ic_n])
-                    print(" done 3 way tangent")
                     ictan0 = f1*t1 + (1.-f1)*t2
+                print(" done 3 way tangent")
             else:
-                ictan0, _ = GSM.get_tangent(nodes[newic_n], nodes[intic_n])
+                ictan0 = np.reshape(tangents[k], (-1, 1))
+                k += 1
 
             ictan[n] = ictan0/np.linalg.norm(ictan0)
             dqmaga[n] = np.linalg.norm(ictan0)
@@ -801,7 +864,7 @@ class GSM(object):
         return ictan, dqmaga
 
     @staticmethod
-    def ic_reparam(nodes, energies, climbing=False, ic_reparam_steps=8, print_level=1, NUM_CORE=1, MAXRE=0.25):
+    def ic_reparam(nodes, energies, climbing=False, ic_reparam_steps=8, print_level=1, NUM_CORE=1, MAXRE=0.25, pool=None, coord_obj=None):
         '''
         Reparameterizes the string using Delocalizedin internal coordinatesusing three-way tangents at the TS node
         Only pushes nodes outwards during reparameterization because otherwise too many things change.
@@ -812,9 +875,18 @@ class GSM(object):
         energies : list of energies in kcal/mol
         ic_reparam_steps : int max number of reparameterization steps
         print_level : int verbosity
+        NUM_CORE : int number of processes moving the nodes
+        pool : ReparamPool used when NUM_CORE > 1, a temporary one is started if None
+        coord_obj : coordinate object the pool builds the bases with (default that of nodes[0])
         '''
         nifty.printcool("reparametrizing string nodes")
 
+        own_pool = NUM_CORE > 1 and pool is None
+        if own_pool:
+            pool = ReparamPool(NUM_CORE)
+        if coord_obj is None:
+            coord_obj = nodes[0].coord_obj
+
         nnodes = len(nodes)
         rpart = np.zeros(nnodes)
         for n in range(1, nnodes):
@@ -913,24 +985,8 @@ class GSM(object):
                         deltadqs[n] = np.sign(deltadqs[n])*MAXRE
 
                 if NUM_CORE > 1:
-
                     # 5/14/2021 TS node this up?!
-                    tans = [ictan[n] if deltadqs[n] < 0 else ictan[n+1] for n in chain(range(1, TSnode), range(TSnode+1, nnodes-1))]  # + [ ictan[n] if deltadqs[n]<0 else ictan[n+1] for n in range(TSnode+1,nnodes-1)]
-                    pool = mp.Pool(NUM_CORE)
-                    Vecs = pool.map(worker, ((nodes[0].coord_obj, "build_dlc", node.xyz, tan) for node, tan in zip(nodes[1:TSnode] + nodes[TSnode+1:nnodes-1], tans)))
-                    pool.close()
-                    pool.join()
-                    for n, node in enumerate(nodes[1:TSnode] + nodes[TSnode+1:nnodes-1]):
-                        node.coord_basis = Vecs[n]
-
-                    # move the positions
-                    dqs = [deltadqs[n]*nodes[n].constraints[:, 0] for n in chain(range(1, TSnode), range(TSnode+1, nnodes-1))]
-                    pool = mp.Pool(NUM_CORE)
-                    newXyzs = pool.map(worker, ((node.coord_obj, "newCartesian", node.xyz, dq) for node, dq in zip(nodes[1:TSnode] + nodes[TSnode+1:nnodes-1], dqs)))
-                    pool.close()
-                    pool.join()
-                    for n, node in enumerate(nodes[1:TSnode] + nodes[TSnode+1:nnodes-1]):
-                        node.xyz = newXyzs[n]
+                    pool.move_nodes(coord_obj, nodes, [(n, ictan[n] if deltadqs[n] < 0 else ictan[n+1], deltadqs[n]) for n in chain(range(1, TSnode), range(TSnode+1, nnodes-1)) if deltadqs[n] != 0], verbose=(print_level > 1))
                 else:
                     for n in chain(range(1, TSnode), range(TSnode+1, nnodes-1)):
                         if deltadqs[n] < 0:
@@ -959,22 +1015,7 @@ class GSM(object):
                         deltadqs[n] = np.sign(deltadqs[n])*MAXRE
 
                 if NUM_CORE > 1:
-                    # Update the coordinate basis
-                    tans = [ictan[n] if deltadqs[n] < 0 else ictan[n+1] for n in range(1, nnodes-1)]
-                    pool = mp.Pool(NUM_CORE)
-                    Vecs = pool.map(worker, ((nodes[0].coord_obj, "build_dlc", node.xyz, tan) for node, tan in zip(nodes[1:nnodes-1], tans)))
-                    pool.close()
-                    pool.join()
-                    for n, node in enumerate(nodes[1:nnodes-1]):
-                        node.coord_basis = Vecs[n]
-                    # move the positions
-                    dqs = [deltadqs[n]*nodes[n].constraints[:, 0] for n in range(1, nnodes-1)]
-                    pool = mp.Pool(NUM_CORE)
-                    newXyzs = pool.map(worker, ((node.coord_obj, "newCartesian", node.xyz, dq) for node, dq in zip(nodes[1:nnodes-1], dqs)))
-                    pool.close()
-                    pool.join()
-                    for n, node in enumerate(nodes[1:nnodes-1]):
-                        node.xyz = newXyzs[n]
+                    pool.move_nodes(coord_obj, nodes, [(n, ictan[n] if deltadqs[n] < 0 else ictan[n+1], deltadqs[n]) for n in range(1, nnodes-1) if deltadqs[n] != 0], verbose=(print_level > 1))
                 else:
                     for n in range(1, nnodes-1):
                         if deltadqs[n] < 0:
@@ -1030,6 +1071,8 @@ class GSM(object):
             print(" {:1.2}".format(dqmaga[n]), end=' ')
         print("\n  disprms: {:1.3}".format(disprms))
 
+        if own_pool:
+            pool.shutdown()
         return
 
     # TODO move to string utils or delete altogether
@@ -1117,3 +1160,63 @@ class GSM(object):
         # TODO wrong for growth
         gradrms = np.sqrt(gradrms/(nnodes-2))
         return totalgrad, gradrms, sum_gradrms
+
+    def write_iteration(self, stage, iteration):
+        ''' Write the string after an iteration of stage (growth_iters or opt_iters) to scratch '''
+        if self.options['frame_log']:
+            if stage not in self.frame_logs:
+                self.frame_logs[stage] = TrajectoryWriter('scratch/{}_{:03}{}'.format(stage, self.ID, FRAME_LOG_EXT))
+            self.frame_logs[stage].extend(self.geometries, self.energies, self.gradrmss, self.dEs, group=iteration)
+            self.frame_logs[stage].flush()
+        else:
+            self.xyz_writer('scratch/{}_{:03}_{:03}.xyz'.format(stage, self.ID, iteration), self.geometries, self.energies, self.gradrmss, self.dEs)
+
+    @staticmethod
+    def memory_report(nodes):
+        '''
+        Table of the approximate memory (MB) held by each node, see
+        Molecule.memory_usage. Objects shared between nodes (e.g. with the
+        share_primitives coordinate option) are counted at the first node.
+        '''
+        seen = set()
+        lines = []
+        totals = None
+        for n, node in enumerate(nodes):
+            if node is None:
+                continue
+            usage = node.memory_usage(seen)
+            if totals is None:
+                totals = Counter()
+                lines.append(" node " + ''.join("{:>12s}".format(key) for key in usage) + "{:>12s}".format('total'))
+            totals.update(usage)
+            lines.append(" {:4d} ".format(n) + ''.join("{:12.3f}".format(val/1024./1024.) for val in usage.values()) + "{:12.3f}".format(sum(usage.values())/1024./1024.))
+        if totals is not None:
+            lines.append(" all  " + ''.join("{:12.3f}".format(totals[key]/1024./1024.) for key in usage) + "{:12.3f}".format(sum(totals.values())/1024./1024.))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def batch_evaluate_nodes(nodes):
+        '''
+        Compute the energies and gradients of all the nodes with a single
+        run_batch call on the first node's LoT, the results are handed to each
+        node's own LoT so the optimizers find them already computed.  The node
+        ids are passed along so per-node wavefunctions stay with their node.
+        Nodes whose LoT already ran at the current geometry are skipped.
+        '''
+
+        todo = []
+        for node in nodes:
+            if node is None:
+                continue
+            lot = node.PES.lot
+            if lot.hasRanForCurrentCoords and np.array_equal(lot.currentCoords, node.xyz):
+                continue
+            todo.append(node)
+        if not todo:
+            return
+
+        print(" Computing {} nodes with one batched LoT call".format(len(todo)))
+        results = todo[0].PES.lot.run_batch([node.xyz for node in todo], todo[0].PES.batch_states,
+                                            [node.PES.lot.node_id for node in todo])
+        for node, result in zip(todo, results):
+            node.PES.lot.set_results(node.xyz, *result)
@@ -17,15 +17,22 @@ from utilities.nifty import printcool
 from utilities.manage_xyz import xyz_to_np
 from utilities import units
 from utilities import block_matrix
+from utilities.math_utils import davidson_lowest
 from coordinate_systems import rotate
 from optimizers import eigenvector_follow
-import multiprocessing as mp
-from itertools import chain
 from copy import deepcopy
 
-def worker(arg):
-    obj, methname = arg[:2]
-    return getattr(obj, methname)(*arg[2:])
+
+def optimize_node(arg):
+    '''
+    Optimize a single node, returns the optimizer and node since a
+    process executor works on copies of them.
+    '''
+    n, optimizer, node, kwargs = arg
+    print()
+    printcool("Optimizing node {}".format(n))
+    optimizer.optimize(molecule=node, **kwargs)
+    return optimizer, node
 
 
 #######################################################################################
@@ -63,7 +70,7 @@ class MainGSM(GSM):
             printcool("Starting growth iteration %i" % iteration)
             self.optimize_iteration(max_opt_steps)
             totalgrad, gradrms, sum_gradrms = self.calc_optimization_metrics(self.nodes)
-            self.xyz_writer('scratch/growth_iters_{:03}_{:03}.xyz'.format(self.ID, iteration), self.geometries, self.energies, self.gradrmss, self.dEs)
+            self.write_iteration('growth_iters', iteration)
             print(" gopt_iter: {:2} totalgrad: {:4.3} gradrms: {:5.4} max E: {:5.4}\n".format(iteration, float(totalgrad), float(gradrms), float(self.emax)))
 
             try:
@@ -260,8 +267,7 @@ class MainGSM(GSM):
             print(f'{stage_changed=}: {self.climb=} {self.find=}')
 
             # => write Convergence to file <= #
-            filename = 'scratch/opt_iters_{:03}_{:03}.xyz'.format(self.ID, oi)
-            self.xyz_writer(filename, self.geometries, self.energies, self.gradrmss, self.dEs)
+            self.write_iteration('opt_iters', oi)
 
             print(" End early counter {}".format(self.endearly_counter))
 
@@ -306,16 +312,7 @@ class MainGSM(GSM):
                         self.nodes[n].coord_basis = Vecs
 
             else:
-                pool = mp.Pool(self.mp_cores)
-                Vecs = pool.map(worker, ((self.newic.coord_obj, "build_dlc", self.nodes[n].xyz, self.ictan[n]) for n in range(1, self.nnodes-1) if self.nodes[n] is not None))
-                pool.close()
-                pool.join()
-
-                i = 0
-                for n in range(1, self.nnodes-1):
-                    if self.nodes[n] is not None:
-                        self.nodes[n].coord_basis = Vecs[i]
-                        i += 1
+                self.reparam_pool.update_bases(self.newic.coord_obj, self.nodes, [(n, self.ictan[n]) for n in range(1, self.nnodes-1) if self.nodes[n] is not None])
         else:
             if self.find or self.climb:
                 TSnode = self.TSnode
@@ -326,12 +323,7 @@ class MainGSM(GSM):
                             Vecs = self.newic.coord_obj.build_dlc(self.nodes[n].xyz, self.ictan[n])
                             self.nodes[n].coord_basis = Vecs
                 else:
-                    pool = mp.Pool(self.mp_cores)
-                    Vecs = pool.map(worker, ((self.newic.coord_obj, "build_dlc", self.nodes[n].xyz, self.ictan[n]) for n in range(1, self.nnodes-1) if n != TSnode))
-                    pool.close()
-                    pool.join()
-                    for i, n in enumerate(chain(range(1, TSnode), range(TSnode+1, self.nnodes-1))):
-                        self.nodes[n].coord_basis = Vecs[i]
+                    self.reparam_pool.update_bases(self.newic.coord_obj, self.nodes, [(n, self.ictan[n]) for n in range(1, self.nnodes-1) if n != TSnode])
 
                     if update_TS:
                         Vec = self.newic.coord_obj.build_dlc(self.nodes[TSnode].xyz, self.ictan[TSnode])
@@ -342,13 +334,10 @@ class MainGSM(GSM):
                     Vecs = []
                     for n in range(1, self.nnodes-1):
                         Vecs.append(self.newic.coord_obj.build_dlc(self.nodes[n].xyz, self.ictan[n]))
-                elif self.mp_cores > 1:
-                    pool = mp.Pool(self.mp_cores)
-                    Vecs = pool.map(worker, ((self.newic.coord_obj, "build_dlc", self.nodes[n].xyz, self.ictan[n]) for n in range(1, self.nnodes-1)))
-                    pool.close()
-                    pool.join()
-                for n, node in enumerate(self.nodes[1:self.nnodes-1]):
-                    node.coord_basis = Vecs[n]
+                    for n, node in enumerate(self.nodes[1:self.nnodes-1]):
+                        node.coord_basis = Vecs[n]
+                else:
+                    self.reparam_pool.update_bases(self.newic.coord_obj, self.nodes, [(n, self.ictan[n]) for n in range(1, self.nnodes-1)])
 
     def optimize_iteration(self, opt_steps):
         '''
@@ -357,22 +346,36 @@ class MainGSM(GSM):
 
         refE = self.nodes[0].energy
 
+        # The nodes are independent within an iteration, so they are handed to
+        # the node executor together and the gradients are evaluated concurrently
+        jobs = []
         for n in range(self.nnodes):
             if self.nodes[n] and self.active[n]:
-                print()
                 path = os.path.join(os.getcwd(), 'scratch/{:03d}/{}'.format(self.ID, n))
-                printcool("Optimizing node {}".format(n))
                 opt_type = self.set_opt_type(n)
                 osteps = self.mult_steps(n, opt_steps)
-                self.optimizer[n].optimize(
-                    molecule=self.nodes[n],
+                jobs.append((n, self.optimizer[n], self.nodes[n], dict(
                     refE=refE,
                     opt_type=opt_type,
                     opt_steps=osteps,
                     ictan=self.ictan[n],
                     xyzframerate=1,
                     path=path,
-                )
+                )))
+
+        # LoTs that evaluate many geometries faster in one call get all the starting points at once
+        if len(jobs) > 1 and self.nodes[0].PES.lot.native_batch:
+            self.batch_evaluate_nodes([job[2] for job in jobs])
+
+        if len(jobs) > 1 and self.node_executor.ncores > 1:
+            print(" Optimizing {} nodes with {}".format(len(jobs), self.node_executor))
+        results = self.node_executor.map(optimize_node, jobs)
+        for job, (optimizer, node) in zip(jobs, results):
+            if node is not job[2]:
+                # a process executor sends back copies, share the primitives again
+                node.coord_obj.Prims.reshare(job[2].coord_obj.Prims)
+            self.optimizer[job[0]] = optimizer
+            self.nodes[job[0]] = node
 
         if self.__class__.__name__ == "SE-GSM" and self.done_growing:
             fp = self.find_peaks('opting')
@@ -411,6 +414,10 @@ class MainGSM(GSM):
             print(ncurrent)
             print(nlist)
 
+        if self.__class__.__name__ == "DE_GSM":
+            # all the tangents of the string at once
+            tangents = self.get_tangents_xyz(self.nodes, [(nlist[2*n], nlist[2*n+1]) for n in range(ncurrent)])
+
         for n in range(ncurrent):
             # ictan0,_ = self.get_tangent(
             #        node1=self.nodes[nlist[2*n]],
@@ -420,9 +427,7 @@ class MainGSM(GSM):
 
             if self.__class__.__name__ == "DE_GSM":  # or self.__class__.__name__=="SE_Cross":
                 print(" getting tangent [%i ]from between %i %i pointing towards %i" % (nlist[2*n], nlist[2*n], nlist[2*n+1], nlist[2*n]))
-                ictan0 = self.get_tangent_xyz(self.nodes[nlist[2*n]].xyz,
-                                              self.nodes[nlist[2*n+1]].xyz,
-                                              self.nodes[0].primitive_internal_coordinates)
+                ictan0 = np.reshape(tangents[n], (-1, 1))
             else:
                 ictan0, _ = self.get_tangent(
                     node1=self.nodes[nlist[2*n]],
@@ -625,7 +630,7 @@ class MainGSM(GSM):
         '''
         if self.interp_method == 'DLC':
             # print('reparameterizing')
-            self.ic_reparam(nodes=self.nodes, energies=self.energies, climbing=(self.climb or self.find), ic_reparam_steps=ic_reparam_steps, NUM_CORE=self.mp_cores)
+            self.ic_reparam(nodes=self.nodes, energies=self.energies, climbing=(self.climb or self.find), ic_reparam_steps=ic_reparam_steps, NUM_CORE=self.mp_cores, pool=self.reparam_pool, coord_obj=self.newic.coord_obj)
         return
 
     def ic_reparam_g(self, ic_reparam_steps=4, n0=0, reparam_interior=True):  # see line 3863 of gstring.cpp
@@ -712,27 +717,7 @@ class MainGSM(GSM):
             tan_list = self.make_tan_list()
 
             if self.mp_cores > 1:
-                pool = mp.Pool(self.mp_cores)
-                Vecs = pool.map(worker, ((self.nodes[0].coord_obj, "build_dlc", self.nodes[n].xyz, self.ictan[ntan]) for n, ntan in zip(move_list, tan_list) if rpmove[n] < 0))
-                pool.close()
-                pool.join()
-
-                i = 0
-                for n in move_list:
-                    if rpmove[n] < 0:
-                        self.nodes[n].coord_basis = Vecs[i]
-                        i += 1
-
-                # move the positions
-                pool = mp.Pool(self.mp_cores)
-                newXyzs = pool.map(worker, ((self.nodes[n].coord_obj, "newCartesian", self.nodes[n].xyz, rpmove[n]*self.nodes[n].constraints[:, 0]) for n in move_list if rpmove[n] < 0))
-                pool.close()
-                pool.join()
-                i = 0
-                for n in move_list:
-                    if rpmove[n] < 0:
-                        self.nodes[n].xyz = newXyzs[i]
-                        i += 1
+                self.reparam_pool.move_nodes(self.newic.coord_obj, self.nodes, [(n, self.ictan[ntan], rpmove[n]) for n, ntan in zip(move_list, tan_list) if rpmove[n] < 0])
             else:
                 for nmove, ntan in zip(move_list, tan_list):
                     if rpmove[nmove] < 0:
@@ -828,6 +813,9 @@ class MainGSM(GSM):
 
         self.nodes[TSnode].newHess = 5
 
+        if self.options['ts_mode_refinement'] > 0:
+            self.refine_TS_mode(tan)
+
         if False:
             print("newHess of node %i %i" % (TSnode, self.nodes[TSnode].newHess))
             eigen, tmph = np.linalg.eigh(self.nodes[TSnode].Hessian)  # nicd,nicd
@@ -836,6 +824,25 @@ class MainGSM(GSM):
 
         # reset pgradrms ?
 
+    def refine_TS_mode(self, guess):
+        '''
+        Refines the lowest mode of the TS node Hessian, starting from guess (the
+        reaction path tangent in the node's coordinate basis), with a Davidson
+        search on finite difference Hessian-vector products and replaces the
+        curvature of that mode in the Hessian by the refined one.
+        '''
+        node = self.nodes[self.TSnode]
+        H = node.Hessian
+        theta, u, nprod = davidson_lowest(node.Hessian_vector_product, guess, H0=H, max_iter=self.options['ts_mode_refinement'])
+
+        uHu = np.dot(u.T, np.dot(H, u)).item()
+        overlap = abs(np.dot(u.T, guess).item())/np.linalg.norm(guess)
+        print(" TS mode curvature %1.4f -> %1.4f (overlap with the path %1.2f) from %i Hessian-vector products" % (uHu, theta, overlap, nprod))
+
+        # make u an eigenvector with eigenvalue theta
+        P = np.eye(len(u)) - np.outer(u, u)
+        node.Hessian = np.dot(P, np.dot(H, P)) + theta*np.outer(u, u)
+
     def mult_steps(self, n, opt_steps):
         exsteps = 1
         tsnode = int(self.TSnode)
@@ -1160,11 +1167,14 @@ class MainGSM(GSM):
         # set coordinates from geoms
         self.nodes[0].xyz = xyz_to_np(geoms[0])
         self.nodes[nstructs-1].xyz = xyz_to_np(geoms[-1])
-        for struct in range(1, nstructs-1):
-            self.nodes[struct] = Molecule.copy_from_options(self.nodes[struct-1],
-                                                            xyz_to_np(geoms[struct]),
-                                                            new_node_id=struct,
-                                                            copy_wavefunction=False)
+        # the interior nodes are independent copies of the reactant, build them all at once
+        interior = Molecule.copies_from_options(self.nodes[0],
+                                                [xyz_to_np(geom) for geom in geoms[1:nstructs-1]],
+                                                new_node_ids=list(range(1, nstructs-1)),
+                                                copy_wavefunction=False,
+                                                executor=self.node_executor)
+        for struct, node in enumerate(interior, start=1):
+            self.nodes[struct] = node
             self.nodes[struct].newHess = 5
             # Turning this off
             # self.nodes[struct].gradrms = np.sqrt(np.dot(self.nodes[struct].gradient,self.nodes
@@ -6,6 +6,8 @@ Written by Tamas K. Stenczel in 2021
 """
 import importlib
 
+import numpy as np
+
 try:
     from ase import Atoms
     from ase.calculators.calculator import Calculator
@@ -19,18 +21,26 @@ except ModuleNotFoundError:
     print("ASE not installed, ASE-based calculators will not work")
 
 from .base_lot import Lot, LoTError
+from utilities import manage_xyz
 
 
 class ASELoT(Lot):
     """
     Warning:
         multiplicity is not implemented, the calculator ignores it
+
+    Each lot keeps one Atoms object with the calculator attached and only
+    moves its positions, so calculators that keep a wavefunction or charges
+    between calls restart from the previous geometry of the node.
     """
 
+    native_batch = True
+
     def __init__(self, calculator: Calculator, options):
         super(ASELoT, self).__init__(options)
 
         self.ase_calculator = calculator
+        self.ase_atoms = None
 
     @classmethod
     def from_options(cls, calculator: Calculator, **kwargs):
@@ -69,11 +79,50 @@ class ASELoT(Lot):
         # construct from the constructor
         return cls.from_options(calc_class(**calculator_kwargs), **kwargs)
 
+    def cache_signature(self, runtype=None):
+        # the calculator is not one of the options
+        return super(ASELoT, self).cache_signature(runtype) + (self.signature_value(self.ase_calculator),)
+
+    def signature_value(self, value):
+        if Calculator is not None and isinstance(value, Calculator):
+            # the calculator kwargs end up in its parameters
+            return (type(value).__module__, type(value).__name__, self.signature_value(dict(getattr(value, 'parameters', {}))))
+        return super(ASELoT, self).signature_value(value)
+
     def run(self, geom, mult, ad_idx, runtype='gradient'):
         # run ASE
-        mol = xyz_to_ase(geom,cell=self.cell)
-        self.run_ase_atoms(mol, mult, ad_idx, runtype)
+        if self.ase_atoms is None:
+            self.ase_atoms = xyz_to_ase(geom, cell=self.cell)
+        else:
+            self.ase_atoms.set_positions(manage_xyz.xyz_to_np(geom))
+        self.run_ase_atoms(self.ase_atoms, mult, ad_idx, runtype)
+
+
+    def run_batch(self, coords_list, states=None, node_ids=None):
+        """
+        Batched evaluation: a single Atoms object carries the calculator and
+        only its positions change between geometries, so the Atoms
+        construction and calculator attachment are paid once per batch.
+        The calculator ignores the multiplicity, every state gets the same result.
+        """
+        if states is None:
+            states = self.states
+        if len(coords_list) == 0:
+            return []
+
+        atoms = xyz_to_ase(manage_xyz.np_to_xyz(self.geom, coords_list[0]), cell=self.cell)
+        atoms.set_calculator(self.ase_calculator)
 
+        results = []
+        for coords in coords_list:
+            atoms.set_positions(np.asarray(coords).reshape(-1, 3))
+            gradient = self.Gradient(- atoms.get_forces() / units.Ha * units.Bohr, 'Hartree/Bohr')
+            energy = self.Energy(atoms.get_potential_energy() / units.Ha, 'Hartree')
+            results.append(({state: energy for state in states}, {state: gradient for state in states}, {}))
+
+        self.set_results(coords_list[-1], *results[-1])
+        self.write_E_to_file()
+        return results
 
     def run_ase_atoms(self, atoms: Atoms, mult, ad_idx, runtype='gradient'):
         # set the calculator
@@ -114,9 +163,13 @@ def xyz_to_ase(xyz,cell=None):
 
     """
 
-    # compatible with list-of-list as well
-    numbers = [atomic_numbers[x[0]] for x in xyz]
-    pos = [x[1:4] for x in xyz]
+    if manage_xyz.is_geometry(xyz):
+        numbers = [atomic_numbers[a] for a in xyz.atoms]
+        pos = xyz.xyz
+    else:
+        # compatible with list-of-list as well
+        numbers = [atomic_numbers[x[0]] for x in xyz]
+        pos = [x[1:4] for x in xyz]
     if cell:
         return geom_to_ase(numbers, pos, cell=cell)
     else:
@@ -1,6 +1,8 @@
 # standard library imports
-from collections import namedtuple
+from collections import Counter, namedtuple
+import hashlib
 import os
+import threading
 
 # third party
 import numpy as np
@@ -9,11 +11,16 @@ import numpy as np
 from utilities import manage_xyz, options, elements, nifty, units
 try:
     from .file_options import File_Options
+    from .lot_cache import LotCache
 except:
     from file_options import File_Options
+    from lot_cache import LotCache
 
 ELEMENT_TABLE = elements.ElementData()
 
+# how much of what a runtype computes, a run covers requests of lower or equal rank
+RUNTYPE_RANK = {'energy': 0, None: 1, 'gradient': 2}
+
 # TODO take out all job-specific data -- encourage external files since those are most customizable
 # TODO fix tuple searches
 # TODO Make energies,grada dictionaries
@@ -38,6 +45,18 @@ Coupling = namedtuple('Coupling','value unit')
 class Lot(object):
     """ Lot object for level of theory calculators """
 
+    # True if run_batch is faster than running the geometries one by one
+    native_batch = False
+
+    # energy/gradient/coupling requests of all the lots in this process and
+    # how they were served, see run_report
+    run_stats = Counter(requests=0, runs=0, cached=0, reused=0)
+    _stats_lock = threading.Lock()
+
+    # options that say where or how the results are computed but not what they
+    # are, left out of the cache signature
+    cache_ignore_options = ('geom', 'fnm', 'node_id', 'ID', 'nproc', 'cache_dir', 'cache_max_mb')
+
     @staticmethod
     def default_options():
         """ Lot default options. """
@@ -195,6 +214,24 @@ class Lot(object):
             doc='xTB solvent'
         )
 
+        opt.add_option(
+            key='cache_dir',
+            value=None,
+            required=False,
+            allowed_types=[str],
+            doc='Directory of the persistent energy/gradient cache. Results are keyed by the\
+                    coordinates, atoms, charge, states and LoT options so the directory can be shared\
+                    between nodes, strings and restarts. None turns the cache off.'
+        )
+
+        opt.add_option(
+            key='cache_max_mb',
+            value=1024.,
+            required=False,
+            allowed_types=[int, float],
+            doc='Size of the cache directory after which the least recently used results are removed'
+        )
+
         Lot._default_options = opt
         return Lot._default_options.copy()
 
@@ -257,6 +294,9 @@ class Lot(object):
         else:
             raise RuntimeError("Need to initialize LOT object")
 
+        # array-native, so np_to_xyz only has to wrap new coordinates
+        self.geom = manage_xyz.Geometry.from_geom(self.geom)
+
         # Cache some useful atributes - other useful attributes are properties
         self.currentCoords = manage_xyz.xyz_to_np(self.geom)
         self.atoms = manage_xyz.get_atoms(self.geom)
@@ -272,6 +312,7 @@ class Lot(object):
 
         # Bools for running
         self.hasRanForCurrentCoords = False
+        self.currentRuntype = None
         self.has_nelectrons = False
 
         # Read file options if they exist and not already set
@@ -388,6 +429,25 @@ class Lot(object):
     def copy(cls, lot, options={}, copy_wavefunction=True):
         return cls(lot.options.copy().set_values(options))
 
+    def request_gradients(self, states):
+        ''' Add states to gradient_states so that a single runall computes all their gradients '''
+        if self.gradient_states is None:
+            return
+        missing = [tuple(state) for state in states if tuple(state) not in self.gradient_states]
+        if missing:
+            print(" adding {} to the gradient states".format(missing))
+            self.gradient_states = list(self.gradient_states) + missing
+
+    @classmethod
+    def count(cls, key, n=1):
+        ''' Add n to run_stats[key], the nodes may run in threads '''
+        with cls._stats_lock:
+            cls.run_stats[key] += n
+
+    @classmethod
+    def run_report(cls):
+        return " LoT: {requests} requests, {runs} runs, {cached} from the cache, {reused} reused from the last run".format(**cls.run_stats)
+
     def check_multiplicity(self, multiplicity):
         if multiplicity > self.n_electrons + 1:
             raise ValueError("Spin multiplicity too high.")
@@ -405,13 +465,91 @@ class Lot(object):
         self.check_multiplicity(multiplicity)
         return
 
+    @property
+    def cache(self):
+        if self.options['cache_dir'] is None:
+            return None
+        return LotCache.get(self.options['cache_dir'], self.options['cache_max_mb'])
+
+    def cache_signature(self, runtype=None):
+        ''' Everything besides the coordinates that determines the results: the LoT, the atoms and the options '''
+        return (type(self).__name__, tuple(self.atoms), runtype) + tuple(
+            (key, self.signature_value(self.options[key]))
+            for key in sorted(self.options.keys()) if key not in self.cache_ignore_options
+        ) + (('lot_inp_file', self.file_hash(self.lot_inp_file)),)
+
+    def signature_value(self, value):
+        '''
+        Hashable form of an option value for cache_signature that is the same
+        in every process. LoTs keeping objects in their options (calculators,
+        simulations, clients) extend it to describe those by what determines
+        their results, other objects are only equal to themselves.
+        '''
+        if value is None or isinstance(value, (bool, int, float, str, bytes)):
+            return value
+        if isinstance(value, np.ndarray):
+            return (value.shape, hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest())
+        if isinstance(value, dict):
+            return tuple(sorted((str(key), self.signature_value(val)) for key, val in value.items()))
+        if isinstance(value, (list, tuple)):
+            return tuple(self.signature_value(val) for val in value)
+        if isinstance(value, File_Options):
+            return (self.signature_value(value.UserOptions), self.signature_value(value.ActiveOptions))
+        # the default repr holds the address, so a miss rather than a wrong hit
+        return (type(value).__module__, type(value).__name__, repr(value))
+
+    @staticmethod
+    def file_hash(filename):
+        if filename is None or not os.path.exists(filename):
+            return None
+        with open(filename, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def pack_results(self):
+        return tuple({key: tuple(val) for key, val in d.items()} for d in (self.Energies, self.Gradients, self.Couplings))
+
+    def unpack_results(self, packed):
+        energies, gradients, couplings = packed
+        return (
+            {key: self.Energy(*val) for key, val in energies.items()},
+            {key: self.Gradient(*val) for key, val in gradients.items()},
+            {key: self.Coupling(*val) for key, val in couplings.items()},
+        )
+
+    def run_for_coords(self, coords, runtype=None):
+        '''
+        runall at coords unless the results are already known from the last call or the cache.
+        One runall computes every state, so all the PES objects sharing this lot
+        (e.g. the two states of a Penalty_PES or Avg_PES) are served by one run per geometry.
+        '''
+        Lot.count('requests')
+        if self.hasRanForCurrentCoords and not (coords != self.currentCoords).any() and \
+                RUNTYPE_RANK.get(self.currentRuntype, 1) >= RUNTYPE_RANK.get(runtype, 1):
+            Lot.count('reused')
+            return
+        self.currentCoords = coords.copy()
+        self.currentRuntype = runtype
+
+        cache = self.cache
+        if cache is not None:
+            key = cache.make_key(coords, self.cache_signature(runtype))
+            packed = cache.load(key)
+            if packed is not None:
+                self.set_results(coords, *self.unpack_results(packed))
+                self.currentRuntype = runtype
+                Lot.count('cached')
+                return
+
+        geom = manage_xyz.np_to_xyz(self.geom, self.currentCoords)
+        self.runall(geom, runtype)
+        Lot.count('runs')
+        self.hasRanForCurrentCoords = True
+        if cache is not None:
+            cache.store(key, self.pack_results())
+
     def get_energy(self, coords, multiplicity, state, runtype=None):
-        if self.hasRanForCurrentCoords is False or (coords != self.currentCoords).any():
-            self.currentCoords = coords.copy()
-            geom = manage_xyz.np_to_xyz(self.geom,self.currentCoords)
-            self.runall(geom,runtype)
-            self.hasRanForCurrentCoords=True
-        
+        self.run_for_coords(coords, runtype)
+
         Energy = self.Energies[(multiplicity,state)]
         if Energy.unit=="Hartree":
             return Energy.value*units.KCAL_MOL_PER_AU
@@ -421,11 +559,7 @@ class Lot(object):
             return Energy.value
 
     def get_gradient(self, coords, multiplicity, state, frozen_atoms=None):
-        if self.hasRanForCurrentCoords is False or (coords != self.currentCoords).any():
-            self.currentCoords = coords.copy()
-            geom = manage_xyz.np_to_xyz(self.geom, self.currentCoords)
-            self.runall(geom)
-            self.hasRanForCurrentCoords=True
+        self.run_for_coords(coords)
         Gradient = self.Gradients[(multiplicity,state)]
         if Gradient.value is not None:
             if frozen_atoms is not None:
@@ -441,11 +575,7 @@ class Lot(object):
             return None
 
     def get_coupling(self, coords, multiplicity, state1, state2, frozen_atoms=None):
-        if self.hasRanForCurrentCoords is False or (coords != self.currentCoords).any():
-            self.currentCoords = coords.copy()
-            geom = manage_xyz.np_to_xyz(self.geom, self.currentCoords)
-            self.runall(geom)
-            self.hasRanForCurrentCoords=True
+        self.run_for_coords(coords)
         Coupling = self.Couplings[(state1,state2)]
 
         if Coupling.value is not None:
@@ -481,6 +611,50 @@ class Lot(object):
             else:
                 self.run(geom, mult, ad_idx, 'energy')
 
+    def run_batch(self, coords_list, states=None, node_ids=None):
+        """ Run several geometries in a single call
+
+        Params:
+            coords_list - list of (natoms,3) np.ndarray in Angstrom
+            states - list of (multiplicity,state) tuples, defaults to self.states
+            node_ids - node each geometry belongs to, defaults to self.node_id for all.
+                LoTs that keep per-node state (orbitals, restarts) guess from and
+                store into the node of each geometry.
+
+        Returns:
+            list of (Energies,Gradients,Couplings) dictionaries, one per geometry,
+            keyed the same way as self.Energies, self.Gradients and self.Couplings
+
+        This fallback runs the geometries one after the other, LoTs with a
+        faster batched interface override it. Afterwards the LoT holds the
+        results of the last geometry.
+        """
+        results = []
+        for coords in coords_list:
+            if states is None or all(state in self.states for state in states):
+                self.run_for_coords(coords)
+            else:
+                geom = manage_xyz.np_to_xyz(self.geom, coords)
+                self.Gradients = {}
+                self.Energies = {}
+                self.Couplings = {}
+                for mult, ad_idx in states:
+                    self.run(geom, mult, ad_idx)
+                Lot.count('runs')
+            results.append((dict(self.Energies), dict(self.Gradients), dict(self.Couplings)))
+        if results:
+            self.set_results(coords_list[-1], *results[-1])
+        return results
+
+    def set_results(self, coords, energies, gradients, couplings=None):
+        """ Use results computed elsewhere (e.g. by run_batch) as the results for coords """
+        self.currentCoords = np.array(coords, dtype=float).reshape(-1, 3)
+        self.Energies = dict(energies)
+        self.Gradients = dict(gradients)
+        self.Couplings = dict(couplings) if couplings is not None else {}
+        self.hasRanForCurrentCoords = True
+        self.currentRuntype = None
+
     #    self.E=[]
     #    self.grada = []
     #    singlets=self.search_tuple(self.states,1)
@@ -113,6 +113,9 @@ class File_Options(object):
         self.InactiveWarnings[key] = msg
 
     def __getattr__(self, key):
+        # the option dicts don't exist yet while unpickling (e.g. in a process pool worker)
+        if key in ('ActiveOptions', 'InactiveOptions') or key.startswith('__'):
+            raise AttributeError(key)
         if key in self.ActiveOptions:
             return self.ActiveOptions[key]
         elif key in self.InactiveOptions:
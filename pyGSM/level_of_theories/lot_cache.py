@@ -0,0 +1,153 @@
+# standard library imports
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+# third party
+import numpy as np
+
+
+class LotCache(object):
+    """ Content addressed store of level of theory results
+
+    Results are keyed by a hash of the rounded coordinates and a signature of
+    everything else that determines them (atoms, charge, states, LoT options).
+    A small in-memory LRU tier sits in front of a directory with one pickle
+    per geometry.  The directory is trimmed back to max_mb, least recently
+    used files first, so it can be shared between the node LoT copies of a
+    string, between strings with different -ID and between restarts.
+
+    One instance is shared per directory within a process, use LotCache.get.
+    The memory tier and the counters are guarded by a lock since the nodes
+    may run on a thread executor.
+    """
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, path, max_mb=1024., memory_entries=256):
+        path = os.path.abspath(path)
+        with cls._registry_lock:
+            if path not in cls._registry:
+                cls._registry[path] = cls(path, max_mb, memory_entries)
+            return cls._registry[path]
+
+    def __init__(self, path, max_mb=1024., memory_entries=256):
+        self.path = path
+        self.max_bytes = int(max_mb*1024*1024)
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path, exist_ok=True)
+        self.nbytes = sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.name.endswith('.pkl'))
+
+    @staticmethod
+    def make_key(coords, signature, decimals=8):
+        ''' sha1 of the signature and the coordinates rounded to decimals (Angstrom) '''
+        xyz = np.round(np.asarray(coords, dtype=float).reshape(-1, 3), decimals) + 0.  # +0. gets rid of -0.
+        h = hashlib.sha1(repr(signature).encode())
+        h.update(xyz.tobytes())
+        return h.hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key + '.pkl')
+
+    def load(self, key):
+        ''' Returns the stored value or None '''
+        with self.lock:
+            data = self.memory.get(key, None)
+            if data is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+        if data is not None:
+            return pickle.loads(data)
+
+        fname = self.filename(key)
+        try:
+            with open(fname, 'rb') as f:
+                data = f.read()
+            value = pickle.loads(data)
+            os.utime(fname, None)  # mark as recently used
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.disk_hits += 1
+            self._remember(key, data)
+        return value
+
+    def store(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self._remember(key, data)
+
+        # write then rename so other processes and threads never read half a file
+        fname = self.filename(key)
+        tmp = '{}.{}.{}.tmp'.format(fname, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        with self.lock:
+            try:
+                # an overwritten file no longer counts
+                self.nbytes -= os.path.getsize(fname)
+            except OSError:
+                pass
+            os.replace(tmp, fname)
+            self.nbytes += len(data)
+            if self.nbytes > self.max_bytes:
+                self._trim()
+
+    def _remember(self, key, data):
+        ''' Add to the memory tier, call with the lock held '''
+        self.memory[key] = data
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def trim(self):
+        ''' Delete the least recently used files until 90% of max_bytes is left '''
+        with self.lock:
+            self._trim()
+
+    def _trim(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        self.nbytes = sum(e[1] for e in entries)
+        for mtime, size, fname in entries:
+            if self.nbytes <= 0.9*self.max_bytes:
+                break
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+            self.nbytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            for entry in os.scandir(self.path):
+                if entry.name.endswith('.pkl'):
+                    os.remove(entry.path)
+            self.nbytes = 0
+
+    def __repr__(self):
+        return "LotCache({}: {} memory hits, {} disk hits, {} misses, {} evictions, {:.1f} MB)".format(
+            self.path, self.memory_hits, self.disk_hits, self.misses, self.evictions, self.nbytes/1024./1024.)
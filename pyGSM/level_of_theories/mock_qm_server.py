@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Mock QM worker for the QMServer level of theory, see qmserver.ServerProcess
+for the protocol.  It lets the persistent server machinery be tested
+without a real electronic structure code:
+
+    gsm -package QMServer -qm_server_command "python /path/to/mock_qm_server.py --startup 2" ...
+
+The energy is a sum of Morse pair potentials with minima at the sum of
+the covalent radii.  Excited states and higher multiplicities are shifted
+copies of the ground state.  An "orbital" file is kept in the working
+directory between calls (and can be seeded from another worker's
+guess_dir) so cold and warm starts can be told apart.
+"""
+# standard library imports
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+# third party
+import numpy as np
+
+BOHR_PER_ANGSTROM = 1.8897261246
+COVALENT_RADII = {'H': 0.31, 'C': 0.76, 'N': 0.71, 'O': 0.66, 'F': 0.57, 'S': 1.05, 'Cl': 1.02}
+MORSE_D = 0.1  # Hartree
+MORSE_A = 1.0  # 1/Bohr
+STATE_SHIFT = 0.1  # Hartree per adiabatic index
+SPIN_SHIFT = 0.02  # Hartree per unpaired electron
+ORBITAL_FILE = 'orbitals.npy'
+
+
+def morse(symbols, xyz):
+    ''' Energy (Hartree) and gradient (Hartree/Bohr) for coordinates in Bohr '''
+    r0 = np.array([COVALENT_RADII.get(s, 0.75) for s in symbols]) * BOHR_PER_ANGSTROM
+    i, j = np.triu_indices(len(symbols), 1)
+    d = xyz[i] - xyz[j]
+    r = np.linalg.norm(d, axis=1)
+    e = np.exp(-MORSE_A*(r - r0[i] - r0[j]))
+    energy = np.sum(MORSE_D*(1. - e)**2 - MORSE_D)
+    dEdr = 2.*MORSE_D*MORSE_A*(1. - e)*e
+    pair = (dEdr/r)[:, None]*d
+    gradient = np.zeros_like(xyz)
+    np.add.at(gradient, i, pair)
+    np.add.at(gradient, j, -pair)
+    return energy, gradient
+
+
+def compute(request):
+    symbols = [atom[0] for atom in request['geom']]
+    xyz = np.array([atom[1:4] for atom in request['geom']], dtype=float) * BOHR_PER_ANGSTROM
+    energy, gradient = morse(symbols, xyz)
+
+    # warm start if there are orbitals of this or another worker
+    warm = os.path.exists(ORBITAL_FILE)
+    guess_dir = request.get('guess_dir')
+    if not warm and guess_dir and os.path.exists(os.path.join(guess_dir, ORBITAL_FILE)):
+        shutil.copy(os.path.join(guess_dir, ORBITAL_FILE), ORBITAL_FILE)
+        warm = True
+    np.save(ORBITAL_FILE, xyz)
+
+    def shift(state):
+        mult, ad_idx = state
+        return STATE_SHIFT*ad_idx + SPIN_SHIFT*(mult - 1)
+
+    reply = {
+        'energies': [energy + shift(state) for state in request['states']],
+        'gradients': [gradient.tolist() for state in request['gradient_states']],
+        'coupling': None,
+        'warm': warm,
+    }
+    if request.get('coupling_states'):
+        reply['coupling'] = (1e-3*gradient).tolist()
+    return reply
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--startup', type=float, default=0., help='seconds to sleep at startup (license checkout etc.)')
+    parser.add_argument('--delay', type=float, default=0., help='seconds to sleep per cold calculation')
+    args = parser.parse_args()
+
+    time.sleep(args.startup)
+    print(json.dumps({'ready': True}), flush=True)
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if request.get('command') == 'exit':
+            break
+        try:
+            reply = compute(request)
+            if not reply['warm']:
+                time.sleep(args.delay)
+        except Exception as e:
+            reply = {'error': '{}: {}'.format(type(e).__name__, e)}
+        print(json.dumps(reply), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ from os import path
 import re
 from collections import namedtuple
 import copy as cp
+from concurrent.futures import ThreadPoolExecutor
 # third party
 import numpy as np
 
@@ -25,6 +26,8 @@ from utilities import *
 
 class nanoreactor_engine(Lot):
 
+    native_batch = True
+
     def __init__(self,options):
         super(nanoreactor_engine,self).__init__(options)
         # can we do a check here?
@@ -119,6 +122,71 @@ class nanoreactor_engine(Lot):
             self.options['job_data']['orbfile'].update({self.node_id: orb_a_path + ' ' + orb_b_path})
         # Store the values in memory
 
+    def run_batch(self, coords_list, states=None, node_ids=None):
+        '''
+        Submit all the geometries to the engine at once so its job queue can
+        work on them concurrently.  Each geometry starts from the orbitals of
+        its node (or of a neighbouring node, as in run) and its orbitals are
+        stored for that node.  Without a guess for every geometry the serial
+        path is used since it knows how to generate one safely.
+        '''
+        if node_ids is None:
+            node_ids = [self.node_id]*len(coords_list)
+        orbfile = self.options['job_data']['orbfile']
+        guesses = [self.orb_guess(node_id) for node_id in node_ids]
+        if len(coords_list) < 2 or any(guess is None for guess in guesses):
+            return self.run_batch_serial(coords_list, states, node_ids)
+        if states is None:
+            states = self.states
+
+        if self.engine.options['closed_shell']:
+            fields = ('energy', 'gradient', 'orbfile')
+        else:
+            fields = ('energy', 'gradient', 'orbfile_a', 'orbfile_b')
+
+        def compute(arg):
+            coords, guess = arg
+            xyz = np.asarray(coords).reshape(-1, 3)*units.ANGSTROM_TO_AU
+            return self.engine.compute_blocking(xyz, fields, job_type='gradient', guess=guess)
+
+        with ThreadPoolExecutor(max_workers=len(coords_list)) as pool:
+            all_results = list(pool.map(compute, zip(coords_list, guesses)))
+
+        results = []
+        for node_id, res in zip(node_ids, all_results):
+            energy = self.Energy(res[0], 'Hartree')
+            gradient = self.Gradient(res[1], 'Hartree/Bohr')
+            results.append(({state: energy for state in states}, {state: gradient for state in states}, {}))
+            # the orbitals belong to the node of the geometry
+            if self.engine.options['closed_shell']:
+                orbfile.update({node_id: res[2]})
+            else:
+                orbfile.update({node_id: res[2] + ' ' + res[3]})
+
+        self.set_results(coords_list[-1], *results[-1])
+        return results
+
+    def orb_guess(self, node_id):
+        ''' Orbitals of node_id or else of a neighbouring node, None if there are none '''
+        orbfile = self.options['job_data']['orbfile']
+        for n in (node_id, node_id - 1, node_id + 1):
+            if n in orbfile:
+                return orbfile[n]
+        return None
+
+    def run_batch_serial(self, coords_list, states, node_ids):
+        ''' One geometry after the other through run, each as its own node '''
+        own_node_id = self.node_id
+        results = []
+        try:
+            for coords, node_id in zip(coords_list, node_ids):
+                # run keys the orbitals by self.node_id
+                self.node_id = node_id
+                results.extend(super(nanoreactor_engine, self).run_batch([coords], states))
+        finally:
+            self.node_id = own_node_id
+        return results
+
 
 if __name__=="__main__":
     from nanoreactor.engine import get_engine
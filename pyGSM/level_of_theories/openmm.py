@@ -1,4 +1,5 @@
 # standard library imports
+import hashlib
 from coordinate_systems import Dihedral
 from utilities import manage_xyz, nifty
 import sys
@@ -20,6 +21,9 @@ except:
 
 
 class OpenMM(Lot):
+
+    native_batch = True
+
     def __init__(self, options):
 
         super(OpenMM, self).__init__(options)
@@ -173,6 +177,18 @@ class OpenMM(Lot):
     def simulation(self, value):
         self.options['job_data']['simulation'] = value
 
+    def signature_value(self, value):
+        if isinstance(value, openmm_app.Simulation):
+            # the force field and the restraints are in the system, hashed once
+            # since it is complete when the simulation is made, the box is in the context
+            system = value.system
+            if getattr(self, '_system_hash', (None, None))[0] is not system:
+                xml = openmm.XmlSerializer.serialize(system)
+                self._system_hash = (system, hashlib.sha1(xml.encode()).hexdigest())
+            box = value.context.getState().getPeriodicBoxVectors().value_in_unit(openmm_units.nanometer)
+            return ('Simulation', self._system_hash[1], self.signature_value(np.array(box)))
+        return super(OpenMM, self).signature_value(value)
+
     def run(self, geom, mult, ad_idx, runtype='gradient'):
 
         coords = manage_xyz.xyz_to_np(geom)
@@ -201,6 +217,33 @@ class OpenMM(Lot):
 
         return
 
+    def run_batch(self, coords_list, states=None, node_ids=None):
+        """
+        Batched evaluation on the one simulation context, the forces are
+        pulled out as a numpy array instead of a list of Vec3 per geometry.
+        """
+        if states is None:
+            states = self.states
+        for mult, ad_idx in states:
+            if mult != 1 or ad_idx > 1:
+                raise RuntimeError('MM cant do excited states')
+
+        energy_unit = openmm_units.kilocalories / openmm_units.moles
+        force_unit = energy_unit / openmm_units.angstroms
+        context = self.simulation.context
+
+        results = []
+        for coords in coords_list:
+            context.setPositions(0.1 * np.asarray(coords).reshape(-1, 3))  # coords are in angstrom
+            s = context.getState(getEnergy=True, getForces=True)
+            energy = self.Energy(s.getPotentialEnergy().value_in_unit(energy_unit), 'kcal/mol')
+            gradient = self.Gradient(-1.0 * s.getForces(asNumpy=True).value_in_unit(force_unit), 'kcal/mol/Angstrom')
+            results.append(({state: energy for state in states}, {state: gradient for state in states}, {}))
+
+        if results:
+            self.set_results(coords_list[-1], *results[-1])
+        return results
+
 
 if __name__ == "__main__":
     from openbabel import pybel as pb
@@ -0,0 +1,277 @@
+# standard library imports
+import atexit
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+import traceback
+from os import path
+
+# third party
+import numpy as np
+
+# local application imports
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from utilities import manage_xyz
+from utilities.executors import ThreadExecutor
+try:
+    from .base_lot import Lot, LoTError
+except:
+    from base_lot import Lot, LoTError
+
+
+def _serve(lot, buf, shape, conn):
+    '''
+    Worker loop of a LotWorker.  The geometry of every request is read from
+    the shared buffer, the lot copies computing it are kept per request key
+    so each of them restarts from its own previous calculation.
+    '''
+    xyz = np.frombuffer(buf).reshape(shape)
+    lots = {}
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        key, node_id, runtype = message
+        try:
+            if key not in lots:
+                lots[key] = type(lot).copy(lot, {'node_id': node_id})
+            worker_lot = lots[key]
+            worker_lot.runall(manage_xyz.np_to_xyz(worker_lot.geom, xyz.copy()), runtype)
+            conn.send(('results', worker_lot.pack_results()))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+    conn.close()
+
+
+class LotWorker(object):
+    """ A process holding copies of a LoT that computes one geometry at a time
+
+    The LoT (and with it the calculator) is handed to the worker once when it
+    starts.  Per calculation the coordinates are written to a shared memory
+    buffer and only the request key, the node id and the runtype go through
+    the pipe, the energies and gradients come back through it.
+    """
+
+    def __init__(self, lot):
+        self.lot = lot
+        self.shape = (len(lot.atoms), 3)
+        self.process = None
+        self.conn = None
+        self.xyz = None
+        self.lock = threading.Lock()
+        self.starts = 0
+        self.calls = 0
+        self.call_time = 0.
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def start(self):
+        buf = mp.RawArray('d', int(np.prod(self.shape)))
+        self.xyz = np.frombuffer(buf).reshape(self.shape)
+        self.conn, child_conn = mp.Pipe()
+        self.process = mp.Process(target=_serve, args=(self.lot, buf, self.shape, child_conn), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.starts += 1
+
+    def request(self, key, node_id, coords, runtype=None):
+        ''' Compute coords (Angstrom) with the worker's lot for key, returns the packed results '''
+        with self.lock:
+            if not self.alive:
+                self.start()
+            t0 = time.time()
+            self.xyz[:] = np.reshape(coords, self.shape)
+            try:
+                self.conn.send((key, node_id, runtype))
+                kind, reply = self.conn.recv()
+            except (EOFError, OSError):
+                raise LoTError("LoT worker exited with code {}".format(self.process.exitcode))
+            self.call_time += time.time() - t0
+            self.calls += 1
+        if kind == 'error':
+            raise LoTError("LoT worker failed:\n{}".format(reply))
+        return reply
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+            self.process.join(timeout=10)
+        except (OSError, ValueError):
+            pass
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+        self.process = None
+        self.conn = None
+        self.xyz = None
+
+    def __repr__(self):
+        return "LotWorker({} starts, {} calls in {:.2f} s)".format(self.starts, self.calls, self.call_time)
+
+
+class LotPool(object):
+    """ The workers serving one wrapped LoT, see ProcessPoolLot
+
+    Pools are shared per wrapped LoT within a process, use LotPool.get.
+    """
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, lot, size):
+        # a forked process must not talk to the workers of its parent
+        key = (os.getpid(), id(lot))
+        with cls._registry_lock:
+            if key not in cls._registry:
+                cls._registry[key] = cls(lot, size)
+            return cls._registry[key]
+
+    @classmethod
+    def close_all(cls):
+        with cls._registry_lock:
+            for (pid, _), pool in cls._registry.items():
+                if pid == os.getpid():
+                    pool.close()
+
+    @classmethod
+    def report(cls):
+        return '\n'.join(repr(pool) for (pid, _), pool in cls._registry.items() if pid == os.getpid())
+
+    def __init__(self, lot, size):
+        self.lot = lot
+        self.size = max(int(size), 1)
+        self.workers = [LotWorker(lot) for _ in range(self.size)]
+        self.executor = ThreadExecutor(self.size)
+
+    def worker(self, slot):
+        return self.workers[slot % self.size]
+
+    def start(self, slots=None):
+        ''' Start the workers of slots (default all) that aren't running '''
+        for slot in (range(self.size) if slots is None else slots):
+            worker = self.worker(slot)
+            with worker.lock:
+                if not worker.alive:
+                    worker.start()
+
+    def close(self):
+        self.executor.shutdown()
+        for worker in self.workers:
+            worker.close()
+
+    def __repr__(self):
+        return "LotPool({} of {} workers: {})".format(
+            self.size, type(self.lot).__name__, ', '.join(repr(worker) for worker in self.workers))
+
+
+atexit.register(LotPool.close_all)
+
+
+class ProcessPoolLot(Lot):
+    """ Runs another level of theory in a pool of worker processes
+
+    Meant for LoTs that compute in the python interpreter (xTB_lot, ASELoT,
+    ...), which otherwise evaluate one node at a time.  Every worker keeps
+    its own copy of the wrapped LoT, so its calculator is initialized once
+    per worker and each node restarts from the wavefunction/charges of its
+    previous geometry.  Node node_id is always computed by worker
+    node_id % pool_size, also in batches.
+
+    job_data keys:
+        pool_lot  - the wrapped Lot object
+        pool_size - number of worker processes
+
+    Use ProcessPoolLot.wrap(lot, pool_size).  With the thread node executor
+    the nodes are computed concurrently, otherwise the starting points of
+    every optimization iteration are computed together by run_batch.
+    """
+
+    native_batch = True
+
+    def __init__(self, options):
+        super(ProcessPoolLot, self).__init__(options)
+        if self.pool_lot is None:
+            raise LoTError("ProcessPoolLot needs job_data['pool_lot']")
+
+    @classmethod
+    def wrap(cls, lot, pool_size):
+        ''' A ProcessPoolLot computing lot in pool_size worker processes '''
+        job_data = dict(lot.options['job_data'], pool_lot=lot, pool_size=pool_size)
+        new = cls(lot.options.copy().set_values({'job_data': job_data}))
+        # fork the workers now, from this thread, while the process is small
+        new.pool.start()
+        return new
+
+    @property
+    def pool_lot(self):
+        return self.options['job_data'].get('pool_lot', None)
+
+    @property
+    def pool_size(self):
+        return self.options['job_data'].get('pool_size', 1)
+
+    @property
+    def pool(self):
+        return LotPool.get(self.pool_lot, self.pool_size)
+
+    def cache_signature(self, runtype=None):
+        # the same results as the wrapped lot
+        return self.pool_lot.cache_signature(runtype)
+
+    def runall(self, geom, runtype=None):
+        packed = self.pool.worker(self.node_id).request(self.node_id, self.node_id, manage_xyz.xyz_to_np(geom), runtype)
+        self.Energies, self.Gradients, self.Couplings = self.unpack_results(packed)
+
+    def run(self, geom, multiplicity, ad_idx, runtype='gradient'):
+        # one worker call computes all the states
+        self.runall(geom, runtype)
+
+    def run_batch(self, coords_list, states=None, node_ids=None):
+        """
+        Computes the geometries concurrently, every worker computes all the
+        states.  As in runall the lot copy of node n on worker n % pool_size
+        computes the geometries of node n, so each of them restarts from the
+        previous geometry of its node.  Without node_ids all the geometries
+        belong to this node (e.g. displacements for a finite difference
+        Hessian) and geometry i goes to worker i % pool_size.
+        """
+        if states is not None and not all(state in self.states for state in states):
+            return super(ProcessPoolLot, self).run_batch(coords_list, states, node_ids)
+        if len(coords_list) == 0:
+            return []
+
+        pool = self.pool
+        if node_ids is None:
+            node_ids = [self.node_id]*len(coords_list)
+            slots = list(range(len(coords_list)))
+        else:
+            slots = list(node_ids)
+        jobs = {}
+        for i, slot in enumerate(slots):
+            jobs.setdefault(slot % pool.size, []).append(i)
+        # start the workers from this thread, the Fortran output of xtb goes astray
+        # in workers forked from the threads of the executor
+        pool.start(jobs)
+
+        def run_slot(slot):
+            worker = pool.worker(slot)
+            return [(i, worker.request(node_ids[i], node_ids[i], coords_list[i])) for i in jobs[slot]]
+
+        packed = {}
+        for slot_results in pool.executor.map(run_slot, list(jobs)):
+            packed.update(slot_results)
+        results = [self.unpack_results(packed[i]) for i in range(len(coords_list))]
+        Lot.count('runs', len(results))
+
+        self.set_results(coords_list[-1], *results[-1])
+        return results
@@ -0,0 +1,249 @@
+# standard library imports
+import atexit
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from os import path
+
+# third party
+import numpy as np
+
+# local application imports
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+try:
+    from .base_lot import Lot, LoTError
+except:
+    from base_lot import Lot, LoTError
+
+
+class ServerProcess(object):
+    """ A long lived QM worker process
+
+    The worker is started once in its own scratch directory (on tmpfs when
+    available) and then serves any number of calculations, so process
+    startup, license checkout and the orbital guess I/O are paid once per
+    worker instead of once per gradient.  Orbital/restart files stay in the
+    scratch directory between calls.
+
+    Protocol, one JSON object per line:
+        worker -> client, once at startup   {"ready": true}
+        client -> worker, per calculation   {"geom": [[symbol, x, y, z], ...] (Angstrom),
+                                             "charge": 0, "nproc": 1,
+                                             "states": [[mult, ad_idx], ...],
+                                             "gradient_states": [[mult, ad_idx], ...],
+                                             "coupling_states": [[mult, ad_idx], [mult, ad_idx]] or null,
+                                             "lot_inp_file": path or null,
+                                             "guess_dir": path or null}
+        worker -> client, per calculation   {"energies": [E per state] (Hartree),
+                                             "gradients": [natoms x 3 per gradient state] (Hartree/Bohr),
+                                             "coupling": natoms x 3 or null,
+                                             "warm": true if a stored guess was used}
+                                            or {"error": message}
+    The worker exits on {"command": "exit"} or when its stdin is closed.
+    guess_dir is the scratch directory of another worker whose orbitals
+    may be copied as a starting guess.  See mock_qm_server.py.
+
+    Workers are shared per scratch directory within a process, use ServerProcess.get.
+    """
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, command, scratch, cleanup=False):
+        scratch = os.path.abspath(scratch)
+        with cls._registry_lock:
+            if scratch not in cls._registry:
+                cls._registry[scratch] = cls(command, scratch, cleanup)
+            return cls._registry[scratch]
+
+    @classmethod
+    def close_all(cls):
+        with cls._registry_lock:
+            for server in cls._registry.values():
+                server.close()
+
+    @classmethod
+    def report(cls):
+        return '\n'.join(repr(server) for server in cls._registry.values())
+
+    def __init__(self, command, scratch, cleanup=False):
+        self.command = command
+        self.scratch = scratch
+        # remove the scratch directory when the worker is closed
+        self.cleanup = cleanup
+        self.process = None
+        self.lock = threading.Lock()
+        self.starts = 0
+        self.calls = 0
+        self.warm_calls = 0
+        self.startup_time = 0.
+        self.call_time = 0.
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        if not os.path.exists(self.scratch):
+            os.makedirs(self.scratch, exist_ok=True)
+        print(" starting QM server '{}' in {}".format(self.command, self.scratch))
+        t0 = time.time()
+        self.process = subprocess.Popen(
+            shlex.split(self.command),
+            cwd=self.scratch,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            bufsize=1,
+        )
+        reply = self._read()
+        if not reply.get('ready', False):
+            raise LoTError("QM server '{}' did not start: {}".format(self.command, reply))
+        self.startup_time += time.time() - t0
+        self.starts += 1
+
+    def request(self, message):
+        ''' Send one calculation to the worker (starting it if needed) and return its reply '''
+        with self.lock:
+            if not self.alive:
+                self.start()
+            t0 = time.time()
+            self.process.stdin.write(json.dumps(message) + '\n')
+            self.process.stdin.flush()
+            reply = self._read()
+            self.call_time += time.time() - t0
+            self.calls += 1
+            self.warm_calls += int(bool(reply.get('warm', False)))
+        if 'error' in reply:
+            raise LoTError("QM server '{}' failed: {}".format(self.command, reply['error']))
+        return reply
+
+    def _read(self):
+        line = self.process.stdout.readline()
+        if not line:
+            raise LoTError("QM server '{}' exited with code {}".format(self.command, self.process.wait()))
+        return json.loads(line)
+
+    def close(self):
+        if not self.alive:
+            return
+        try:
+            self.process.stdin.write(json.dumps({'command': 'exit'}) + '\n')
+            self.process.stdin.close()
+            self.process.wait(timeout=10)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            self.process.kill()
+        self.process = None
+        if self.cleanup:
+            shutil.rmtree(self.scratch, ignore_errors=True)
+            try:
+                # and the parent directories once they are empty
+                os.removedirs(os.path.dirname(self.scratch))
+            except OSError:
+                pass
+
+    def __repr__(self):
+        return "ServerProcess({}: {} starts in {:.2f} s, {} calls ({} warm) in {:.2f} s)".format(
+            self.scratch, self.starts, self.startup_time, self.calls, self.warm_calls, self.call_time)
+
+
+atexit.register(ServerProcess.close_all)
+
+
+class QMServer(Lot):
+    """ Level of theory served by persistent worker processes, see ServerProcess
+
+    job_data keys:
+        server_command   - command starting a worker, e.g. 'python mock_qm_server.py'
+        server_pool_size - number of workers shared by the nodes (node_id modulo
+                           server_pool_size), 0 gives every node its own worker
+        server_scratch   - root of the worker scratch directories, defaults to
+                           /dev/shm (tmpfs) when available and scratch/ otherwise
+    """
+
+    def __init__(self, options):
+        super(QMServer, self).__init__(options)
+        if self.server_command is None:
+            raise LoTError("QMServer needs job_data['server_command']")
+        self.guess_dir = None
+
+    @property
+    def server_command(self):
+        return self.options['job_data'].get('server_command', None)
+
+    @property
+    def server_pool_size(self):
+        return self.options['job_data'].get('server_pool_size', 0)
+
+    @property
+    def server_scratch(self):
+        ''' Scratch directory of the worker serving this node '''
+        root = self.options['job_data'].get('server_scratch', None)
+        if root is None:
+            root = self.default_scratch()
+        slot = self.node_id if self.server_pool_size == 0 else self.node_id % self.server_pool_size
+        return os.path.join(root, 'string_{:03d}'.format(self.ID), str(slot))
+
+    @staticmethod
+    def default_scratch():
+        if os.access('/dev/shm', os.W_OK):
+            return '/dev/shm/pygsm_{}'.format(os.getpid())
+        return 'scratch/qm_server'
+
+    @property
+    def server(self):
+        # the default tmpfs scratch only lives as long as this run
+        cleanup = self.options['job_data'].get('server_scratch', None) is None
+        return ServerProcess.get(self.server_command, self.server_scratch, cleanup)
+
+    @classmethod
+    def copy(cls, lot, options, copy_wavefunction=True):
+        new = cls(lot.options.copy().set_values(options))
+        if new.server_scratch == lot.server_scratch:
+            new.guess_dir = lot.guess_dir
+        elif copy_wavefunction:
+            new.guess_dir = os.path.abspath(lot.server_scratch)
+        return new
+
+    def runall(self, geom, runtype=None):
+        self.Gradients = {}
+        self.Energies = {}
+        self.Couplings = {}
+
+        if runtype == 'gradient':
+            gradient_states = self.states
+        else:
+            gradient_states = self.gradient_states if self.calc_grad else []
+        coupling_states = self.coupling_states if self.do_coupling and self.coupling_states else None
+
+        reply = self.server.request({
+            'geom': [[atom[0]] + [float(x) for x in atom[1:4]] for atom in geom],
+            'charge': self.charge,
+            'nproc': self.nproc,
+            'states': [list(state) for state in self.states],
+            'gradient_states': [list(state) for state in gradient_states],
+            'coupling_states': [list(state) for state in coupling_states] if coupling_states is not None else None,
+            'lot_inp_file': os.path.abspath(self.lot_inp_file) if self.lot_inp_file else None,
+            'guess_dir': self.guess_dir,
+        })
+        self.guess_dir = None
+
+        for state, energy in zip(self.states, reply['energies']):
+            self._Energies[tuple(state)] = self.Energy(energy, 'Hartree')
+        for state, gradient in zip(gradient_states, reply['gradients']):
+            self._Gradients[tuple(state)] = self.Gradient(np.asarray(gradient, dtype=float), 'Hartree/Bohr')
+        if coupling_states is not None and reply.get('coupling') is not None:
+            # keyed by the adiabatic indices as in get_coupling
+            key = (coupling_states[0][1], coupling_states[1][1])
+            self._Couplings[key] = self.Coupling(np.asarray(reply['coupling'], dtype=float).reshape(-1, 1), 'Hartree/Bohr')
+        self.write_E_to_file()
+
+    def run(self, geom, multiplicity, ad_idx, runtype='gradient'):
+        # one server call computes all the states
+        self.runall(geom, runtype)
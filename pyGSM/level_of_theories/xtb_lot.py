@@ -1,12 +1,13 @@
 # standard library imports
 import sys
+import threading
 from os import path
 
 # third party
 import numpy as np
 
 try:
-    from xtb.interface import Calculator
+    from xtb.interface import Calculator, Results, XTBException
     from xtb.utils import get_method, get_solvent
     from xtb.interface import Environment
     from xtb.libxtb import VERBOSITY_FULL
@@ -23,6 +24,19 @@ except:
 
 
 class xTB_lot(Lot):
+    """ GFN-xTB through the xtb python API
+
+    The xtb Calculator is built once per thread for each set of atoms and
+    xTB settings and only its positions are updated between calls.  Every
+    lot keeps the results of its last calculation as the restart (wavefunction
+    and charges) of the next one, so the SCC of a node starts from the
+    converged density of its previous geometry.
+    """
+
+    # xtb Calculators of this process keyed by calculator_key, one set per
+    # thread so that a thread node executor never shares a Calculator
+    _calculators = threading.local()
+
     def __init__(self, options):
         super(xTB_lot, self).__init__(options)
 
@@ -32,6 +46,41 @@ class xTB_lot(Lot):
             elem = E.from_symbol(a)
             numbers.append(elem.atomic_num)
         self.numbers = np.asarray(numbers)
+        self.restart = None
+
+    @classmethod
+    def copy(cls, lot, options={}, copy_wavefunction=True):
+        new = cls(lot.options.copy().set_values(options))
+        if copy_wavefunction and lot.restart is not None:
+            new.restart = Results(lot.restart)
+        return new
+
+    def __getstate__(self):
+        # xtb results can't be pickled, the copy starts without a restart
+        state = self.__dict__.copy()
+        state['restart'] = None
+        return state
+
+    @property
+    def calculator_key(self):
+        return (tuple(self.numbers), self.charge, self.xTB_Hamiltonian, self.xTB_accuracy,
+                self.xTB_electronic_temperature, self.solvent)
+
+    def calculator(self, positions):
+        ''' The xtb Calculator of this process for these settings, at positions (Bohr) '''
+        key = self.calculator_key
+        calculators = xTB_lot._calculators.__dict__
+        calc = calculators.get(key, None)
+        if calc is None:
+            calc = Calculator(get_method(self.xTB_Hamiltonian), self.numbers, positions, charge=self.charge)
+            calc.set_accuracy(self.xTB_accuracy)
+            calc.set_electronic_temperature(self.xTB_electronic_temperature)
+            if self.solvent is not None:
+                calc.set_solvent(get_solvent(self.solvent))
+            calculators[key] = calc
+        else:
+            calc.update(positions)
+        return calc
 
     def run(self, geom, multiplicity, state, verbose=False):
 
@@ -41,17 +90,18 @@ class xTB_lot(Lot):
 
         # convert to bohr
         positions = coords * units.ANGSTROM_TO_AU
-        calc = Calculator(get_method(self.xTB_Hamiltonian), self.numbers, positions, charge=self.charge)
-
-        calc.set_accuracy(self.xTB_accuracy)
-        calc.set_electronic_temperature(self.xTB_electronic_temperature)
-
-        if self.solvent is not None:
-            calc.set_solvent(get_solvent(self.solvent))
+        calc = self.calculator(positions)
 
         calc.set_output('lot_jobs_{}.txt'.format(self.node_id))
-        res = calc.singlepoint()  # energy printed is only the electronic part
-        calc.release_output()
+        try:
+            # the last results are updated in place
+            res = calc.singlepoint(self.restart)  # energy printed is only the electronic part
+        except XTBException:
+            # e.g. a restart too far from this geometry, start from scratch
+            res = calc.singlepoint()
+        finally:
+            calc.release_output()
+        self.restart = res
 
         # energy in hartree
         self._Energies[(multiplicity, state)] = self.Energy(res.get_energy(), 'Hartree')
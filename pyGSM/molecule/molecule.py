@@ -14,15 +14,24 @@ from coordinate_systems import DelocalizedInternalCoordinates
 from potential_energy_surfaces import Penalty_PES
 from potential_energy_surfaces import Avg_PES
 from potential_energy_surfaces import PES
-from utilities import manage_xyz, elements, options, block_matrix
+from utilities import manage_xyz, elements, options, block_matrix, nifty, units
+from utilities.compact_hessian import CompactHessian
+from utilities.executors import SerialExecutor
 from time import time
 
 # third party
 import numpy as np
-from collections import Counter
+from collections import Counter, OrderedDict
+from collections.abc import Sequence
 
 ELEMENT_TABLE = elements.ElementData()
 
+
+def copy_node(arg):
+    ''' (MoleculeA, xyz, new_node_id, copy_wavefunction) -> copy of MoleculeA, used by Molecule.copies_from_options '''
+    MoleculeA, xyz, new_node_id, copy_wavefunction = arg
+    return Molecule.copy_from_options(MoleculeA, xyz, new_node_id=new_node_id, copy_wavefunction=copy_wavefunction)
+
 # TOC:
 # constructors
 # methods
@@ -75,7 +84,7 @@ class Molecule(object):
         opt.add_option(
             key='geom',
             required=False,
-            allowed_types=[list],
+            allowed_types=[list, Sequence],
             doc='geometry including atomic symbols'
         )
 
@@ -104,7 +113,16 @@ class Molecule(object):
             key='Primitive_Hessian',
             value=None,
             required=False,
-            doc='Primitive hessian save file for doing optimization.'
+            doc='Primitive hessian save file for doing optimization, an array or a CompactHessian.'
+        )
+
+        opt.add_option(
+            key='hessian_memory',
+            value=0,
+            required=False,
+            allowed_types=[int],
+            doc='Number of quasi-Newton updates kept in the primitive Hessian (L-BFGS style), 0 keeps all of them \
+                (folded into a dense matrix once they take as much space).'
         )
 
         opt.add_option(
@@ -185,6 +203,20 @@ class Molecule(object):
             'copy_wavefunction': copy_wavefunction,
         }))
 
+    @staticmethod
+    def copies_from_options(MoleculeA, xyzs, new_node_ids, copy_wavefunction=True, executor=None):
+        """
+        Create one copy of MoleculeA per geometry in xyzs (see copy_from_options).
+
+        The copies are independent of each other, so their coordinate systems
+        (primitive copy, DLC basis) and Hessians are built through executor
+        (see utilities.executors), e.g. a process pool for large systems.
+        """
+        if executor is None:
+            executor = SerialExecutor()
+        jobs = [(MoleculeA, xyz, node_id, copy_wavefunction) for xyz, node_id in zip(xyzs, new_node_ids)]
+        return executor.map(copy_node, jobs)
+
     def __init__(self,
                  options,
                  **kwargs
@@ -280,6 +312,8 @@ class Molecule(object):
         self.isTSnode = False
         self.bdist = 0.
         self.newHess = 5
+        # wraps a primitive Hessian passed in as an array
+        self.Primitive_Hessian = self.Data['Primitive_Hessian']
 
         if self.Data['Hessian'] is None and self.Data['Form_Hessian']:
             if self.Data['Primitive_Hessian'] is None and type(self.coord_obj) is not CartesianCoordinates:
@@ -439,17 +473,21 @@ class Molecule(object):
 
     @Primitive_Hessian.setter
     def Primitive_Hessian(self, value):
+        if value is not None and not isinstance(value, CompactHessian):
+            value = CompactHessian(value, memory=self.Data['hessian_memory'])
         self.Data['Primitive_Hessian'] = value
 
     def form_Primitive_Hessian(self):
         print(" making primitive Hessian")
-        self.Data['Primitive_Hessian'] = self.coord_obj.Prims.guess_hessian(self.xyz)
+        self.Primitive_Hessian = CompactHessian(self.coord_obj.Prims.guess_hessian_diagonal(self.xyz), memory=self.Data['hessian_memory'])
         self.newHess = 10
 
     def update_Primitive_Hessian(self, change=None):
+        ''' change is a low-rank pair (U, C) adding U.C.U^T, see utilities.compact_hessian '''
         print(" updating prim hess")
         if change is not None:
-            self.Primitive_Hessian += change
+            # not in place, nodes copied from each other share their Hessians
+            self.Primitive_Hessian = self.Primitive_Hessian.update(*change)
         return self.Primitive_Hessian
 
     @property
@@ -465,14 +503,16 @@ class Molecule(object):
         self.newHess = 5
 
     def update_Hessian(self, change=None):
+        ''' change is a low-rank pair (U, C) adding U.C.U^T, as for update_Primitive_Hessian '''
         #print " in update Hessian"
         if change is not None:
-            self.Hessian += change
+            U, C = change
+            self.Hessian = self.Hessian + np.dot(U, np.dot(C, U.T))
         return self.Hessian
 
     def form_Hessian_in_basis(self):
         # print " forming Hessian in current basis"
-        self.Hessian = block_matrix.dot(block_matrix.dot(block_matrix.transpose(self.coord_basis), self.Primitive_Hessian), self.coord_basis)
+        self.Hessian = self.Primitive_Hessian.project(self.coord_basis)
         return self.Hessian
 
     @property
@@ -512,7 +552,28 @@ class Molecule(object):
 
     @property
     def finiteDifferenceHessian(self):
-        return self.PES.get_finite_difference_hessian(self.xyz)
+        return self.finite_difference_hessian()
+
+    def finite_difference_hessian(self, two_sided=True, executor=None, checkpoint=None, checkpoint_every=8):
+        '''
+        Symmetrized finite difference Cartesian Hessian (au) at the current geometry,
+        see PES.get_finite_difference_hessian for the options.
+        '''
+        return self.PES.get_finite_difference_hessian(self.xyz, two_sided=two_sided, executor=executor,
+                                                      checkpoint=checkpoint, checkpoint_every=checkpoint_every)
+
+    def Hessian_vector_product(self, dq, step=0.005):
+        '''
+        Finite difference product of the Hessian in the current coordinate basis with dq,
+        (g(q+step*dq) - g(q-step*dq))/(2*step) for the unit vector along dq, scaled back by |dq|.
+        The two displaced gradients are computed with one PES.get_gradients_batch call.
+        '''
+        dq = np.reshape(dq, (-1, 1))
+        norm = np.linalg.norm(dq)
+        xyzs = [self.coord_obj.newCartesian(self.xyz, sign*step*dq/norm, frozen_atoms=self.frozen_atoms, verbose=False) for sign in (1., -1.)]
+        _, gradxs = self.PES.get_gradients_batch(xyzs, frozen_atoms=self.frozen_atoms)
+        gqs = [self.coord_obj.calcGrad(xyz, gradx) for xyz, gradx in zip(xyzs, gradxs)]
+        return norm*(gqs[0] - gqs[1])/(2.*step)
 
     @property
     def primitive_internal_coordinates(self):
@@ -604,6 +665,22 @@ class Molecule(object):
         self.Data['node_id'] = value
         self.PES.lot.node_id = value
 
+    def memory_usage(self, seen=None):
+        '''
+        Approximate bytes held by this node, by part. Objects whose id is in
+        seen (e.g. a primitive set shared with a previous node) are not counted.
+        '''
+        if seen is None:
+            seen = set()
+        Prims = self.coord_obj.Prims
+        usage = OrderedDict()
+        usage['primitives'] = sum(nifty.sizeof(obj, seen) for obj in (Prims.Internals, Prims.block_info, Prims.stored_groups))
+        usage['topology'] = sum(nifty.sizeof(obj, seen) for obj in (Prims.topology, getattr(Prims, 'fragments', None)))
+        usage['basis'] = nifty.sizeof(getattr(self.coord_obj, 'Vecs', None), seen)
+        usage['hessians'] = sum(nifty.sizeof(self.Data[key], seen) for key in ('Hessian', 'Primitive_Hessian'))
+        usage['other'] = nifty.sizeof(self, seen)
+        return usage
+
 
 if __name__ == '__main__':
     from level_of_theories import Molpro
@@ -9,6 +9,7 @@ import numpy as np
 sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
 from ._linesearch import backtrack, NoLineSearch
 from utilities import units, options, block_matrix
+from utilities.compact_hessian import bfgs_terms, bofill_terms
 
 
 def sorted_eigh(mat, asc=False):
@@ -664,64 +665,29 @@ class base_optimizer(object):
             raise NotImplementedError
 
     def update_bfgsp(self, molecule):
+        ''' The BFGS change of the primitive Hessian as a low-rank pair (U, C), see utilities.compact_hessian '''
         if self.options['print_level'] > 1:
             print("In update bfgsp")
             print('dx_prim ', self.dx_prim.T)
             print('dg_prim ', self.dg_prim.T)
 
-        Hdx = np.dot(molecule.Primitive_Hessian, self.dx_prim)
-        dxHdx = np.dot(np.transpose(self.dx_prim), Hdx)
-        dgdg = np.outer(self.dg_prim, self.dg_prim)
-        dgtdx = np.dot(np.transpose(self.dg_prim), self.dx_prim)
-        change = np.zeros_like(molecule.Primitive_Hessian)
+        Hdx = molecule.Primitive_Hessian.dot(self.dx_prim)
 
         if self.options['print_level'] > 1:
             print("Hdx")
             print(Hdx.T)
-            print("dgtdx: %1.8f dxHdx: %1.8f dgdg" % (dgtdx, dxHdx))
-            print("dgdg")
-            print(dgdg)
-
-        if dgtdx > 0.:
-            if dgtdx < 0.001:
-                dgtdx = 0.001
-            change += dgdg/dgtdx
-        if dxHdx > 0.:
-            if dxHdx < 0.001:
-                dxHdx = 0.001
-            change -= np.outer(Hdx, Hdx)/dxHdx
+            print("dgtdx: %1.8f dxHdx: %1.8f" % (np.dot(self.dg_prim.T, self.dx_prim), np.dot(self.dx_prim.T, Hdx)))
 
-        return change
+        return bfgs_terms(Hdx, self.dx_prim, self.dg_prim)
 
     def update_bofill(self, molecule):
+        ''' The Bofill change of the Hessian in the current basis as a low-rank pair (U, C), see utilities.compact_hessian '''
         print(" in update bofill")
 
         # return self.update_TS_BFGS(molecule)
 
-        G = np.copy(molecule.Hessian)  # nicd,nicd
-        Gdx = np.dot(G, self.dx)  # (nicd,nicd)(nicd,1) = (nicd,1)
-        dgmGdx = self.dg - Gdx  # (nicd,1)
-
-        # MS
-        dgmGdxtdx = np.dot(dgmGdx.T, self.dx)  # (1,nicd)(nicd,1)
-        Gms = np.outer(dgmGdx, dgmGdx)/dgmGdxtdx
-
-        # PSB
-        dxdx = np.outer(self.dx, self.dx)
-        dxtdx = np.dot(self.dx.T, self.dx)
-        dxtdg = np.dot(self.dx.T, self.dg)
-        dxtGdx = np.dot(self.dx.T, Gdx)
-        dxtdx2 = dxtdx*dxtdx
-        dxtdgmdxtGdx = dxtdg - dxtGdx
-        Gpsb = np.outer(dgmGdx, self.dx)/dxtdx + np.outer(self.dx, dgmGdx)/dxtdx - dxtdgmdxtGdx*dxdx/dxtdx2
-
-        # Bofill mixing
-        dxtE = np.dot(self.dx.T, dgmGdx)  # (1,nicd)(nicd,1)
-        EtE = np.dot(dgmGdx.T, dgmGdx)  # E is dgmGdx
-        phi = 1. - dxtE*dxtE/(dxtdx*EtE)
-
-        change = (1.-phi)*Gms + phi*Gpsb
-        return change
+        G = molecule.Hessian  # nicd,nicd
+        return bofill_terms(np.dot(G, self.dx), self.dx, self.dg)
 
     def update_TS_BFGS(self, molecule):
         G = np.copy(molecule.Hessian)  # nicd,nicd
@@ -38,6 +38,7 @@ class beales_cg(base_optimizer):
         energies = []
         geoms.append(molecule.geometry)
         energies.append(molecule.energy-refE)
+        traj = manage_xyz.TrajectoryWriter('opt_{}.xyz'.format(molecule.node_id))
         self.initial_step = True
         self.disp = 1000.
         self.Ediff = 1000.
@@ -160,6 +161,7 @@ class beales_cg(base_optimizer):
                 if nconstraints == 1:
                     print(" opt-summary")
                     print(self.buf.getvalue())
+                    traj.close()
                     return geoms, energies
                 else:
                     nconstraints = 1
@@ -181,7 +183,7 @@ class beales_cg(base_optimizer):
             if ostep % xyzframerate == 0:
                 geoms.append(molecule.geometry)
                 energies.append(molecule.energy-refE)
-                manage_xyz.write_xyzs_w_comments('opt_{}.xyz'.format(molecule.node_id), geoms, energies, scale=1.)
+                traj.append_new(geoms, energies)
 
             # save variables for update Hessian!
             if not molecule.coord_obj.__class__.__name__ == 'CartesianCoordinates' or self.options['update_hess_in_bg']:
@@ -220,7 +222,7 @@ class beales_cg(base_optimizer):
                 if ostep % xyzframerate != 0:
                     geoms.append(molecule.geometry)
                     energies.append(molecule.energy-refE)
-                    manage_xyz.write_xyzs_w_comments('opt_{}.xyz'.format(molecule.node_id), geoms, energies, scale=1.)
+                    traj.append_new(geoms, energies)
                 break
 
             #update DLC  --> this changes q, g, Hint
@@ -247,4 +249,5 @@ class beales_cg(base_optimizer):
 
         print(" opt-summary")
         print(self.buf.getvalue())
+        traj.close()
         return geoms, energies
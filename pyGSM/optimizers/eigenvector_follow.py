@@ -43,6 +43,7 @@ class eigenvector_follow(base_optimizer):
         energies = []
         geoms.append(molecule.geometry)
         energies.append(molecule.energy-refE)
+        traj = manage_xyz.TrajectoryWriter('{}/opt_{}.xyz'.format(path, molecule.node_id))
         self.converged = False
 
         # form initial coord basis
@@ -63,6 +64,7 @@ class eigenvector_follow(base_optimizer):
         if self.check_only_grad_converged:
             if molecule.gradrms < self.conv_grms and gmax < self.conv_gmax:
                 self.converged = True
+                traj.close()
                 return geoms, energies
             else:
                 self.check_only_grad_converged = False
@@ -200,7 +202,7 @@ class eigenvector_follow(base_optimizer):
             if ostep % xyzframerate == 0:
                 geoms.append(molecule.geometry)
                 energies.append(molecule.energy-refE)
-                manage_xyz.write_xyzs_w_comments('{}/opt_{}.xyz'.format(path, molecule.node_id), geoms, energies, scale=1.)
+                traj.append_new(geoms, energies)
 
             # save variables for update Hessian!
             if not molecule.coord_obj.__class__.__name__ == 'CartesianCoordinates':
@@ -260,7 +262,7 @@ class eigenvector_follow(base_optimizer):
                 if ostep % xyzframerate != 0:
                     geoms.append(molecule.geometry)
                     energies.append(molecule.energy-refE)
-                    manage_xyz.write_xyzs_w_comments('{}/opt_{}.xyz'.format(path, molecule.node_id), geoms, energies, scale=1.)
+                    traj.append_new(geoms, energies)
                 break
 
             # update DLC  --> this changes q, g, Hint
@@ -279,6 +281,7 @@ class eigenvector_follow(base_optimizer):
 
         print(" opt-summary {}".format(molecule.node_id))
         print(self.buf.getvalue())
+        traj.close()
         return geoms, energies
 
 
@@ -54,6 +54,7 @@ class lbfgs(base_optimizer):
         energies = []
         geoms.append(molecule.geometry)
         energies.append(molecule.energy-refE)
+        traj = manage_xyz.TrajectoryWriter('{}/opt_{}.xyz'.format(path, molecule.node_id))
         self.check_inputs(molecule, opt_type, ictan)
         nconstraints = self.get_nconstraints(opt_type)
         self.buf = StringIO()
@@ -286,7 +287,7 @@ class lbfgs(base_optimizer):
             if ostep % xyzframerate == 0:
                 geoms.append(molecule.geometry)
                 energies.append(molecule.energy-refE)
-                manage_xyz.write_xyzs_w_comments('{}/opt_{}.xyz'.format(path, molecule.node_id), geoms, energies, scale=1.)
+                traj.append_new(geoms, energies)
 
             if self.options['print_level'] > 0:
                 print(" Node: %d Opt step: %d E: %5.4f predE: %5.4f ratio: %1.3f gradrms: %1.5f ss: %1.3f DMAX: %1.3f" % (molecule.node_id, ostep+1, fx-refE, dEpre, ratio, molecule.gradrms, step, self.DMAX))
@@ -319,7 +320,7 @@ class lbfgs(base_optimizer):
                 if ostep % xyzframerate != 0:
                     geoms.append(molecule.geometry)
                     energies.append(molecule.energy-refE)
-                    manage_xyz.write_xyzs_w_comments('{}/opt_{}.xyz'.format(path, molecule.node_id), geoms, energies, scale=1.)
+                    traj.append_new(geoms, energies)
                 break
             # print " ########## DONE WITH TOTAL STEP #########"
 
@@ -339,4 +340,5 @@ class lbfgs(base_optimizer):
 
         print(" opt-summary")
         print(self.buf.getvalue())
+        traj.close()
         return geoms, energies
@@ -31,6 +31,12 @@ class Avg_PES(PES):
         self.lot = lot
         self.lot.do_coupling = True
         self.lot.coupling_states = (PES1.ad_idx, PES2.ad_idx)
+        # both states and the coupling come out of the same lot run
+        self.lot.request_gradients(self.batch_states)
+
+    @property
+    def batch_states(self):
+        return self.PES1.batch_states + self.PES2.batch_states
 
     @classmethod
     def create_pes_from(cls, PES, options={}, copy_wavefunction=True):
@@ -40,8 +46,10 @@ class Avg_PES(PES):
     def get_energy(self, xyz):
         if self.PES1.multiplicity == self.PES2.multiplicity:
             assert self.PES2.ad_idx > self.PES1.ad_idx, "dgrad wrong direction"
-        self.dE = self.PES2.get_energy(xyz) - self.PES1.get_energy(xyz)
-        return 0.5*(self.PES1.get_energy(xyz) + self.PES2.get_energy(xyz))
+        E1 = self.PES1.get_energy(xyz)
+        E2 = self.PES2.get_energy(xyz)
+        self.dE = E2 - E1
+        return 0.5*(E1 + E2)
 
     def get_gradient(self, xyz, frozen_atoms=None):
         return 0.5*(self.PES1.get_gradient(xyz, frozen_atoms) + self.PES2.get_gradient(xyz, frozen_atoms))
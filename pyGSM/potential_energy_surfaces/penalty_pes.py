@@ -29,8 +29,14 @@ class Penalty_PES(PES):
         self.alpha = alpha
         self.dE = 1000.
         self.sigma = sigma
+        # both states come out of the same lot run
+        self.lot.request_gradients(self.batch_states)
         print(' PES1 multiplicity: {} PES2 multiplicity: {} sigma: {}'.format(self.PES1.multiplicity, self.PES2.multiplicity, self.sigma))
 
+    @property
+    def batch_states(self):
+        return self.PES1.batch_states + self.PES2.batch_states
+
     @classmethod
     def create_pes_from(cls, PES, options={}, copy_wavefunction=True):
         lot = type(PES.lot).copy(PES.lot, options, copy_wavefunction)
@@ -1,4 +1,5 @@
 # standard library imports
+import os
 import sys
 from os import path
 
@@ -13,6 +14,12 @@ from utilities import *
 ELEMENT_TABLE = elements.ElementData()
 
 
+def gradients_worker(arg):
+    ''' (PES, list of xyz) -> gradients, used by PES.get_gradients_parallel '''
+    pes, xyzs = arg
+    return pes.get_gradients_batch(xyzs)[1]
+
+
 class PES(object):
     """ PES object """
 
@@ -106,6 +113,11 @@ class PES(object):
     def energy(self):
         return self.get_energy(self.lot.currentCoords)
 
+    @property
+    def batch_states(self):
+        ''' The (multiplicity,state) tuples needed from the lot '''
+        return [(self.multiplicity, self.ad_idx)]
+
     #def energy(self):
     #    if self.lot.Energies:
     #        # if E is property and a dictionary
@@ -177,47 +189,97 @@ class PES(object):
                 kdE += 0.5*force*(xyz[a] - self.reference_xyz[a])**2
         return self.lot.get_energy(xyz, self.multiplicity, self.ad_idx) + fdE + kdE   # Kcal/mol
 
-    def get_finite_difference_hessian(self, coords, qm_region=None):
+    def get_finite_difference_hessian(self, coords, qm_region=None, FD_STEP_LENGTH=0.001, two_sided=True,
+                                      symmetrize=True, executor=None, checkpoint=None, checkpoint_every=8):
         ''' Calculate Finite Differnce Hessian
 
         Params:
             coords ((natoms,3) np.ndarray - system coordinates  (x,y,z)
             qm_region list of QM atoms in a QMMM simulation to obtain environment perturbed Hessian with the size of the QM region
+            FD_STEP_LENGTH (float) - Cartesian displacement in Angstrom
+            two_sided (bool) - central differences (2 gradients per coordinate) or
+                forward differences (1 gradient per coordinate plus the reference)
+            symmetrize (bool) - return (H+H^T)/2, e.g. to diagonalize it with normal_modes
+                when verifying a TS, False returns the raw finite difference Hessian
+            executor - a utilities.executors process executor to compute the displaced
+                gradients in parallel, each worker gets a copy of this PES.  Without one
+                (or with a serial/thread executor) they go through lot.run_batch.
+            checkpoint (str) - .npz file the finished displacements are saved to every
+                checkpoint_every gradients, a matching file is resumed from
 
         Returns:
             Hessian (N1,N1) np.ndarray
 
         '''
+        coords = np.asarray(coords, dtype=float).reshape(-1, 3)
         if qm_region is None:
-            hess = np.zeros((len(coords)*3, len(coords)*3))
-            n1_region = [x for x in range(3*len(coords))]
+            n1_region = np.arange(coords.size)
         else:
-            n1_region = []
-            for n in qm_region:
-                for j in range(3):
-                    n1_region.append(n*3+j)
-            print('n1_region')
-            print(n1_region)
-            # hess = np.zeros((len(coords[qm_region])*3,len(coords[qm_region])*3))
-            hess = np.zeros((len(n1_region), len(n1_region)))
-        print("hess shape", hess.shape)
-
-        def gen_row(n):
-            vec = np.zeros(coords.shape[0]*3)
-            vec[n] = 1.
-            return vec
-
-        n_actual = 0
-        for n in range(len(coords)*3):
-            if n in n1_region:
-                print("on hessian product ", n)
-                row = gen_row(n)
-                ans = self.get_finite_difference_hessian_product(coords, row)
-                # hess[n_actual] = np.squeeze(self.get_finite_difference_hessian_product(coords,row))
-                hess[n_actual] = np.squeeze(ans[n1_region])
-                n_actual += 1
+            n1_region = (3*np.asarray(qm_region, dtype=int)[:, None] + np.arange(3)).ravel()
+        N1 = len(n1_region)
+
+        # the displaced geometries, the reference first for forward differences
+        steps = [FD_STEP_LENGTH, -FD_STEP_LENGTH] if two_sided else [FD_STEP_LENGTH]
+        displacements = [] if two_sided else [(None, 0.)]
+        displacements += [(n, step) for n in n1_region for step in steps]
+        settings = {
+            'coords': coords,
+            'region': n1_region,
+            'step': FD_STEP_LENGTH,
+            'two_sided': two_sided,
+        }
+
+        grads = np.zeros((len(displacements), coords.size))
+        done = np.zeros(len(displacements), dtype=bool)
+        if checkpoint is not None and path.exists(checkpoint):
+            with np.load(checkpoint) as data:
+                if all(key in data and np.array_equal(data[key], val) for key, val in settings.items()):
+                    grads[:] = data['grads']
+                    done[:] = data['done']
+                    print(" resuming finite difference Hessian from {}: {}/{} gradients done".format(checkpoint, done.sum(), len(done)))
+                else:
+                    print(" {} is for a different finite difference Hessian, starting over".format(checkpoint))
+
+        todo = np.flatnonzero(~done)
+        nbatch = max(checkpoint_every, getattr(executor, 'ncores', 1)) if checkpoint is not None else len(todo)
+        print(" finite difference Hessian of {} coordinates: {} gradients".format(N1, len(todo)))
+        for start in range(0, len(todo), max(nbatch, 1)):
+            batch = todo[start:start+nbatch]
+            xyzs = []
+            for i in batch:
+                n, step = displacements[i]
+                xyz = coords.copy()
+                if n is not None:
+                    xyz.flat[n] += step
+                xyzs.append(xyz)
+            for i, grad in zip(batch, self.get_gradients_parallel(xyzs, executor)):
+                grads[i] = np.ravel(grad)
+            done[batch] = True
+            if checkpoint is not None:
+                tmp = '{}.{}.tmp'.format(checkpoint, os.getpid())
+                with open(tmp, 'wb') as f:
+                    np.savez(f, grads=grads, done=done, **settings)
+                os.replace(tmp, checkpoint)
+
+        # calculate grad fwd and bwd in a.u. (Bohr/Ha)
+        grads /= units.ANGSTROM_TO_AU
+        if two_sided:
+            hess = (grads[0::2] - grads[1::2])/(2.*FD_STEP_LENGTH)
+        else:
+            hess = (grads[1:] - grads[0])/FD_STEP_LENGTH
+        hess = hess[:, n1_region]
+        if symmetrize:
+            hess = 0.5*(hess + hess.T)
         return hess
 
+    def get_gradients_parallel(self, xyzs, executor=None):
+        ''' Gradients (Ha/ang) of several geometries, in a process pool if executor is one, else with lot.run_batch '''
+        if executor is None or executor.name != 'process' or executor.ncores == 1 or len(xyzs) < 2:
+            return self.get_gradients_batch(xyzs)[1]
+        chunks = [chunk for chunk in np.array_split(np.arange(len(xyzs)), executor.ncores) if len(chunk)]
+        results = executor.map(gradients_worker, [(self, [xyzs[i] for i in chunk]) for chunk in chunks])
+        return [grad for chunk in results for grad in chunk]
+
     def get_finite_difference_hessian_product(self, coords, direction, FD_STEP_LENGTH=0.001):
 
         # format the direction
@@ -318,6 +380,27 @@ class PES(object):
         grad = np.reshape(grad, (-1, 1))
         return grad  # Ha/ang
 
+    def get_gradients_batch(self, xyzs, frozen_atoms=None):
+        ''' Energies and gradients of several geometries with one lot.run_batch call
+
+        Params:
+            xyzs list of (natoms,3) np.ndarray - system coordinates
+
+        Returns:
+            energies list of energies in kcal/mol
+            gradients list of (3*natoms,1) np.ndarray in Ha/ang
+        '''
+
+        results = self.lot.run_batch(xyzs, self.batch_states)
+        energies = []
+        gradients = []
+        for xyz, result in zip(xyzs, results):
+            # the lot now has the results for xyz so the usual path doesn't rerun
+            self.lot.set_results(xyz, *result)
+            energies.append(self.get_energy(xyz))
+            gradients.append(self.get_gradient(xyz, frozen_atoms))
+        return energies, gradients
+
     def check_input(self, geom):
         atoms = manage_xyz.get_atoms(self.geom)
         elements = [ELEMENT_TABLE.from_symbol(atom) for atom in atoms]
@@ -0,0 +1,107 @@
+import numpy as np
+
+from pyGSM.utilities.block_matrix import block_matrix
+from pyGSM.utilities.compact_hessian import CompactHessian, bfgs_terms
+
+
+def dense_bfgs(H, dx, dg):
+    ''' The dense BFGS change of base_optimizer.update_bfgsp '''
+    Hdx = np.dot(H, dx)
+    dxHdx = np.dot(dx.T, Hdx).item()
+    dgtdx = np.dot(dg.T, dx).item()
+    change = np.zeros_like(H)
+    if dgtdx > 0.:
+        change += np.outer(dg, dg)/max(dgtdx, 0.001)
+    if dxHdx > 0.:
+        change -= np.outer(Hdx, Hdx)/max(dxHdx, 0.001)
+    return change
+
+
+def dense_bofill(G, dx, dg):
+    ''' The dense Bofill change of base_optimizer.update_bofill '''
+    Gdx = np.dot(G, dx)
+    E = dg - Gdx
+    dxtdx = np.dot(dx.T, dx).item()
+    dxtE = np.dot(dx.T, E).item()
+    Gms = np.outer(E, E)/dxtE
+    Gpsb = np.outer(E, dx)/dxtdx + np.outer(dx, E)/dxtdx - dxtE*np.outer(dx, dx)/(dxtdx*dxtdx)
+    phi = 1. - dxtE*dxtE/(dxtdx*np.dot(E.T, E).item())
+    return (1.-phi)*Gms + phi*Gpsb
+
+
+def steps(n, nsteps, seed=0):
+    rng = np.random.RandomState(seed)
+    A = rng.randn(n, n)
+    A = np.dot(A, A.T)/n + np.eye(n)
+    for _ in range(nsteps):
+        dx = 0.1*rng.randn(n, 1)
+        yield dx, np.dot(A, dx) + 0.01*rng.randn(n, 1)
+
+
+def test_bfgs_matches_dense():
+    n = 12
+    H0 = np.random.RandomState(1).uniform(0.1, 0.5, n)
+    H = CompactHessian(H0)
+    dense = np.diag(H0)
+    for dx, dg in steps(n, 4):
+        H = H.bfgs_update(dx, dg)
+        dense += dense_bfgs(dense, dx, dg)
+        assert H.updates and H.is_diagonal
+        assert np.allclose(H.toarray(), dense)
+
+    V = np.linalg.qr(np.random.RandomState(2).randn(n, 5))[0]
+    assert np.allclose(H.project(V), np.dot(V.T, np.dot(dense, V)))
+    Vblocks = block_matrix([V[:7, :3], V[7:, 3:]])
+    Vfull = block_matrix.full_matrix(Vblocks)
+    assert np.allclose(H.project(Vblocks), np.dot(Vfull.T, np.dot(dense, Vfull)))
+    assert np.allclose(H.diagonal(), np.diagonal(dense))
+
+
+def test_bofill_matches_dense():
+    n = 8
+    G0 = np.random.RandomState(3).randn(n, n)
+    G0 = 0.5*(G0 + G0.T)
+    G = CompactHessian(G0)
+    dense = G0.copy()
+    for dx, dg in steps(n, 3, seed=4):
+        G = G.bofill_update(dx, dg)
+        dense += dense_bofill(dense, dx, dg)
+        assert np.allclose(G.toarray(), dense)
+
+
+def test_densify_and_memory():
+    n = 6
+    H0 = np.ones(n)
+    dense = np.diag(H0)
+    H = CompactHessian(H0)
+    for dx, dg in steps(n, 10, seed=5):
+        H = H.bfgs_update(dx, dg)
+        dense += dense_bfgs(dense, dx, dg)
+        # the updates never take more space than the dense matrix, the result stays exact
+        assert H.rank < n
+        assert np.allclose(H.toarray(), dense)
+    assert not H.is_diagonal
+
+    # a limited memory only keeps the last updates and shares the guess
+    H = CompactHessian(H0, memory=2)
+    for dx, dg in steps(n, 10, seed=5):
+        H = H.bfgs_update(dx, dg)
+    assert len(H.updates) == 2 and H.is_diagonal
+
+
+def test_append_in_place():
+    n = 6
+    H = CompactHessian(np.ones(n))
+    shared = H
+    copied = H.copy()
+    dense = np.eye(n)
+    for dx, dg in steps(n, 10, seed=6):
+        terms = bfgs_terms(H.dot(dx), dx, dg)
+        new = H.update(*terms)
+        H.append(*terms)
+        dense += dense_bfgs(dense, dx, dg)
+        assert np.allclose(H.toarray(), new.toarray())
+        assert np.allclose(H.toarray(), dense)
+    # every holder sees the appended updates, a copy doesn't
+    assert shared is H and not H.is_diagonal
+    assert np.array_equal(copied.toarray(), np.eye(n))
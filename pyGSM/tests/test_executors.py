@@ -0,0 +1,20 @@
+import pytest
+
+from pyGSM.utilities.executors import EXECUTORS, get_executor
+
+
+def square(x):
+    return x*x
+
+
+def test_default_is_serial():
+    assert get_executor(None, 4).name == 'serial'
+    with pytest.raises(ValueError):
+        get_executor('gpu', 4)
+
+
+@pytest.mark.parametrize('backend', sorted(EXECUTORS))
+def test_map_keeps_order(backend):
+    with get_executor(backend, 2) as executor:
+        assert executor.name == backend
+        assert executor.map(square, range(10)) == [x*x for x in range(10)]
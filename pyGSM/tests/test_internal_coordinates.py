@@ -0,0 +1,57 @@
+import numpy as np
+
+from pyGSM.coordinate_systems.delocalized_coordinates import DelocalizedInternalCoordinates
+from pyGSM.coordinate_systems.internal_coordinates import InternalCoordinates
+from pyGSM.coordinate_systems.primitive_internals import PrimitiveInternalCoordinates
+from pyGSM.coordinate_systems.topology import Topology
+from pyGSM.utilities import elements, manage_xyz
+
+
+def make_prims(**options):
+    geom = manage_xyz.read_xyzs('pyGSM/data/diels_alder.xyz')[0]
+    ELEMENT_TABLE = elements.ElementData()
+    atoms = [ELEMENT_TABLE.from_symbol(atom) for atom in manage_xyz.get_atoms(geom)]
+    xyz = manage_xyz.xyz_to_np(geom)
+    top = Topology.build_topology(xyz, atoms)
+    prims = PrimitiveInternalCoordinates.from_options(xyz=xyz, atoms=atoms, addtr=True, topology=top, **options)
+    return xyz, atoms, prims
+
+
+def make_dlc(xyz, atoms, prims, **options):
+    return DelocalizedInternalCoordinates.from_options(xyz=xyz, atoms=atoms, addtr=True, primitives=prims, **options)
+
+
+def test_frozen_ginverse():
+    xyz, atoms, prims = make_prims()
+    full = make_dlc(xyz, atoms, prims, ginv_update='full')
+    frozen = make_dlc(xyz, atoms, prims, ginv_update='frozen')
+    dQ = 0.05*np.random.RandomState(0).randn(full.Vecs.shape[1], 1)
+
+    # every micro-iteration factorizes G at the new geometry
+    stats = InternalCoordinates.ginv_stats.copy()
+    ref = full.newCartesian(xyz, dQ, verbose=False)
+    assert InternalCoordinates.ginv_stats['factorized'] - stats['factorized'] > 1
+    assert InternalCoordinates.ginv_stats['reused'] == stats['reused']
+
+    # the frozen G comes from the cache
+    stats = InternalCoordinates.ginv_stats.copy()
+    new = frozen.newCartesian(xyz, dQ, verbose=False)
+    assert InternalCoordinates.ginv_stats['reused'] > stats['reused']
+    assert np.allclose(new, ref, rtol=0., atol=1e-5)
+    assert np.allclose(frozen.calcDiff(new, xyz).flatten(), dQ.flatten(), rtol=0., atol=1e-5)
+
+
+def test_sparse_b():
+    xyz, atoms, dense_prims = make_prims()
+    _, _, sparse_prims = make_prims(sparse_b=True)
+    dense = make_dlc(xyz, atoms, dense_prims)
+    sparse = make_dlc(xyz, atoms, sparse_prims, sparse_b=True)
+    # compare both paths in the same basis
+    sparse.Vecs = dense.Vecs
+
+    gradx = np.random.RandomState(0).randn(xyz.size)
+    assert np.allclose(sparse.calcGrad(xyz, gradx), dense.calcGrad(xyz, gradx), rtol=0., atol=1e-6)
+
+    dQ = 0.05*np.random.RandomState(1).randn(dense.Vecs.shape[1], 1)
+    ref = dense.newCartesian(xyz, dQ, verbose=False)
+    assert np.allclose(sparse.newCartesian(xyz, dQ, verbose=False), ref, rtol=0., atol=1e-5)
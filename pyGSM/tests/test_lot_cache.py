@@ -0,0 +1,93 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from pyGSM.level_of_theories.lot_cache import LotCache
+from pyGSM.level_of_theories.xtb_lot import xTB_lot
+from pyGSM.utilities import manage_xyz
+
+
+def test_round_trip(tmp_path):
+    cache = LotCache(str(tmp_path))
+    xyz = np.random.RandomState(0).randn(5, 3)
+    key = cache.make_key(xyz, ('xTB_lot', 0))
+    assert cache.load(key) is None
+
+    value = ({(1, 0): (-1.5, 'Hartree')}, {(1, 0): (xyz, 'Hartree/Bohr')}, {})
+    cache.store(key, value)
+    energies, gradients, couplings = cache.load(key)
+    assert energies == value[0]
+    assert np.array_equal(gradients[(1, 0)][0], xyz)
+    assert cache.memory_hits == 1 and cache.misses == 1
+
+    # a new instance (another process, a restart) finds it on disk
+    other = LotCache(str(tmp_path))
+    assert other.load(key)[0] == value[0]
+    assert other.disk_hits == 1
+
+    # the key only depends on the coordinates to the rounding and on the signature
+    assert cache.make_key(xyz + 1e-10, ('xTB_lot', 0)) == key
+    assert cache.make_key(xyz, ('xTB_lot', 1)) != key
+
+
+def test_overwrite_counts_once(tmp_path):
+    cache = LotCache(str(tmp_path))
+    for _ in range(3):
+        cache.store('a', np.zeros(100))
+    assert cache.nbytes == os.path.getsize(cache.filename('a'))
+
+
+def test_eviction(tmp_path):
+    data = np.zeros(1000)
+    cache = LotCache(str(tmp_path), max_mb=5*data.nbytes/1024./1024., memory_entries=2)
+    for i in range(10):
+        cache.store(str(i), data)
+        # distinct modification times for the least recently used order
+        os.utime(cache.filename(str(i)), (i, i))
+
+    files = sorted(entry.name for entry in os.scandir(str(tmp_path)) if entry.name.endswith('.pkl'))
+    assert cache.evictions > 0
+    assert cache.nbytes <= cache.max_bytes
+    assert files == ['{}.pkl'.format(i) for i in range(10 - len(files), 10)]
+    assert len(cache.memory) == 2
+    assert cache.load('0') is None
+
+
+def test_threads(tmp_path):
+    cache = LotCache(str(tmp_path), memory_entries=4)
+
+    def work(i):
+        key = str(i % 8)
+        cache.store(key, i % 8)
+        return cache.load(key)
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(work, range(400)))
+    assert results == [i % 8 for i in range(400)]
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith('.tmp')]
+    assert cache.nbytes == sum(os.path.getsize(cache.filename(str(i))) for i in range(8))
+
+
+def test_cache_signature(tmp_path, monkeypatch):
+    geom = manage_xyz.read_xyzs('pyGSM/data/diels_alder.xyz')[0]
+    # the lots make their scratch folders in the working directory
+    monkeypatch.chdir(tmp_path)
+    lot = xTB_lot.from_options(states=[(1, 0)], gradient_states=[(1, 0)], geom=geom)
+    signature = lot.cache_signature()
+    hash(signature)
+
+    # where the results are computed doesn't matter
+    assert xTB_lot.copy(lot, {'node_id': 3, 'ID': 2}).cache_signature() == signature
+    # the options and the job data do
+    assert xTB_lot.copy(lot, {'xTB_accuracy': 0.1}).cache_signature() != signature
+    assert xTB_lot.copy(lot, {'job_data': {'orbfile': 'c0'}}).cache_signature() != signature
+    assert lot.cache_signature('energy') != signature
+
+    # the ASE calculator class and kwargs
+    LennardJones = pytest.importorskip('ase.calculators.lj').LennardJones
+    from pyGSM.level_of_theories.ase import ASELoT
+    ase_lot = ASELoT.from_options(LennardJones(sigma=1.), geom=geom)
+    assert ASELoT.copy(ase_lot, {'node_id': 1}).cache_signature() == ase_lot.cache_signature()
+    assert ASELoT.from_options(LennardJones(sigma=2.), geom=geom).cache_signature() != ase_lot.cache_signature()
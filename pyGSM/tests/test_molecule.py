@@ -0,0 +1,76 @@
+import pickle
+
+import numpy as np
+
+from pyGSM.coordinate_systems.delocalized_coordinates import DelocalizedInternalCoordinates
+from pyGSM.coordinate_systems.primitive_internals import PrimitiveInternalCoordinates, STATELESS_PRIMITIVES
+from pyGSM.coordinate_systems.slots import Distance
+from pyGSM.coordinate_systems.topology import Topology
+from pyGSM.growing_string_methods.gsm import GSM
+from pyGSM.level_of_theories.xtb_lot import xTB_lot
+from pyGSM.molecule.molecule import Molecule
+from pyGSM.potential_energy_surfaces.pes import PES
+from pyGSM.utilities import elements, manage_xyz
+
+
+def make_node(share_primitives=False):
+    geom = manage_xyz.read_xyzs('pyGSM/data/diels_alder.xyz')[0]
+    lot = xTB_lot.from_options(states=[(1, 0)], gradient_states=[0], geom=geom)
+    pes = PES.from_options(lot=lot, multiplicity=1, ad_idx=0)
+    ELEMENT_TABLE = elements.ElementData()
+    atoms = [ELEMENT_TABLE.from_symbol(atom) for atom in manage_xyz.get_atoms(geom)]
+    xyz = manage_xyz.xyz_to_np(geom)
+    top = Topology.build_topology(xyz, atoms)
+    prims = PrimitiveInternalCoordinates.from_options(xyz=xyz, atoms=atoms, addtr=True, topology=top)
+    coord_obj = DelocalizedInternalCoordinates.from_options(xyz=xyz, atoms=atoms, addtr=True, primitives=prims, share_primitives=share_primitives)
+    return Molecule.from_options(geom=geom, PES=pes, coord_obj=coord_obj, Form_Hessian=True)
+
+
+def test_node_hessians_are_independent():
+    node = make_node()
+    copy = Molecule.copy_from_options(node, new_node_id=1)
+    prim_ref = node.Primitive_Hessian.toarray()
+    hess_ref = node.Hessian.copy()
+
+    n = node.Primitive_Hessian.n
+    u = np.random.RandomState(0).randn(n, 1)
+    copy.update_Primitive_Hessian(change=(u, np.eye(1)))
+    copy.update_Hessian((np.eye(len(hess_ref)), np.eye(len(hess_ref))))
+
+    # the copy changed, the node it was copied from did not
+    assert np.allclose(copy.Primitive_Hessian.toarray(), prim_ref + np.dot(u, u.T))
+    assert np.allclose(copy.Hessian, hess_ref + np.eye(len(hess_ref)))
+    assert np.array_equal(node.Primitive_Hessian.toarray(), prim_ref)
+    assert np.array_equal(node.Hessian, hess_ref)
+
+
+def test_pickled_node_reshares_primitives():
+    node = make_node(share_primitives=True)
+    copy = Molecule.copy_from_options(node, new_node_id=1)
+    Prims = copy.coord_obj.Prims
+    assert Prims.topology is node.coord_obj.Prims.topology
+
+    # a process executor sends back a copy of the node
+    returned = pickle.loads(pickle.dumps(copy))
+    assert returned.coord_obj.Prims.topology is not Prims.topology
+    returned.coord_obj.Prims.reshare(Prims)
+    assert returned.coord_obj.Prims.topology is Prims.topology
+    assert returned.coord_obj.Prims.block_info is Prims.block_info
+    for p, q in zip(returned.coord_obj.Prims.Internals, Prims.Internals):
+        assert (p is q) == (type(p) in STATELESS_PRIMITIVES)
+    assert np.allclose(returned.coord_obj.calculate(returned.xyz), copy.coord_obj.calculate(copy.xyz))
+
+
+def test_tangents_use_the_primitives_of_the_second_node():
+    for share_primitives in (False, True):
+        node = make_node(share_primitives)
+        rng = np.random.RandomState(0)
+        nodes = [node] + [Molecule.copy_from_options(node, xyz=node.xyz + 0.05*rng.randn(*node.xyz.shape), new_node_id=n) for n in (1, 2)]
+        # node 1 has an extra primitive
+        assert nodes[1].coord_obj.Prims.add(Distance(0, 9))
+        pairs = [(0, 1), (2, 1), (1, 2)]
+        tangents = GSM.get_tangents_xyz(nodes, pairs)
+        for (i, j), tangent in zip(pairs, tangents):
+            ref, _ = GSM.get_tangent(nodes[i], nodes[j])
+            assert tangent.shape == (nodes[j].num_primitives,)
+            assert np.allclose(tangent, ref.flatten(), rtol=0., atol=1e-10)
@@ -0,0 +1,57 @@
+import networkx as nx
+import numpy as np
+
+from pyGSM.coordinate_systems.neighbor_list import minimum_image, minimum_spanning_edges, neighbor_pairs
+from pyGSM.coordinate_systems.topology import Topology
+from pyGSM.utilities import elements
+
+
+def brute_force_pairs(xyz, cutoff, box=None):
+    i, j = np.triu_indices(len(xyz), 1)
+    dr = np.linalg.norm(minimum_image(xyz[j] - xyz[i], box), axis=1)
+    keep = dr < cutoff
+    return np.column_stack((i[keep], j[keep])), dr[keep]
+
+
+def test_neighbor_pairs():
+    xyz = 10.*np.random.RandomState(0).rand(200, 3)
+    ref, ref_dr = brute_force_pairs(xyz, 1.5)
+    for method in ('kdtree', 'cells'):
+        pairs, dr = neighbor_pairs(xyz, 1.5, method=method)
+        assert np.array_equal(pairs, ref)
+        assert np.allclose(dr, ref_dr)
+
+    # periodic box, and only a subset of the atoms
+    box = [10., 10., 10.]
+    ref, _ = brute_force_pairs(xyz, 2., box)
+    subset = np.arange(0, 200, 3)
+    sub_ref, _ = brute_force_pairs(xyz[subset], 2., box)
+    for method in ('kdtree', 'cells'):
+        assert np.array_equal(neighbor_pairs(xyz, 2., box=box, method=method)[0], ref)
+        assert np.array_equal(neighbor_pairs(xyz, 2., indices=subset, box=box, method=method)[0], subset[sub_ref])
+
+
+def test_minimum_spanning_edges():
+    # three clusters farther apart than the starting cutoff
+    rng = np.random.RandomState(1)
+    xyz = np.vstack([center + rng.rand(10, 3) for center in ([0., 0., 0.], [9., 0., 0.], [0., 20., 0.])])
+    G = nx.Graph()
+    for i in range(len(xyz)):
+        for j in range(i+1, len(xyz)):
+            G.add_edge(i, j, weight=np.linalg.norm(xyz[i] - xyz[j]))
+    ref = sorted(tuple(sorted(edge[:2])) for edge in nx.minimum_spanning_edges(G, data=False))
+    for method in ('kdtree', 'cells'):
+        assert minimum_spanning_edges(xyz, cutoff=4.0, method=method) == ref
+
+
+def test_periodic_topology():
+    ELEMENT_TABLE = elements.ElementData()
+    atoms = [ELEMENT_TABLE.from_symbol(symbol) for symbol in ('C', 'C', 'H')]
+    # the carbons are bonded across the boundary of the box
+    xyz = np.array([[0.3, 5., 5.], [9.5, 5., 5.], [5., 5., 5.]])
+    assert sorted(Topology.build_topology(xyz, atoms).edges()) == []
+    G = Topology.build_topology(xyz, atoms, toppbc=True, box=[10., 10., 10.])
+    assert sorted(tuple(sorted(edge)) for edge in G.edges()) == [(0, 1)]
+    # only the primitive atoms get bonds
+    G = Topology.build_topology(xyz, atoms, hybrid_indices=[1], toppbc=True, box=[10., 10., 10.])
+    assert sorted(G.nodes()) == [0, 2] and not G.edges()
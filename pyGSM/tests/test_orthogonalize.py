@@ -0,0 +1,54 @@
+import numpy as np
+
+from pyGSM.utilities.block_matrix import block_matrix
+from pyGSM.utilities.math_utils import orthogonalize
+
+
+def gram_schmidt(vecs, numCvecs=0):
+    ''' math_utils.orthogonalize before the QR version '''
+    basis = np.zeros((vecs.shape[0], vecs.shape[1]-numCvecs))
+    count = 0
+    for v in vecs.T:
+        w = v - sum(np.dot(v, b)*b for b in basis.T)
+        wnorm = np.linalg.norm(w)
+        if wnorm > 1e-3 and (abs(w) > 1e-6).any():
+            basis[:, count] = w/wnorm
+            count += 1
+    return basis
+
+
+def dlc_block(nprims, ncoords, nconstraints, rng):
+    ''' An orthonormal DLC-like block and constraints in its span, in front of it '''
+    Vecs = np.linalg.qr(rng.randn(nprims, ncoords))[0]
+    C = np.dot(Vecs, rng.randn(ncoords, nconstraints))
+    return Vecs, C/np.linalg.norm(C, axis=0)
+
+
+def test_matches_gram_schmidt():
+    rng = np.random.RandomState(0)
+    for nconstraints in (0, 1, 3):
+        Vecs, C = dlc_block(60, 30, nconstraints, rng)
+        vecs = np.hstack((C, Vecs))
+        basis = orthogonalize(vecs, nconstraints)
+        assert basis.shape == (60, 30)
+        assert np.allclose(basis, gram_schmidt(vecs, nconstraints), rtol=0., atol=1e-12)
+        if nconstraints:
+            # the constraints come first
+            assert np.isclose(abs(np.dot(basis[:, 0], C[:, 0])), 1.)
+
+
+def test_dependent_columns():
+    # dependent and vanishing columns in the middle are dropped as in Gram-Schmidt
+    rng = np.random.RandomState(1)
+    V = rng.randn(20, 6)
+    vecs = np.column_stack((V[:, :3], V[:, 0] + V[:, 1], np.zeros(20), 1e-5*rng.randn(20), V[:, 3:]))
+    basis = orthogonalize(vecs, 3)
+    assert np.allclose(basis, gram_schmidt(vecs, 3), rtol=0., atol=1e-12)
+    assert np.allclose(np.dot(basis.T, basis), np.eye(6))
+
+
+def test_project_constraint():
+    Vecs, C = dlc_block(40, 20, 1, np.random.RandomState(2))
+    projected = block_matrix.project_constraint(block_matrix([Vecs]), C.copy())
+    ref = gram_schmidt(np.hstack((C, Vecs)), 1)
+    assert np.allclose(block_matrix.full_matrix(projected), ref, rtol=0., atol=1e-12)
@@ -0,0 +1,59 @@
+import numpy as np
+
+from pyGSM.level_of_theories.xtb_lot import xTB_lot
+from pyGSM.potential_energy_surfaces.pes import PES
+from pyGSM.utilities import manage_xyz
+from pyGSM.utilities.executors import get_executor
+
+QM_REGION = [0, 1, 2]
+
+
+def make_pes(tmp_path, monkeypatch):
+    geom = manage_xyz.read_xyzs('pyGSM/data/diels_alder.xyz')[0]
+    # the lots write their scratch files to the working directory
+    monkeypatch.chdir(tmp_path)
+    # tight SCF convergence, the finite differences amplify the gradient noise
+    lot = xTB_lot.from_options(states=[(1, 0)], gradient_states=[(1, 0)], geom=geom, node_id=0, xTB_accuracy=1e-3)
+    return PES.from_options(lot=lot, multiplicity=1, ad_idx=0), manage_xyz.xyz_to_np(geom)
+
+
+def test_fd_hessian_process_executor(tmp_path, monkeypatch):
+    pes, xyz = make_pes(tmp_path, monkeypatch)
+    ref = pes.get_finite_difference_hessian(xyz, qm_region=QM_REGION)
+    assert ref.shape == (9, 9)
+    assert np.array_equal(ref, ref.T)
+    with get_executor('process', 2) as executor:
+        hess = pes.get_finite_difference_hessian(xyz, qm_region=QM_REGION, executor=executor)
+    # xTB restarts from the last wavefunction of the process, so the gradients agree to the SCF convergence
+    assert np.allclose(hess, ref, rtol=0., atol=1e-6)
+
+
+def test_fd_hessian_checkpoint_resume(tmp_path, monkeypatch):
+    pes, xyz = make_pes(tmp_path, monkeypatch)
+    checkpoint = str(tmp_path / 'fd_hessian.npz')
+    ref = pes.get_finite_difference_hessian(xyz, qm_region=QM_REGION, two_sided=False,
+                                            checkpoint=checkpoint, checkpoint_every=4)
+
+    # keep the first 4 gradients, as if the run had stopped after the first checkpoint
+    with np.load(checkpoint) as data:
+        saved = dict(data)
+    saved['done'][4:] = False
+    saved['grads'][4:] = 0.
+    with open(checkpoint, 'wb') as f:
+        np.savez(f, **saved)
+
+    computed = []
+    get_gradients_batch = pes.get_gradients_batch
+
+    def counting(xyzs, frozen_atoms=None):
+        computed.extend(xyzs)
+        return get_gradients_batch(xyzs, frozen_atoms)
+    monkeypatch.setattr(pes, 'get_gradients_batch', counting)
+
+    hess = pes.get_finite_difference_hessian(xyz, qm_region=QM_REGION, two_sided=False,
+                                             checkpoint=checkpoint, checkpoint_every=4)
+    # the reference and the 9 displacements, minus the ones in the checkpoint
+    assert len(computed) == 10 - 4
+    assert np.allclose(hess, ref, rtol=0., atol=1e-6)
+    with np.load(checkpoint) as data:
+        assert data['done'].all()
@@ -0,0 +1,75 @@
+import numpy as np
+
+from pyGSM.coordinate_systems.primitive_groups import PrimitiveGroups
+from pyGSM.coordinate_systems.primitive_internals import PrimitiveInternalCoordinates
+from pyGSM.coordinate_systems.slots import CartesianX, CartesianY, CartesianZ, Dihedral, OutOfPlane
+from pyGSM.coordinate_systems.topology import Topology
+from pyGSM.utilities import elements, manage_xyz
+
+
+def make_prims():
+    geom = manage_xyz.read_xyzs('pyGSM/data/diels_alder.xyz')[0]
+    ELEMENT_TABLE = elements.ElementData()
+    atoms = [ELEMENT_TABLE.from_symbol(atom) for atom in manage_xyz.get_atoms(geom)]
+    xyz = manage_xyz.xyz_to_np(geom)
+    top = Topology.build_topology(xyz, atoms)
+    prims = PrimitiveInternalCoordinates.from_options(xyz=xyz, atoms=atoms, addtr=True, topology=top)
+    # rotations are per fragment and only go through the slot methods
+    internals = [p for p in prims.Internals if not type(p).__name__.startswith('Rotation')]
+    # every other primitive type, including the ones the TRIC system doesn't have
+    internals += [CartesianX(0, w=1.), CartesianY(3, w=0.5), CartesianZ(5, w=2.), OutOfPlane(0, 1, 2, 3)]
+    return xyz, internals
+
+
+def test_values_and_derivatives():
+    xyz, prims = make_prims()
+    groups = PrimitiveGroups(prims)
+    types = set(type(p).__name__ for p in prims)
+    assert {'Distance', 'Angle', 'Dihedral', 'OutOfPlane', 'CartesianX', 'TranslationX'} <= types
+
+    assert np.allclose(groups.values(xyz), [p.value(xyz) for p in prims], rtol=0., atol=1e-12)
+    B = np.array([p.derivative(xyz).flatten() for p in prims])
+    assert np.allclose(groups.derivatives(xyz), B, rtol=0., atol=1e-12)
+    assert np.allclose(groups.sparse_derivatives(xyz).toarray(), B, rtol=0., atol=1e-12)
+
+    xyzs = np.array([xyz, xyz + 0.01*np.random.RandomState(0).randn(*xyz.shape)])
+    assert np.allclose(groups.string_values(xyzs), [groups.values(x) for x in xyzs], rtol=0., atol=1e-12)
+
+
+def second_derivative(p, xyz, start_idx=0):
+    ''' The slot's second derivative, the analytic dihedral one for out of plane bends '''
+    if type(p) is OutOfPlane:
+        p = Dihedral(p.a, p.b, p.c, p.d)
+    n = xyz.size
+    return p.second_derivative(xyz, start_idx=start_idx).reshape(n, n)
+
+
+def test_second_derivatives():
+    xyz, prims = make_prims()
+    groups = PrimitiveGroups(prims)
+    ref = np.array([second_derivative(p, xyz) for p in prims])
+    assert np.allclose(groups.second_derivatives(xyz), ref, rtol=0., atol=1e-10)
+
+    # the OutOfPlane slot itself uses a finite difference
+    oop = [i for i, p in enumerate(prims) if type(p) is OutOfPlane]
+    fd = [prims[i].second_derivative(xyz, start_idx=0).reshape(ref.shape[1:]) for i in oop]
+    assert oop and np.allclose(ref[oop], fd, atol=1e-4)
+
+    weights = np.random.RandomState(1).randn(len(prims))
+    weighted = np.einsum('p,pij->ij', weights, ref)
+    assert np.allclose(groups.weighted_second_derivatives(xyz, weights), weighted, rtol=0., atol=1e-10)
+    assert np.allclose(groups.weighted_second_derivatives(xyz, weights, sparse_result=True).toarray(), weighted, rtol=0., atol=1e-10)
+
+
+def test_fragment_block():
+    # a block of atoms that doesn't start at atom 0, as in a multi-fragment system
+    xyz, prims = make_prims()
+    start = 2
+    frag = [p for p in prims if type(p).__name__ in ('Distance', 'Angle', 'Dihedral')
+            and min(getattr(p, name) for name in 'abcd' if hasattr(p, name)) >= start]
+    groups = PrimitiveGroups(frag)
+    sub = xyz[start:]
+    assert np.allclose(groups.derivatives(sub, start_idx=start),
+                       [p.derivative(sub, start_idx=start).flatten() for p in frag], rtol=0., atol=1e-12)
+    assert np.allclose(groups.second_derivatives(sub, start_idx=start),
+                       [second_derivative(p, sub, start_idx=start) for p in frag], rtol=0., atol=1e-10)
@@ -0,0 +1,41 @@
+import numpy as np
+
+from pyGSM.level_of_theories.process_pool_lot import ProcessPoolLot
+from pyGSM.level_of_theories.xtb_lot import xTB_lot
+from pyGSM.utilities import manage_xyz
+
+
+def test_run_batch(tmp_path, monkeypatch):
+    geoms = manage_xyz.read_xyzs('pyGSM/data/diels_alder.xyz')
+    # the lots write their scratch files to the working directory
+    monkeypatch.chdir(tmp_path)
+    reactant = manage_xyz.xyz_to_np(geoms[0])
+    product = manage_xyz.xyz_to_np(geoms[-1])
+    frames = [(1. - t)*reactant + t*product for t in np.linspace(0., 1., 5)]
+    lot = xTB_lot.from_options(states=[(1, 0)], gradient_states=[(1, 0)], geom=geoms[0], node_id=0)
+    ref = []
+    for n, xyz in enumerate(frames):
+        node = xTB_lot.copy(lot, {'node_id': n})
+        node.runall(manage_xyz.np_to_xyz(node.geom, xyz))
+        ref.append(node.Energies[(1, 0)].value)
+
+    pool_lot = ProcessPoolLot.wrap(xTB_lot.copy(lot, {}), 2)
+    pool = pool_lot.pool
+    try:
+        node_ids = [0, 1, 2, 3, 4]
+        results = pool_lot.run_batch(frames, node_ids=node_ids)
+        assert np.allclose([result[0][(1, 0)].value for result in results], ref)
+        # node n is computed by worker n % 2
+        assert [worker.calls for worker in pool.workers] == [3, 2]
+
+        # the same worker computes the node with runall
+        node = ProcessPoolLot.copy(pool_lot, {'node_id': 3})
+        node.runall(manage_xyz.np_to_xyz(node.geom, frames[3]))
+        assert np.isclose(node.Energies[(1, 0)].value, ref[3])
+        assert [worker.calls for worker in pool.workers] == [3, 3]
+
+        # without node ids the geometries are spread over the workers
+        pool_lot.run_batch(frames[:2])
+        assert [worker.calls for worker in pool.workers] == [4, 4]
+    finally:
+        pool.close()
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import numpy as np
+
+from pyGSM.level_of_theories import mock_qm_server
+from pyGSM.level_of_theories.qmserver import QMServer, ServerProcess
+from pyGSM.utilities import manage_xyz, units
+
+
+def test_mock_server(tmp_path, monkeypatch):
+    geom = manage_xyz.read_xyzs('pyGSM/data/diels_alder.xyz')[0]
+    # the lots write their scratch files to the working directory
+    monkeypatch.chdir(tmp_path)
+    job_data = {
+        'server_command': '{} {}'.format(sys.executable, os.path.abspath(mock_qm_server.__file__)),
+        'server_pool_size': 2,
+        'server_scratch': str(tmp_path / 'qm'),
+    }
+    lot = QMServer.from_options(states=[(1, 0), (1, 1)], gradient_states=[(1, 0), (1, 1)], geom=geom, job_data=job_data)
+    other = QMServer.copy(lot, {'node_id': 1})
+    assert other.server is not lot.server
+    servers = [lot.server, other.server]
+    try:
+        xyz = manage_xyz.xyz_to_np(geom)
+        energy, gradient = mock_qm_server.morse(manage_xyz.get_atoms(geom), xyz*units.ANGSTROM_TO_AU)
+        assert np.isclose(lot.get_energy(xyz, 1, 0), energy*units.KCAL_MOL_PER_AU)
+        assert np.isclose(lot.get_energy(xyz, 1, 1), (energy + mock_qm_server.STATE_SHIFT)*units.KCAL_MOL_PER_AU)
+        assert np.allclose(lot.get_gradient(xyz, 1, 0), gradient*units.ANGSTROM_TO_AU)
+
+        # the gradient (Ha/Angstrom) is the derivative of the energy (kcal/mol)
+        step = 1e-4
+        for n in [0, 7, 20]:
+            fwd, bwd = xyz.copy(), xyz.copy()
+            fwd.flat[n] += step
+            bwd.flat[n] -= step
+            fd = (lot.get_energy(fwd, 1, 0) - lot.get_energy(bwd, 1, 0))/(2.*step)*units.KCAL_MOL_TO_AU
+            assert np.isclose(fd, lot.get_gradient(xyz, 1, 0).flat[n], rtol=1e-5, atol=1e-8)
+
+        # the copy starts from the orbitals of the node it was copied from
+        assert np.isclose(other.get_energy(xyz, 1, 0), lot.get_energy(xyz, 1, 0))
+
+        # one start per worker, every call after the first of node 0 is warm
+        assert [server.starts for server in servers] == [1, 1]
+        assert [server.warm_calls for server in servers] == [servers[0].calls - 1, 1]
+        report = ServerProcess.report()
+        for server in servers:
+            assert "{} calls ({} warm)".format(server.calls, server.warm_calls) in report
+        processes = [server.process for server in servers]
+    finally:
+        ServerProcess.close_all()
+
+    # the workers exited and nothing is left running
+    assert not any(server.alive for server in servers)
+    assert all(process.poll() is not None for process in processes)
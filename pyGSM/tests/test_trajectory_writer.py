@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+
+from pyGSM.utilities import manage_xyz
+
+
+def make_geoms(nframes=5, natoms=4):
+    rng = np.random.RandomState(0)
+    atoms = ['C', 'H', 'O', 'N'][:natoms]
+    return [manage_xyz.np_to_xyz([[a, 0., 0., 0.] for a in atoms], rng.randn(natoms, 3)) for _ in range(nframes)]
+
+
+def test_xyz_round_trip(tmp_path):
+    geoms = make_geoms()
+    energies = [0.5*i for i in range(len(geoms))]
+    filename = str(tmp_path / 'opt_0.xyz')
+    with manage_xyz.TrajectoryWriter(filename, flush_every=100) as traj:
+        for i in range(1, len(geoms) + 1):
+            traj.append_new(geoms[:i], energies[:i])
+    assert traj.fh.closed
+
+    with manage_xyz.XYZFrames(filename) as frames:
+        assert len(frames) == len(geoms)
+        assert list(frames.atoms) == manage_xyz.get_atoms(geoms[0])
+        assert [float(frames.comment(k)) for k in range(len(frames))] == energies
+        for k, geom in enumerate(geoms):
+            assert np.allclose(frames.coords(k), manage_xyz.xyz_to_np(geom), atol=1e-6)
+
+    # continuing the file appends to it
+    with manage_xyz.TrajectoryWriter(filename, mode='a') as traj:
+        traj.append(geoms[0], comment=energies[0])
+    assert len(manage_xyz.read_xyzs(filename)) == len(geoms) + 1
+
+
+def test_frame_log_round_trip(tmp_path):
+    geoms = make_geoms()
+    filename = str(tmp_path / ('string' + manage_xyz.FRAME_LOG_EXT))
+    with manage_xyz.TrajectoryWriter(filename) as traj:
+        traj.extend(geoms, range(len(geoms)), [0.1]*len(geoms), [0.]*len(geoms), group=3)
+
+    atoms, frames = manage_xyz.read_frame_log(filename)
+    assert atoms == manage_xyz.get_atoms(geoms[0])
+    assert np.array_equal(frames['group'], [3]*len(geoms))
+    assert np.array_equal(frames['energy'], range(len(geoms)))
+    assert np.array_equal(frames['xyz'], [manage_xyz.xyz_to_np(geom) for geom in geoms])
+
+    outfile = str(tmp_path / 'string.xyz')
+    manage_xyz.export_frame_log(filename, outfile)
+    with manage_xyz.XYZFrames(outfile) as exported:
+        assert len(exported) == len(geoms)
+        assert np.allclose(exported.coords(len(geoms) - 1), manage_xyz.xyz_to_np(geoms[-1]), atol=1e-6)
+    assert os.path.getsize(filename) > 0
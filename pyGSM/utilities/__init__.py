@@ -1,4 +1,4 @@
-__all__ = ['block_matrix','block_tensor','elements','manage_xyz','math_utils','nifty','options','units']
+__all__ = ['block_matrix','block_tensor','compact_hessian','elements','executors','lru_cache','manage_xyz','math_utils','nifty','options','units']
 
 from .block_matrix import block_matrix
 from .block_tensor import block_tensor
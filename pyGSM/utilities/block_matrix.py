@@ -1,4 +1,5 @@
 import numpy as np
+from scipy import sparse
 from scipy.linalg import block_diag
 from .math_utils import orthogonalize, conjugate_orthogonalize
 
@@ -6,6 +7,58 @@ from .math_utils import orthogonalize, conjugate_orthogonalize
 def isblock(obj):
     return hasattr(obj, "matlist")
 
+
+def dense(A):
+    ''' Returns the block as an np.ndarray (blocks may be scipy.sparse matrices) '''
+    if sparse.issparse(A):
+        return A.toarray()
+    return A
+
+
+def _dot(A, B):
+    ''' np.dot for blocks that may be scipy.sparse matrices '''
+    if sparse.issparse(A):
+        return A.dot(B)
+    elif sparse.issparse(B):
+        return B.T.dot(A.T).T
+    return np.dot(A, B)
+
+
+def _pcg(matvec, b, diag, tol=1e-10, maxiter=None):
+    '''
+    Jacobi preconditioned conjugate gradient for A x = b with A symmetric
+    positive (semi-)definite and only available through matvec.
+    Converged when |r| < tol*|b|.
+    '''
+    x = np.zeros_like(b)
+    bnorm = np.linalg.norm(b)
+    if bnorm == 0.:
+        return x
+    if maxiter is None:
+        maxiter = 10*len(b)
+    dinv = np.ones_like(diag)
+    nonzero = np.abs(diag) > 1e-12
+    dinv[nonzero] = 1./diag[nonzero]
+    r = b.copy()
+    z = dinv*r
+    p = z.copy()
+    rz = np.dot(r, z)
+    for it in range(maxiter):
+        Ap = matvec(p)
+        pAp = np.dot(p, Ap)
+        if pAp <= 0.:
+            break
+        alpha = rz/pAp
+        x += alpha*p
+        r -= alpha*Ap
+        if np.linalg.norm(r) < tol*bnorm:
+            break
+        z = dinv*r
+        rz_new = np.dot(r, z)
+        p = z + (rz_new/rz)*p
+        rz = rz_new
+    return x
+
 class block_matrix(object):
 
     def __init__(self, matlist, cnorms=None):
@@ -27,11 +80,43 @@ class block_matrix(object):
 
     @staticmethod
     def full_matrix(A):
-        return block_diag(*A.matlist)
+        return block_diag(*[dense(a) for a in A.matlist])
 
-    @property
-    def num_blocks(self):
-        return len(self.matlist)
+    @staticmethod
+    def is_sparse(A):
+        return any(sparse.issparse(a) for a in A.matlist)
+
+    @staticmethod
+    def todense(A):
+        if not block_matrix.is_sparse(A):
+            return A
+        return block_matrix([dense(a) for a in A.matlist], A.cnorms)
+
+    @staticmethod
+    def solve_normal(B, rhs, tol=1e-10, maxiter=None, direct_max=32):
+        '''
+        Returns (B.B^T)^-1 rhs block by block with conjugate gradient,
+        without forming or inverting G=B.B^T. Each CG step costs two
+        products with the (possibly sparse) blocks of B. Blocks with at most
+        direct_max rows (e.g. single hybrid atoms) are solved directly.
+        '''
+        rhs = np.asarray(rhs, dtype=float).flatten()
+        s = 0
+        result = []
+        for A in B.matlist:
+            e = s + A.shape[0]
+            if A.shape[0] <= direct_max:
+                A = dense(A)
+                result.append(np.linalg.solve(np.dot(A, A.T), rhs[s:e]))
+            else:
+                AT = A.T
+                if sparse.issparse(A):
+                    diag = np.asarray(A.multiply(A).sum(axis=1)).flatten()
+                else:
+                    diag = np.einsum('ij,ij->i', A, A)
+                result.append(_pcg(lambda x: A.dot(AT.dot(x)), rhs[s:e], diag, tol, maxiter))
+            s = e
+        return np.reshape(np.concatenate(result), (-1, 1))
 
     # IDEA: everywhere a dot product of DLC is done, use the conjugate
     # dot product, also use the conjugate_orthogonalize to orthogonalize
@@ -285,7 +370,7 @@ class block_matrix(object):
 
     @staticmethod
     def diagonal(BM):
-        la = [np.diagonal(A) for A in BM.matlist]
+        la = [np.diagonal(dense(A)) for A in BM.matlist]
         return np.concatenate(la)
 
     @staticmethod
@@ -311,7 +396,7 @@ class block_matrix(object):
         eigenvalues = []
         eigenvectors = []
         for block in BM.matlist:
-            e, v = np.linalg.eigh(block)
+            e, v = np.linalg.eigh(dense(block))
             eigenvalues.append(e)
             eigenvectors.append(v)
         return np.concatenate(eigenvalues), block_matrix(eigenvectors)
@@ -387,7 +472,7 @@ class block_matrix(object):
             result = []
             for A in block.matlist:
                 e = s + np.shape(A)[1]
-                result.append(np.dot(A, vec[s:e]))
+                result.append(_dot(A, vec[s:e]))
                 s = e
             return np.reshape(np.concatenate(result), (-1, 1))
 
@@ -399,7 +484,7 @@ class block_matrix(object):
             result = []
             for A in block.matlist:
                 e = s + np.shape(A)[1]
-                result.append(np.dot(vec[s:e], A))
+                result.append(_dot(vec[s:e], A))
                 s = e
             return np.reshape(np.concatenate(result), (-1, 1))
 
@@ -410,7 +495,7 @@ class block_matrix(object):
 
         # (1) both are block matrices
         if isblock(left) and isblock(right):
-            return block_matrix([np.dot(A, B) for A, B in zip(left.matlist, right.matlist)])
+            return block_matrix([_dot(A, B) for A, B in zip(left.matlist, right.matlist)])
         # (2) left is np.ndarray with a vector shape
         elif isinstance(left, np.ndarray) and left.shape[1] == 1 and isblock(right):
             return vec_block_dot(left, right)
@@ -426,7 +511,7 @@ class block_matrix(object):
             tmp_ans = []
             for A in right.matlist:
                 ec = sc+A.shape[0]
-                tmp_ans.append(np.dot(left[:, sc:ec], A))
+                tmp_ans.append(_dot(left[:, sc:ec], A))
                 sc = ec
             dot_product = np.hstack(tmp_ans)
             return dot_product
@@ -439,7 +524,7 @@ class block_matrix(object):
             tmp_ans = []
             for A in left.matlist:
                 ec = sc+A.shape[1]
-                tmp_ans.append(np.dot(A, right[sc:ec, :]))
+                tmp_ans.append(_dot(A, right[sc:ec, :]))
                 sc = ec
             dot_product = np.vstack(tmp_ans)
             return dot_product
@@ -0,0 +1,183 @@
+import numpy as np
+
+from .block_matrix import block_matrix, isblock, dense
+
+
+def bfgs_terms(Hdx, dx, dg):
+    '''
+    BFGS change dg.dg^T/dg^T.dx - Hdx.Hdx^T/dx^T.Hdx as a low-rank pair (U, C),
+    change = U.C.U^T.  Terms with a non-positive denominator are skipped and
+    small denominators are clamped to 0.001.  Returns None for no change.
+    '''
+    dx = np.reshape(dx, -1)
+    dg = np.reshape(dg, -1)
+    Hdx = np.reshape(Hdx, -1)
+    vecs = []
+    coeffs = []
+    dgtdx = np.dot(dg, dx)
+    if dgtdx > 0.:
+        vecs.append(dg)
+        coeffs.append(1./max(dgtdx, 0.001))
+    dxHdx = np.dot(dx, Hdx)
+    if dxHdx > 0.:
+        vecs.append(Hdx)
+        coeffs.append(-1./max(dxHdx, 0.001))
+    if not vecs:
+        return None
+    return np.column_stack(vecs), np.diag(coeffs)
+
+
+def bofill_terms(Gdx, dx, dg):
+    '''
+    Bofill mixture of the Murtagh-Sargent and Powell-symmetric-Broyden
+    changes as a low-rank pair (U, C) in the span of E = dg - G.dx and dx
+    '''
+    dx = np.reshape(dx, -1)
+    E = np.reshape(dg, -1) - np.reshape(Gdx, -1)
+    dxtdx = np.dot(dx, dx)
+    dxtE = np.dot(dx, E)
+    EtE = np.dot(E, E)
+    phi = 1. - dxtE*dxtE/(dxtdx*EtE)
+    C = np.array([
+        [(1.-phi)/dxtE, phi/dxtdx],
+        [phi/dxtdx, -phi*dxtE/(dxtdx*dxtdx)],
+    ])
+    return np.column_stack((E, dx)), C
+
+
+class CompactHessian(object):
+    """ Hessian stored as a guess plus a list of low-rank updates
+
+        H = H0 + sum_k U_k.C_k.U_k^T
+
+    H0 is a diagonal (stored as a vector) or a dense matrix and every
+    quasi-Newton update adds an (n, r) matrix U_k with a small (r, r) core
+    C_k, r=2 for BFGS and Bofill.  Products with H and projections onto a
+    coordinate basis cost O(n*m) for m stored updates, the dense matrix is
+    only formed by toarray.
+
+    With memory > 0 only the last memory updates are kept, as in L-BFGS.
+    With memory = 0 all of them are kept until the updates take as much
+    space as the dense matrix (their total rank reaches n), then they are
+    folded into a dense H0, which is exact.  update returns a new object
+    that shares H0 and the older updates, append adds the update to the
+    object itself.
+    """
+
+    def __init__(self, H0, updates=(), memory=0):
+        H0 = np.asarray(H0, dtype=float)
+        if H0.ndim == 2 and np.count_nonzero(H0) == np.count_nonzero(np.diagonal(H0)):
+            H0 = np.diagonal(H0).copy()
+        self.H0 = H0
+        self.memory = memory
+        self.updates = list(updates)
+        self._trim()
+
+    def _trim(self):
+        if self.memory > 0:
+            del self.updates[:-self.memory]
+        elif self.rank >= self.n:
+            self.H0 = self.toarray()
+            self.updates = []
+
+    @property
+    def n(self):
+        return self.H0.shape[0]
+
+    @property
+    def shape(self):
+        return (self.n, self.n)
+
+    @property
+    def rank(self):
+        ''' Total rank of the stored updates '''
+        return sum(U.shape[1] for U, C in self.updates)
+
+    @property
+    def is_diagonal(self):
+        return self.H0.ndim == 1
+
+    @property
+    def nbytes(self):
+        return self.H0.nbytes + sum(U.nbytes + C.nbytes for U, C in self.updates)
+
+    def copy(self):
+        return CompactHessian(self.H0, self.updates, self.memory)
+
+    def update(self, U, C):
+        ''' Returns H + U.C.U^T '''
+        return CompactHessian(self.H0, self.updates + [(np.reshape(U, (self.n, -1)), np.atleast_2d(C))], self.memory)
+
+    def append(self, U, C):
+        ''' Adds U.C.U^T to H in place, every holder of this object sees the change '''
+        self.updates.append((np.reshape(U, (self.n, -1)), np.atleast_2d(C)))
+        self._trim()
+
+    def bfgs_update(self, dx, dg):
+        terms = bfgs_terms(self.dot(dx), dx, dg)
+        return self.copy() if terms is None else self.update(*terms)
+
+    def bofill_update(self, dx, dg):
+        return self.update(*bofill_terms(self.dot(dx), dx, dg))
+
+    def dot(self, v):
+        ''' H.v for a vector or an (n, k) matrix, same shape as v '''
+        v = np.asarray(v, dtype=float)
+        shape = v.shape
+        v = v.reshape(self.n, -1)
+        if self.is_diagonal:
+            Hv = self.H0[:, None]*v
+        else:
+            Hv = np.dot(self.H0, v)
+        for U, C in self.updates:
+            Hv += np.dot(U, np.dot(C, np.dot(U.T, v)))
+        return Hv.reshape(shape)
+
+    def diagonal(self):
+        diag = self.H0.copy() if self.is_diagonal else np.diagonal(self.H0).copy()
+        for U, C in self.updates:
+            diag += np.einsum('ir,rs,is->i', U, C, U)
+        return diag
+
+    def project(self, V):
+        '''
+        V^T.H.V for a basis V (block_matrix or array), the Hessian in the
+        coordinates of V.  A diagonal guess is projected block by block.
+        '''
+        if not isblock(V):
+            V = np.asarray(V)
+            return np.dot(V.T, self.dot(V))
+
+        if self.is_diagonal:
+            H = np.zeros((V.shape[1], V.shape[1]))
+            sr = 0
+            sc = 0
+            for block in V.matlist:
+                block = dense(block)
+                er = sr + block.shape[0]
+                ec = sc + block.shape[1]
+                H[sc:ec, sc:ec] = np.dot(block.T, self.H0[sr:er, None]*block)
+                sr = er
+                sc = ec
+        else:
+            H = block_matrix.dot(block_matrix.dot(block_matrix.transpose(V), self.H0), V)
+
+        Vt = block_matrix.transpose(V)
+        for U, C in self.updates:
+            W = block_matrix.dot(Vt, U)
+            H += np.dot(W, np.dot(C, W.T))
+        return H
+
+    def toarray(self):
+        H = np.diag(self.H0) if self.is_diagonal else self.H0.copy()
+        for U, C in self.updates:
+            H += np.dot(U, np.dot(C, U.T))
+        return H
+
+    def __array__(self, dtype=None):
+        H = self.toarray()
+        return H if dtype is None else H.astype(dtype)
+
+    def __repr__(self):
+        return "CompactHessian({} x {}, {} guess, {} updates, {:.1f} kB)".format(
+            self.n, self.n, 'diagonal' if self.is_diagonal else 'dense', len(self.updates), self.nbytes/1024.)
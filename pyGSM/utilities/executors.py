@@ -0,0 +1,251 @@
+from __future__ import print_function
+# standard library imports
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+
+# third party
+import numpy as np
+
+# => Node execution backends <= #
+#
+# The executors all expose the same small interface, ``map(func, args)``,
+# which returns ``[func(arg) for arg in args]`` in the order of ``args``.
+# Each node of the string is evaluated by exactly the same code path in every
+# backend so the results are identical to running serially, only the wall
+# time changes.
+#
+#  serial  -- evaluate the nodes one after the other (the historic behaviour)
+#  thread  -- thread pool, good for LoTs that wait on an external QM program
+#  process -- multiprocessing pool, good for in-process LoTs (xTB, ASE, ...).
+#             func and args must be picklable and func must return anything
+#             it modified since the worker only sees a copy.
+
+
+class SerialExecutor(object):
+    """ Evaluates the jobs one after the other in the calling process """
+
+    name = 'serial'
+
+    def __init__(self, ncores=1):
+        self.ncores = 1
+
+    def map(self, func, args):
+        return [func(arg) for arg in args]
+
+    def shutdown(self):
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def __repr__(self):
+        return "{}(ncores={})".format(self.__class__.__name__, self.ncores)
+
+
+class ThreadExecutor(SerialExecutor):
+    """ Evaluates the jobs in a thread pool that lives as long as the executor """
+
+    name = 'thread'
+
+    def __init__(self, ncores=1):
+        self.ncores = max(int(ncores), 1)
+        self._pool = None
+
+    def map(self, func, args):
+        args = list(args)
+        if self.ncores == 1 or len(args) < 2:
+            return [func(arg) for arg in args]
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.ncores)
+        return list(self._pool.map(func, args))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
+
+class ProcessExecutor(ThreadExecutor):
+    """ Evaluates the jobs in a multiprocessing pool that lives as long as the executor """
+
+    name = 'process'
+
+    def map(self, func, args):
+        args = list(args)
+        if self.ncores == 1 or len(args) < 2:
+            return [func(arg) for arg in args]
+        if self._pool is None:
+            self._pool = mp.Pool(self.ncores)
+        return self._pool.map(func, args, chunksize=1)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+# => Reparameterization pool <= #
+#
+# The reparameterizations rebuild the DLC basis of every node along a tangent
+# and move the node along it.  ReparamPool keeps one process pool for the
+# whole run.  The coordinate object (the primitive definitions shared by all
+# the nodes) is handed to the workers once when the pool starts, the node
+# geometries live in a shared memory buffer, so per node only the tangent and
+# the step size are sent and only the new basis comes back.
+
+_reparam_state = {}
+
+
+def _init_reparam_worker(coord_obj, buf, shape):
+    _reparam_state['coord_obj'] = coord_obj
+    _reparam_state['xyz'] = np.frombuffer(buf).reshape(shape)
+
+
+def _reparam_build_dlc(arg):
+    n, tan = arg
+    coord_obj = _reparam_state['coord_obj']
+    xyz = _reparam_state['xyz'][n].copy()
+    coord_obj.clearCache()
+    return coord_obj.build_dlc(xyz, tan)
+
+
+def _reparam_move(arg):
+    n, tan, deltadq, frozen_atoms, verbose = arg
+    Vecs = _reparam_build_dlc((n, tan))
+    coord_obj = _reparam_state['coord_obj']
+    xyz = _reparam_state['xyz'][n].copy()
+    dq = deltadq*Vecs.cnorms[:, 0]
+    _reparam_state['xyz'][n] = coord_obj.newCartesian(xyz, dq, frozen_atoms=frozen_atoms, verbose=verbose)
+    return Vecs
+
+
+class ReparamPool(object):
+    """ Process pool for the DLC basis updates and moves of the string nodes
+
+    The pool is started on first use and restarted only when it is handed a
+    different coordinate object, the primitives of the coordinate object
+    change or the string changes size.
+    """
+
+    def __init__(self, ncores=1):
+        self.ncores = max(int(ncores), 1)
+        self._pool = None
+        self._key = None
+        self._xyz = None
+
+    def _start(self, coord_obj, nodes):
+        natoms = next(node.natoms for node in nodes if node is not None)
+        Prims = getattr(coord_obj, 'Prims', None)
+        key = (id(coord_obj), getattr(Prims, 'basis_token', None), len(nodes), natoms)
+        if self._pool is not None and key == self._key:
+            return
+        self.shutdown()
+        shape = (len(nodes), natoms, 3)
+        buf = mp.RawArray('d', int(np.prod(shape)))
+        self._xyz = np.frombuffer(buf).reshape(shape)
+        self._pool = mp.Pool(self.ncores, initializer=_init_reparam_worker, initargs=(coord_obj, buf, shape))
+        self._key = key
+
+    def _share(self, nodes, indices):
+        for n in indices:
+            self._xyz[n] = nodes[n].xyz
+
+    def update_bases(self, coord_obj, nodes, tasks):
+        '''
+        Rebuild the DLC basis of the nodes along the tangents
+
+        Params:
+            coord_obj - coordinate object whose primitives all the nodes use
+            nodes - the string nodes
+            tasks - list of (node index, tangent)
+        '''
+        if not tasks:
+            return
+        self._start(coord_obj, nodes)
+        self._share(nodes, [n for n, _ in tasks])
+        Vecs = self._pool.map(_reparam_build_dlc, tasks, chunksize=1)
+        for (n, _), V in zip(tasks, Vecs):
+            nodes[n].coord_basis = V
+
+    def move_nodes(self, coord_obj, nodes, tasks, verbose=False):
+        '''
+        Rebuild the DLC basis of the nodes along the tangents and move them
+        deltadq along the constraint
+
+        Params:
+            coord_obj - coordinate object whose primitives all the nodes use
+            nodes - the string nodes
+            tasks - list of (node index, tangent, deltadq)
+        '''
+        if not tasks:
+            return
+        self._start(coord_obj, nodes)
+        self._share(nodes, [n for n, _, _ in tasks])
+        args = [(n, tan, deltadq, nodes[n].frozen_atoms, verbose) for n, tan, deltadq in tasks]
+        Vecs = self._pool.map(_reparam_move, args, chunksize=1)
+        for (n, _, _), V in zip(tasks, Vecs):
+            nodes[n].coord_basis = V
+            nodes[n].xyz = self._xyz[n].copy()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            self._key = None
+            self._xyz = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        state['_key'] = None
+        state['_xyz'] = None
+        return state
+
+    def __repr__(self):
+        return "{}(ncores={})".format(self.__class__.__name__, self.ncores)
+
+
+EXECUTORS = {
+    'serial': SerialExecutor,
+    'thread': ThreadExecutor,
+    'process': ProcessExecutor,
+}
+
+
+def get_executor(backend=None, ncores=1):
+    """ Build a node executor
+
+    Params:
+        backend (str) - one of EXECUTORS. If None, the nodes are optimized
+            serially whatever ncores is, concurrent node optimization has to
+            be asked for since shared in-process calculators may not be
+            thread safe.
+        ncores (int) - number of workers
+
+    Returns:
+        executor object with a map(func,args) method
+
+    """
+
+    if backend is None:
+        backend = 'serial'
+    try:
+        return EXECUTORS[backend](ncores)
+    except KeyError:
+        raise ValueError("Unknown executor backend {}, choose from {}".format(backend, list(EXECUTORS)))
@@ -0,0 +1,152 @@
+from __future__ import print_function
+# standard library imports
+import itertools
+import os
+import threading
+from collections import OrderedDict
+
+# third party
+import numpy as np
+from scipy import sparse
+
+# => Shared coordinate caches <= #
+#
+# The coordinate objects of all the nodes of a string memoize their Wilson
+# B-matrices, G-inverses, DLC bases and the non-redundant spaces the bases
+# are built from (DLCSpace, the G eigenvectors of a geometry) in a few
+# process wide LRU caches that are bounded both in number of entries and in
+# bytes.  The entries of one
+# coordinate object are keyed by its cache token, which is renewed whenever
+# its cached results become stale (e.g. clearCache), so old entries simply
+# age out.
+#
+#   from utilities import lru_cache
+#   lru_cache.get_cache('wilsonB').stats()
+#   print(lru_cache.report())
+
+_token_counter = itertools.count()
+
+
+def new_token():
+    ''' A token that is unique within the run, also across worker processes '''
+    return (os.getpid(), next(_token_counter))
+
+
+def array_key(*arrays):
+    ''' Hashable key for the contents of the arrays, None is allowed '''
+    return tuple(None if a is None else hash(np.asarray(a).tobytes()) for a in arrays)
+
+
+def nbytes(obj):
+    ''' Approximate memory held by arrays, sparse matrices, block matrices and tuples/lists of those '''
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    elif sparse.issparse(obj):
+        obj = obj.tocsr()
+        return obj.data.nbytes + obj.indices.nbytes + obj.indptr.nbytes
+    elif hasattr(obj, 'matlist'):
+        return sum(nbytes(a) for a in obj.matlist) + nbytes(getattr(obj, 'cnorms', None))
+    elif isinstance(obj, (tuple, list)):
+        return sum(nbytes(a) for a in obj)
+    return 0
+
+
+class LRUCache(object):
+    """ Least recently used cache bounded by number of entries and bytes """
+
+    def __init__(self, name, max_entries=1000, max_mb=512.):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb*1024*1024)
+        self.data = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        ''' Returns the stored value or None '''
+        with self.lock:
+            try:
+                value, size = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = nbytes(value)
+        with self.lock:
+            if key in self.data:
+                self.nbytes -= self.data.pop(key)[1]
+            if size > self.max_bytes:
+                return value
+            self.data[key] = (value, size)
+            self.nbytes += size
+            self._trim()
+        return value
+
+    def _trim(self):
+        while self.data and (len(self.data) > self.max_entries or self.nbytes > self.max_bytes):
+            key, (value, size) = self.data.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+
+    def resize(self, max_entries=None, max_mb=None):
+        with self.lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_mb is not None:
+                self.max_bytes = int(max_mb*1024*1024)
+            self._trim()
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        return {
+            'entries': len(self.data),
+            'MB': self.nbytes/1024./1024.,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def __repr__(self):
+        return "LRUCache({}: {} entries, {:.1f}/{:.1f} MB, {} hits, {} misses, {} evictions)".format(
+            self.name, len(self.data), self.nbytes/1024./1024., self.max_bytes/1024./1024., self.hits, self.misses, self.evictions)
+
+
+# default bounds of the named caches
+DEFAULT_LIMITS = {
+    'wilsonB': (2000, 512.),
+    'GInverse': (1000, 256.),
+    'Vecs': (500, 256.),
+    'DLCSpace': (500, 256.),
+}
+
+caches = OrderedDict()
+
+
+def get_cache(name):
+    ''' Returns the shared cache called name, creating it on first use '''
+    if name not in caches:
+        max_entries, max_mb = DEFAULT_LIMITS.get(name, (1000, 256.))
+        caches[name] = LRUCache(name, max_entries, max_mb)
+    return caches[name]
+
+
+def report():
+    return '\n'.join(repr(get_cache(name)) for name in DEFAULT_LIMITS)
+
+
+for _name in DEFAULT_LIMITS:
+    get_cache(_name)
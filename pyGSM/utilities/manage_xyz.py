@@ -1,3 +1,9 @@
+import json
+import mmap
+import os
+import time
+from collections.abc import Sequence
+
 import numpy as np
 
 try:
@@ -5,9 +11,86 @@ try:
 except:
     import units
 
-import re
 #import openbabel as ob
 
+# => Geometry <= #
+
+def is_geometry(geom):
+    ''' is_geometry(geom), also for a Geometry of this module imported as pyGSM.utilities.manage_xyz '''
+    return getattr(type(geom), 'is_geometry', False) is True
+
+
+class Geometry(Sequence):
+    """ A geometry as a tuple of atom symbols and an (natoms,3) float64 coordinate array
+
+    This is the array-native form of the [(symbol,x,y,z),...] lists used
+    for geometries throughout pyGSM and it can be used wherever those are:
+    len, indexing and iteration give the same (symbol,x,y,z) tuples, and
+    it compares equal to the equivalent list.  The atom tuple is shared
+    between all geometries made from one another (with_xyz, np_to_xyz), so
+    a new geometry only costs its coordinate array.  The coordinates are a
+    read-only array, xyz_to_np returns a writable copy.
+    """
+
+    __slots__ = ('atoms', 'xyz')
+    is_geometry = True
+
+    def __init__(self, atoms, xyz, copy=True):
+        self.atoms = atoms if isinstance(atoms, tuple) else tuple(atoms)
+        xyz = np.array(xyz, dtype=float) if copy else np.asarray(xyz, dtype=float).view()
+        xyz = xyz.reshape(-1, 3)
+        xyz.flags.writeable = False
+        if len(xyz) != len(self.atoms):
+            raise ValueError('{} atoms but {} coordinates'.format(len(self.atoms), len(xyz)))
+        self.xyz = xyz
+
+    @classmethod
+    def from_geom(cls, geom):
+        ''' Geometry of a [(symbol,x,y,z),...] list, geometries are returned as they are '''
+        if is_geometry(geom):
+            return geom
+        return cls([atom[0] for atom in geom], [atom[1:4] for atom in geom])
+
+    def with_xyz(self, xyz):
+        ''' New geometry with the same atoms '''
+        return Geometry(self.atoms, xyz)
+
+    def tolist(self):
+        ''' The [(symbol,x,y,z),...] list '''
+        return [(atom,) + tuple(row) for atom, row in zip(self.atoms, self.xyz.tolist())]
+
+    def __len__(self):
+        return len(self.atoms)
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return Geometry(self.atoms[i], self.xyz[i], copy=False)
+        return (self.atoms[i],) + tuple(self.xyz[i].tolist())
+
+    def __eq__(self, other):
+        if is_geometry(other):
+            return self.atoms == other.atoms and np.array_equal(self.xyz, other.xyz)
+        try:
+            return self.tolist() == [tuple(atom) for atom in other]
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (Geometry, (self.atoms, self.xyz, False))
+
+    def __repr__(self):
+        return 'Geometry({!r})'.format(self.tolist())
+
+
 # => XYZ File Utility <= #
 
 
@@ -20,22 +103,21 @@ def read_xyz(
         filename (str) - name of xyz file to read
 
     Returns:
-        geom ((natoms,4) np.ndarray) - system geometry (atom symbol, x,y,z)
+        geom (Geometry) - system geometry (atom symbol, x,y,z)
 
     """
 
-    lines = open(filename).readlines()
-    lines = lines[2:]
-    geom = []
-    for line in lines:
-        mobj = re.match(r'^\s*(\S+)\s+(\S+)\s+(\S+)\s+(\S+)\s*$', line)
-        geom.append((
-            mobj.group(1),
-            scale*float(mobj.group(2)),
-            scale*float(mobj.group(3)),
-            scale*float(mobj.group(4)),
-        ))
-    return geom
+    with open(filename, 'rb') as f:
+        header = f.readline()
+        f.readline()
+        lines = f.read().splitlines()
+    try:
+        # first frame of a multi-frame file
+        lines = lines[:int(header)]
+    except ValueError:
+        pass
+    atoms, xyz = _parse_atom_lines(b'\n'.join(lines))
+    return _to_geom([atom.decode() for atom in atoms], scale*xyz)
 
 
 def read_xyzs(
@@ -48,31 +130,12 @@ def read_xyzs(
         filename (str) - name of xyz file to read
 
     Returns:
-        geom ((natoms,4) np.ndarray) - system geometry (atom symbol, x,y,z)
+        geoms (list of Geometry) - system geometry (atom symbol, x,y,z) of each frame
 
     """
 
-    lines = open(filename).readlines()
-    natoms = int(lines[0])
-    total_lines = len(lines)
-    num_geoms = total_lines/(natoms+2)
-
-    geoms = []
-    sa = 2
-    for i in range(int(num_geoms)):
-        ea = sa+natoms
-        geom = []
-        for line in lines[sa:ea]:
-            mobj = re.match(r'^\s*(\S+)\s+(\S+)\s+(\S+)\s+(\S+)\s*$', line)
-            geom.append((
-                mobj.group(1),
-                scale*float(mobj.group(2)),
-                scale*float(mobj.group(3)),
-                scale*float(mobj.group(4)),
-            ))
-        sa = ea+2
-        geoms.append(geom)
-    return geoms
+    with XYZFrames(filename) as frames:
+        return frames.geoms(scale=scale)
 
 
 def read_molden_geoms(
@@ -80,74 +143,184 @@ def read_molden_geoms(
     scale=1.
 ):
 
-    lines = open(filename).readlines()
-    natoms = int(lines[2])
-    nlines = len(lines)
-
-    # this is for three blocks after GEOCON
-    num_geoms = (nlines-6) / (natoms+5)
-    num_geoms = int(num_geoms)
-    print(num_geoms)
-    geoms = []
-
-    sa = 4
-    for i in range(int(num_geoms)):
-        ea = sa+natoms
-        geom = []
-        for line in lines[sa:ea]:
-            mobj = re.match(r'^\s*(\S+)\s+(\S+)\s+(\S+)\s+(\S+)\s*$', line)
-            geom.append((
-                mobj.group(1),
-                scale*float(mobj.group(2)),
-                scale*float(mobj.group(3)),
-                scale*float(mobj.group(4)),
-            ))
-        sa = ea+2
-        geoms.append(geom)
-    return geoms
+    with XYZFrames(filename) as frames:
+        return frames.geoms(scale=scale)
 
 
 def read_molden_Energy(
         filename,
 ):
-    with open(filename) as f:
-        nlines = sum(1 for _ in f)
-    # print "number of lines is ", nlines
-    with open(filename) as f:
-        natoms = int(f.readlines()[2])
-
-    # print "number of atoms is ",natoms
-    nstructs = (nlines-6) / (natoms+5)  # this is for three blocks after GEOCON
-    nstructs = int(nstructs)
-
-    # print "number of structures in restart file is %i" % nstructs
-    coords = []
-    E = [0.]*nstructs
-    grmss = []
-    atomic_symbols = []
-    dE = []
-    with open(filename) as f:
-        f.readline()
-        f.readline()  # header lines
-        # get coords
-        for struct in range(nstructs):
-            tmpcoords = np.zeros((natoms, 3))
-            f.readline()  # natoms
-            f.readline()  # space
-            for a in range(natoms):
-                line = f.readline()
-                tmp = line.split()
-                tmpcoords[a, :] = [float(i) for i in tmp[1:]]
-                if struct == 0:
-                    atomic_symbols.append(tmp[0])
-        coords.append(tmpcoords)
-        # Get energies
-        f.readline()  # line
-        f.readline()  # energy
-        for struct in range(nstructs):
-            E[struct] = float(f.readline())
-
-    return E
+    with XYZFrames(filename) as frames:
+        return frames.geoconv('energy')
+
+
+# => Indexed multi-frame reader <= #
+
+def _parse_atom_lines(text, natoms=None):
+    """ Symbols and (natoms,3) coordinates of 'symbol x y z' lines (bytes) """
+    tokens = text.split()
+    if natoms is None:
+        natoms = sum(1 for line in text.splitlines() if line.strip())
+    if len(tokens) != 4*natoms:
+        # extra columns
+        tokens = [token for line in text.splitlines() if line.strip() for token in line.split()[:4]][:4*natoms]
+    xyz = np.empty((natoms, 3))
+    for i in range(3):
+        xyz[:, i] = list(map(float, tokens[i+1::4]))
+    return tokens[0::4], xyz
+
+
+def _to_geom(atoms, xyz):
+    return Geometry(atoms, xyz, copy=False)
+
+
+class XYZFrames(object):
+    """ Random access to the frames of a multi-frame xyz or molden file
+
+    The file is memory-mapped and its line offsets are indexed lazily in
+    chunks, so reading frame k only touches the file up to frame k (the
+    number of frames, negative indices and the molden [GEOCONV] block need the
+    whole index).  Frames are parsed in bulk into float arrays:
+
+        with XYZFrames('opt_converged_000.xyz') as frames:
+            atoms = frames.atoms
+            xyz = frames.coords(-1)          # (natoms,3)
+            string = frames.frames()         # (nframes,natoms,3)
+            geoms = frames.geoms()           # [(symbol,x,y,z),...] per frame
+
+    All frames are assumed to have the same atoms.
+    """
+
+    def __init__(self, filename, chunk_mb=4.):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self.buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self.chunk = int(chunk_mb*1024*1024)
+        self._starts = np.zeros(1, dtype=np.int64)
+        self._scanned = 0
+
+        # molden files have a [Molden Format] and a [Geometries] line before the first frame
+        self.molden = self.line(0).strip().startswith(b'[')
+        self.first = 2 if self.molden else 0
+        self.natoms = int(self.line(self.first))
+        self.frame_lines = self.natoms + 2
+        self._nframes = None
+        self._atoms = None
+
+    # => line index <= #
+
+    def _scan(self, nlines):
+        ''' Index the line starts until nlines are known or the file ends '''
+        while len(self._starts) <= nlines and self._scanned < self.size:
+            count = min(self.chunk, self.size - self._scanned)
+            block = np.frombuffer(self.buf, dtype=np.uint8, count=count, offset=self._scanned)
+            newlines = np.flatnonzero(block == 10) + self._scanned + 1
+            self._starts = np.concatenate((self._starts, newlines))
+            self._scanned += count
+            if self._scanned == self.size and self._starts[-1] != self.size:
+                # last line without a newline
+                self._starts = np.append(self._starts, self.size)
+
+    @property
+    def nlines(self):
+        self._scan(np.inf)
+        return len(self._starts) - 1
+
+    def _offset(self, i):
+        self._scan(i)
+        if i >= len(self._starts):
+            raise IndexError('{} has only {} lines'.format(self.filename, self.nlines))
+        return int(self._starts[i])
+
+    def line(self, i):
+        return self.buf[self._offset(i):self._offset(i+1)]
+
+    # => frames <= #
+
+    def __len__(self):
+        if self._nframes is None:
+            nlines = self.nlines
+            if self.molden:
+                # the geometries end at the next [section]
+                starts = self._starts[self.first:nlines]
+                first_chars = np.frombuffer(self.buf, dtype=np.uint8)[starts]
+                sections = np.flatnonzero(first_chars == ord('['))
+                if len(sections):
+                    nlines = self.first + sections[0]
+            self._nframes = int((nlines - self.first) // self.frame_lines)
+        return self._nframes
+
+    def _frame_index(self, k):
+        if k < 0:
+            k += len(self)
+        if k < 0 or (self._nframes is not None and k >= self._nframes):
+            raise IndexError('frame {} out of range for {}'.format(k, self.filename))
+        return k
+
+    def _atom_lines(self, k):
+        first_line = self.first + self._frame_index(k)*self.frame_lines + 2
+        return self.buf[self._offset(first_line):self._offset(first_line + self.natoms)]
+
+    @property
+    def atoms(self):
+        if self._atoms is None:
+            self._atoms = tuple(atom.decode() for atom in _parse_atom_lines(self._atom_lines(0), self.natoms)[0])
+        return self._atoms
+
+    def comment(self, k):
+        return self.line(self.first + self._frame_index(k)*self.frame_lines + 1).decode().strip()
+
+    def coords(self, k):
+        ''' (natoms,3) coordinates of frame k '''
+        return _parse_atom_lines(self._atom_lines(k), self.natoms)[1]
+
+    def frames(self, indices=None):
+        ''' (nframes,natoms,3) coordinates of the frames in indices (default all), parsed in one go '''
+        if indices is None:
+            indices = range(len(self))
+        indices = list(indices)
+        text = b'\n'.join(self._atom_lines(k) for k in indices)
+        return _parse_atom_lines(text, len(indices)*self.natoms)[1].reshape(len(indices), self.natoms, 3)
+
+    def geom(self, k, scale=1.):
+        ''' Frame k as a geometry [(symbol,x,y,z),...] '''
+        return _to_geom(self.atoms, scale*self.coords(k))
+
+    def geoms(self, indices=None, scale=1.):
+        return [_to_geom(self.atoms, scale*xyz) for xyz in self.frames(indices)]
+
+    def geoconv(self, key='energy'):
+        ''' A column of the molden [GEOCONV] block (energy, max-force or max-step) '''
+        nframes = len(self)
+        i = self.first + nframes*self.frame_lines
+        while i < self.nlines and self.line(i).strip().decode() != key:
+            i += 1
+        if i >= self.nlines:
+            raise ValueError("no '{}' block in {}".format(key, self.filename))
+        return [float(self.line(i+1+j)) for j in range(nframes)]
+
+    def close(self):
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_xyz_frames(filename, indices=None, scale=1.):
+    """ Read the frames of a multi-frame xyz or molden file in bulk
+
+    Returns:
+        atoms (list) - atom symbols
+        xyz ((nframes,natoms,3) np.ndarray) - coordinates of the frames in indices (default all)
+    """
+    with XYZFrames(filename) as frames:
+        return list(frames.atoms), scale*frames.frames(indices)
 
 
 def write_molden_geoms(
@@ -186,6 +359,9 @@ def get_atoms(
         geom,
 ):
 
+    if is_geometry(geom):
+        return list(geom.atoms)
+
     atoms = []
     for atom in geom:
         atoms.append(atom[0])
@@ -323,6 +499,9 @@ def xyz_to_np(
 
     """
 
+    if is_geometry(geom):
+        return np.array(geom.xyz)
+
     xyz2 = np.zeros((len(geom), 3))
     for A, atom in enumerate(geom):
         xyz2[A, 0] = atom[1]
@@ -343,20 +522,14 @@ def np_to_xyz(
         xyz2 ((natoms,3) np.ndarray) - system geometry (x,y,z)
 
     Returns:
-        geom2 ((natoms,4) np.ndarray) - new system geometry
+        geom2 (Geometry) - new system geometry
             (atom symbol, x,y,z)
 
     """
 
-    geom2 = []
-    for A, atom in enumerate(geom):
-        geom2.append((
-            atom[0],
-            xyz2[A, 0],
-            xyz2[A, 1],
-            xyz2[A, 2],
-        ))
-    return geom2
+    if is_geometry(geom):
+        return geom.with_xyz(xyz2)
+    return Geometry(get_atoms(geom), xyz2)
 
 
 def combine_atom_xyz(
@@ -369,19 +542,11 @@ def combine_atom_xyz(
         geom ((natoms,3) np.ndarray) - system geometry (atom symbol, x,y,z)
 
     Returns:
-        geom2 ((natoms,4) np.ndarray) - new system geometry
+        geom2 (Geometry) - new system geometry
             (atom symbol, x,y,z)
 
     """
-    geom2 = []
-    for A, atom in enumerate(atoms):
-        geom2.append((
-            atom,
-            xyz[A, 0],
-            xyz[A, 1],
-            xyz[A, 2],
-        ))
-    return geom2
+    return Geometry(atoms, xyz)
 
 
 def write_fms90(
@@ -419,6 +584,158 @@ def write_fms90(
             ))
 
 
+# => Streaming trajectories <= #
+
+# Binary frame log: a header followed by fixed size frame records, so frames
+# can be appended without touching the rest of the file and read back with a
+# single np.frombuffer.
+FRAME_LOG_EXT = '.frames'
+FRAME_LOG_MAGIC = b'PYGSMFRM'
+FRAME_LOG_VERSION = 1
+
+
+def frame_dtype(natoms):
+    """ Record of one frame in a frame log, group is e.g. the GSM iteration """
+    return np.dtype([
+        ('group', '<i4'),
+        ('energy', '<f8'),
+        ('gradrms', '<f8'),
+        ('dE', '<f8'),
+        ('xyz', '<f8', (natoms, 3)),
+    ])
+
+
+def _read_frame_log_header(f):
+    if f.read(len(FRAME_LOG_MAGIC)) != FRAME_LOG_MAGIC:
+        raise IOError("{} is not a frame log".format(f.name))
+    version, natoms, nbytes = np.frombuffer(f.read(12), dtype='<u4')
+    if version != FRAME_LOG_VERSION:
+        raise IOError("unsupported frame log version {} in {}".format(version, f.name))
+    atoms = json.loads(f.read(int(nbytes)).decode())
+    return atoms
+
+
+class TrajectoryWriter(object):
+    """ Append-only trajectory file that stays open between frames
+
+    Frames are appended to the open file instead of rewriting the whole
+    trajectory for every new frame, and the file is only flushed every
+    flush_every frames or flush_interval seconds (and on flush/close).
+    Filenames ending in FRAME_LOG_EXT are written as binary frame logs (see
+    read_frame_log and export_frame_log), anything else as multi-frame xyz.
+
+    The file is opened (truncated with mode='w', continued with mode='a')
+    when the first frame is written.
+    """
+
+    def __init__(self, filename, atoms=None, mode='w', flush_every=10, flush_interval=10.):
+        self.filename = filename
+        self.binary = filename.endswith(FRAME_LOG_EXT)
+        self.atoms = list(atoms) if atoms is not None else None
+        self.mode = mode
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.nframes = 0
+        self.unflushed = 0
+        self.last_flush = time.time()
+        self.fh = None
+        self.header_written = False
+
+    def _open(self):
+        if self.binary and self.mode == 'a' and os.path.exists(self.filename) and os.path.getsize(self.filename) > 0:
+            with open(self.filename, 'rb') as f:
+                self.atoms = _read_frame_log_header(f)
+            self.header_written = True
+        self.fh = open(self.filename, self.mode + ('b' if self.binary else ''))
+
+    def append(self, geom, comment='', energy=0., gradrms=0., dE=0., group=0):
+        """ Append one frame, geom is a list of (atom symbol, x, y, z) """
+        if self.fh is None:
+            self._open()
+        if self.binary:
+            if not self.header_written:
+                self._write_header(get_atoms(geom) if self.atoms is None else self.atoms)
+            record = np.zeros(1, dtype=frame_dtype(len(self.atoms)))
+            record['group'] = group
+            record['energy'] = energy
+            record['gradrms'] = gradrms
+            record['dE'] = dE
+            record['xyz'][0] = xyz_to_np(geom)
+            self.fh.write(record.tobytes())
+        else:
+            lines = ['%d\n' % len(geom), '%s\n' % comment]
+            for atom in geom:
+                lines.append('%-2s %14.6f %14.6f %14.6f\n' % (atom[0], atom[1], atom[2], atom[3]))
+            self.fh.write(''.join(lines))
+        self.nframes += 1
+        self.unflushed += 1
+        if self.unflushed >= self.flush_every or time.time() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def extend(self, geoms, energies, gradrms, dEs, group=0):
+        """ Append a set of frames, e.g. all the nodes of a string, with the xyz_writer arguments """
+        for geom, energy, grms, dE in zip(geoms, energies, gradrms, dEs):
+            self.append(geom, comment=energy, energy=energy, gradrms=grms, dE=dE, group=group)
+
+    def append_new(self, geoms, comments):
+        """ Append the frames of geoms that have not been written yet, for callers keeping the full list """
+        for geom, comment in zip(geoms[self.nframes:], comments[self.nframes:]):
+            self.append(geom, comment=comment, energy=comment)
+
+    def _write_header(self, atoms):
+        self.atoms = list(atoms)
+        atoms_json = json.dumps(self.atoms).encode()
+        self.fh.write(FRAME_LOG_MAGIC)
+        self.fh.write(np.array([FRAME_LOG_VERSION, len(self.atoms), len(atoms_json)], dtype='<u4').tobytes())
+        self.fh.write(atoms_json)
+        self.header_written = True
+
+    def flush(self):
+        if self.fh is not None:
+            self.fh.flush()
+        self.unflushed = 0
+        self.last_flush = time.time()
+
+    def close(self):
+        if self.fh is not None and not self.fh.closed:
+            self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_frame_log(filename):
+    """ Read a binary frame log
+
+    Returns:
+        atoms (list of str), frames (np.ndarray with fields group, energy, gradrms, dE, xyz)
+        A truncated last frame (e.g. from a run that is still writing) is skipped.
+    """
+    with open(filename, 'rb') as f:
+        atoms = _read_frame_log_header(f)
+        data = f.read()
+    dtype = frame_dtype(len(atoms))
+    return atoms, np.frombuffer(data, dtype=dtype, count=len(data)//dtype.itemsize)
+
+
+def export_frame_log(filename, outfile, group=-1, writer=None):
+    """ Write the frames of one group of a frame log (default the last one) with an XYZ_WRITERS function, None exports all frames as xyz """
+    atoms, frames = read_frame_log(filename)
+    if writer is None:
+        with TrajectoryWriter(outfile) as traj:
+            for frame in frames:
+                traj.append(combine_atom_xyz(atoms, frame['xyz']), comment=frame['energy'])
+        return
+    if group == -1 and len(frames):
+        group = frames['group'][-1]
+    frames = frames[frames['group'] == group]
+    geoms = [combine_atom_xyz(atoms, xyz) for xyz in frames['xyz']]
+    writer(outfile, geoms, list(frames['energy']), list(frames['gradrms']), list(frames['dE']))
+
+
 XYZ_WRITERS = {
     'molden': write_molden_geoms,
     'multixyz': write_std_multixyz,
@@ -181,33 +181,44 @@ def conjugate_orthogonalize(vecs, G, numCvecs=0):
 
 # TODO cVecs can be orthonormalized first to make it less confusing
 # since they are being added to basis before being technically orthonormal
-def orthogonalize(vecs, numCvecs=0):
+def orthogonalize(vecs, numCvecs=0, thresh=1e-3):
     """
+    Orthonormalize the columns of vecs in order (Gram-Schmidt semantics):
+    a column is kept if its component orthogonal to the columns kept so far
+    has a norm larger than thresh, otherwise it is dropped.  The result has
+    cols-numCvecs columns, i.e. numCvecs of the columns are expected to be
+    dependent, e.g. constraint vectors put in front of a DLC block.
+
+    Uses Householder QR, refactorizing the remaining columns after each dropped one.
     """
 
-    # print("in orthogonalize")
     rows = vecs.shape[0]
     cols = vecs.shape[1]
     basis = np.zeros((rows, cols-numCvecs))
 
-    # for i in range(numCvecs):  # orthogonalize with respect to these
-    #    basis[:,i]= vecs[:,i]
-
-    # count=numCvecs-1
     count = 0
-    for v in vecs.T:
-        w = v - np.sum(np.dot(v, b)*b for b in basis.T)
-        wnorm = np.linalg.norm(w)
-        # print("wnorm {} count {}".format(wnorm,count))
-        if wnorm > 1e-3 and (abs(w) > 1e-6).any():
-            try:
-                basis[:, count] = w/wnorm
-                count += 1
-            except:
-                print("this vector should be vanishing, exiting")
-                print("norm=", wnorm)
-                # print(w)
-                exit(1)
+    rest = np.array(vecs, dtype=float)
+    while rest.shape[1] > 0:
+        if count > 0:
+            kept = basis[:, :count]
+            rest = rest - np.dot(kept, np.dot(kept.T, rest))
+        Q, R = np.linalg.qr(rest)
+        diag = R.diagonal()
+        # the residual of column k is Q[:,k]*R[k,k]
+        small = (np.abs(diag) <= thresh) | ~(np.abs(Q*diag) > 1e-6).any(axis=0)
+        nkeep = np.argmax(small) if small.any() else len(diag)
+        if count + nkeep > basis.shape[1]:
+            print("this vector should be vanishing, exiting")
+            print("norm=", abs(diag[basis.shape[1]-count]))
+            exit(1)
+        # same signs as Gram-Schmidt
+        basis[:, count:count+nkeep] = Q[:, :nkeep]*np.sign(diag[:nkeep])
+        count += nkeep
+        if not small.any():
+            # anything left over is in the span of a complete basis
+            break
+        rest = rest[:, nkeep+1:]
+
     dots = np.matmul(basis.T, basis)
     if not (np.allclose(dots, np.eye(dots.shape[0], dtype=float), atol=1e-4)):
         print("np.dot(b.T,b)")
@@ -215,3 +226,61 @@ def orthogonalize(vecs, numCvecs=0):
         print(dots - np.eye(dots.shape[0], dtype=float))
         raise RuntimeError("error in orthonormality")
     return basis
+
+
+def davidson_lowest(matvec, v0, H0=None, max_iter=6, tol=1e-3, verbose=True):
+    """
+    Lowest eigenpair of a symmetric matrix A that is only known through
+    matrix-vector products, e.g. finite difference Hessian products.
+
+    Params:
+        matvec - function mapping an (n,1) vector v to A v
+        v0 ((n,) or (n,1) np.ndarray) - starting guess
+        H0 ((n,n) np.ndarray) - model of A used to precondition the
+            corrections (Olsen's variant so H0 may equal A), None for none
+        max_iter (int) - maximum number of products
+        tol (float) - convergence threshold on the residual norm
+
+    Returns:
+        theta (float) - eigenvalue estimate
+        u ((n,1) np.ndarray) - normalized eigenvector estimate
+        nprod (int) - number of products used
+
+    """
+    n = len(v0)
+    V = np.reshape(v0, (-1, 1))/np.linalg.norm(v0)
+    AV = np.reshape(matvec(V), (-1, 1))
+    if H0 is not None:
+        h0, U0 = np.linalg.eigh(0.5*(H0 + H0.T))
+
+    for it in range(1, max_iter+1):
+        T = np.dot(V.T, AV)
+        theta, s = np.linalg.eigh(0.5*(T + T.T))
+        theta, s = theta[0], s[:, [0]]
+        u = np.dot(V, s)
+        r = np.dot(AV, s) - theta*u
+        rnorm = np.linalg.norm(r)
+        if verbose:
+            print(" Davidson {:2d}: eigenvalue {:1.5f} residual {:1.5f}".format(it, theta, rnorm))
+        if rnorm < tol or it == max_iter or V.shape[1] == n:
+            break
+
+        # correction t = -M^-1 (r - eps u) with M = H0 - theta, orthogonal to u
+        if H0 is not None:
+            denom = h0 - theta
+            denom = np.where(np.abs(denom) < 1e-3, np.copysign(1e-3, denom), denom)
+            Mr = np.dot(U0, np.dot(U0.T, r)/denom[:, None])
+            Mu = np.dot(U0, np.dot(U0.T, u)/denom[:, None])
+            t = -(Mr - (np.dot(u.T, Mr)/np.dot(u.T, Mu))*Mu)
+        else:
+            t = -r
+        for _ in range(2):
+            t -= np.dot(V, np.dot(V.T, t))
+        tnorm = np.linalg.norm(t)
+        if tnorm < 1e-8:
+            break
+        t /= tnorm
+        V = np.hstack((V, t))
+        AV = np.hstack((AV, np.reshape(matvec(t), (-1, 1))))
+
+    return theta, u, V.shape[1]
@@ -1698,6 +1698,42 @@ def concurrent_map(func, data):
     return result
 
 
+def sizeof(obj, seen=None):
+    """
+    Approximate number of bytes held by obj and everything it references.
+    Objects whose id is in seen are not counted (again), pass the same set
+    to several calls to count objects shared between them only once.
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, (type, type(sys), type(sizeof), type(len))):
+            continue
+        seen.add(id(o))
+        if isinstance(o, np.ndarray):
+            total += o.nbytes if o.base is None else 0
+            if o.base is not None:
+                stack.append(o.base)
+            continue
+        total += sys.getsizeof(o, 0)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        if hasattr(o, '__dict__'):
+            stack.append(o.__dict__)
+        for cls in type(o).__mro__:
+            slots = getattr(cls, '__slots__', ())
+            for slot in ([slots] if isinstance(slots, str) else slots):
+                if hasattr(o, slot):
+                    stack.append(getattr(o, slot))
+    return total
+
+
 # ob utils
 ELEMENT_TABLE = elements.ElementData()
 